@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmarks of the simulation core, see benchmarks.suite.
+
+Run with ``python -m benchmarks`` from the root of the repository. Rates are
+machine-specific: regenerate a baseline locally before comparing with it.
+"""
@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmark suite of the simulation core.
+
+Every benchmark is a case (see CASES) run for a number of particles, a
+density (see DENSITIES), an engine and a broad phase. Each run takes place in
+a fresh process, so the peak resident set size reported for it is its own.
+Rates are measured by repeating the benchmarked call for at least MIN_TIME
+seconds.
+
+Results are saved as JSON (see save) and compared with a saved baseline
+(see compare): a rate that dropped by more than the tolerance is reported
+as a regression.
+
+Rates depend on the machine, so a baseline is only meaningful on the machine
+it was measured on, see the environment saved with it. The committed
+baselines (benchmarks/baselines) were measured on a single CPU from the
+commit adding the suite. Before trusting compare, regenerate the baseline
+locally with --output from the commit to compare with.
+
+Usage::
+
+    python -m benchmarks --sizes 1000 10000 --output results.json
+    python -m benchmarks --compare benchmarks/baselines/numpy-grid.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from math import pi, sqrt
+from multiprocessing import get_context
+
+import numpy as np
+
+from particles.engines import ENGINES
+from particles.simulation import Simulator, Playback
+
+MIN_TIME = 1.0
+PARTICLE_R = 0.05
+# Fraction of the box area covered by particles
+DENSITIES = {'sparse': 0.02, 'dense': 0.2}
+# The largest box is the largest number of particles with distinct ids
+SIZES = (1000, 10000, Simulator.MAX_PARTICLES)
+# Largest number of particles checked with the 'all' broad phase
+MAX_ALL_PAIRS = 2000
+
+
+def make_simulator(n_particles, density, engine='numpy', broad_phase='grid',
+                   seed=0):
+    """Create a square box of n_particles particles of radius PARTICLE_R
+    covering the given fraction of its area.
+
+    :param n_particles: number of particles
+    :type n_particles: int
+    :param density: one of DENSITIES
+    :type density: str
+    :param engine: name of the engine
+    :type engine: str
+    :param broad_phase: name of the broad phase
+    :type broad_phase: str
+    :param seed: seed of the random module
+    :type seed: int
+    :return:
+    :rtype: Simulator
+    """
+    random.seed(seed)
+    side = sqrt(n_particles * pi * PARTICLE_R ** 2 / DENSITIES[density])
+    return Simulator(box_width=side, box_height=side, delta_v_top=0.0,
+                     delta_v_bottom=0.0, delta_v_side=0.0,
+                     barrier_x=side / 2, barrier_width=2 * PARTICLE_R,
+                     hole_y=side / 2, hole_height=side / 4, v_loss=0.1,
+                     particle_r=PARTICLE_R, n_left=n_particles // 2,
+                     n_right=n_particles - n_particles // 2, v_init=1.0,
+                     engine=engine, broad_phase=broad_phase)
+
+
+def measure(function, min_time=MIN_TIME):
+    """Call the function repeatedly for at least min_time seconds.
+
+    :param function: function without arguments
+    :type function: collections.abc.Callable
+    :param min_time: seconds
+    :type min_time: float
+    :return: number of calls and seconds they took
+    :rtype: (int, float)
+    """
+    calls = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_time or not calls:
+        function()
+        calls += 1
+        elapsed = time.perf_counter() - start
+    return calls, elapsed
+
+
+def bench_next_state(n_particles, density, engine, broad_phase, min_time):
+    simulator = make_simulator(n_particles, density, engine, broad_phase)
+    simulator.next_state()
+    (steps, elapsed) = measure(simulator.next_state, min_time)
+    return {'steps_per_second': steps / elapsed,
+            'particle_steps_per_second': steps * n_particles / elapsed}
+
+
+def bench_calculate_time_step(n_particles, density, engine, broad_phase,
+                              min_time):
+    simulator = make_simulator(n_particles, density, engine, broad_phase)
+    (calls, elapsed) = measure(simulator.calculate_time_step, min_time)
+    return {'calls_per_second': calls / elapsed,
+            'particles_per_second': calls * n_particles / elapsed}
+
+
+def bench_distribute_particles(n_particles, density, engine, broad_phase,
+                               min_time):
+    simulator = make_simulator(2, density, engine, broad_phase)
+    side = sqrt(n_particles * pi * PARTICLE_R ** 2 / DENSITIES[density])
+    simulator.box_width = simulator.box_height = side
+    simulator.barrier_x = side / 2
+    (calls, elapsed) = measure(
+        lambda: simulator.distribute_particles(n_particles // 2,
+                                               n_particles - n_particles // 2,
+                                               1.0), min_time)
+    return {'calls_per_second': calls / elapsed,
+            'particles_per_second': calls * n_particles / elapsed}
+
+
+def record(simulator, file_path, num_seconds=0.1, **kwargs):
+    snapshots = 0
+    for _ in simulator.simulate_to_file(file_path, num_seconds, 100,
+                                        **kwargs):
+        snapshots += 1
+    return snapshots
+
+
+RECORDING_FORMATS = {'v1': {},
+                     'v2-delta': {'compression': 'zlib', 'delta': True}}
+
+
+def bench_simulate_to_file(n_particles, density, engine, broad_phase,
+                           min_time):
+    metrics = {}
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = os.path.join(directory, "benchmark.bin")
+        for (name, kwargs) in RECORDING_FORMATS.items():
+            simulator = make_simulator(n_particles, density, engine,
+                                       broad_phase)
+            snapshots = []
+            (calls, elapsed) = measure(
+                lambda: snapshots.append(record(simulator, file_path,
+                                                **kwargs)), min_time)
+            metrics[name + '_snapshots_per_second'] = sum(snapshots) / elapsed
+            metrics[name + '_steps_per_second'] = simulator.steps / elapsed
+            metrics[name + '_bytes_per_snapshot'] = (
+                os.path.getsize(file_path) / (snapshots[-1] + 1))
+    return metrics
+
+
+def bench_playback(n_particles, density, engine, broad_phase, min_time):
+    metrics = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for (name, kwargs) in RECORDING_FORMATS.items():
+            file_path = os.path.join(directory, name + ".bin")
+            # several chunks, so that random access decompresses them
+            record(make_simulator(n_particles, density, engine, broad_phase),
+                   file_path, num_seconds=0.3, flush_interval=8, **kwargs)
+            readers = [(name, False)]
+            if name == 'v1':
+                readers.append((name + '-mmap', True))
+            for (reader, memory_map) in readers:
+                playback = Playback(file_path, memory_map=memory_map)
+                rng = np.random.default_rng(0)
+                (calls, elapsed) = measure(
+                    lambda: playback.set_state(
+                        int(rng.integers(len(playback)))), min_time)
+                metrics[reader + '_random_frames_per_second'] = \
+                    calls / elapsed
+                state = [0]
+
+                def next_frame():
+                    playback.set_state(state[0])
+                    state[0] = (state[0] + 1) % len(playback)
+
+                (calls, elapsed) = measure(next_frame, min_time)
+                metrics[reader + '_sequential_frames_per_second'] = \
+                    calls / elapsed
+                del playback
+    return metrics
+
+
+CASES = {'next_state': bench_next_state,
+         'calculate_time_step': bench_calculate_time_step,
+         'distribute_particles': bench_distribute_particles,
+         'simulate_to_file': bench_simulate_to_file,
+         'playback': bench_playback}
+# Cases that do not depend on the engine and the broad phase
+ENGINE_INDEPENDENT = ('calculate_time_step', 'distribute_particles',
+                      'playback')
+
+
+def run_case(case, n_particles, density, engine, broad_phase,
+             min_time=MIN_TIME):
+    """Run a single benchmark in the current process.
+
+    :return: result with the metrics and the peak resident set size of the
+    process (MiB)
+    :rtype: dict
+    """
+    metrics = CASES[case](n_particles, density, engine, broad_phase, min_time)
+    return {'case': case, 'n_particles': n_particles, 'density': density,
+            'engine': engine, 'broad_phase': broad_phase, 'metrics': metrics,
+            'peak_rss_mib': resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def plan(cases, sizes, densities, engines, broad_phases):
+    """Return the arguments of every benchmark to run.
+
+    The 'all' broad phase is skipped above MAX_ALL_PAIRS particles, and the
+    engine independent cases run once per size and density.
+
+    :return:
+    :rtype: list[tuple]
+    """
+    runs = []
+    for case in cases:
+        for n_particles in sizes:
+            for density in densities:
+                if case in ENGINE_INDEPENDENT:
+                    runs.append((case, n_particles, density, 'numpy', 'grid'))
+                    continue
+                for engine in engines:
+                    for broad_phase in broad_phases:
+                        if broad_phase == 'all' and \
+                                n_particles > MAX_ALL_PAIRS:
+                            continue
+                        runs.append((case, n_particles, density, engine,
+                                     broad_phase))
+    return runs
+
+
+def run(runs, min_time=MIN_TIME, callback=None):
+    """Run every benchmark in a fresh process.
+
+    :param runs: arguments of run_case, see plan
+    :type runs: list[tuple]
+    :param min_time: seconds every rate is measured for
+    :type min_time: float
+    :param callback: function called with every result
+    :type callback: collections.abc.Callable
+    :return: results
+    :rtype: list[dict]
+    """
+    results = []
+    context = get_context('spawn')
+    for arguments in runs:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            result = pool.submit(run_case, *arguments, min_time).result()
+        results.append(result)
+        if callback is not None:
+            callback(result)
+    return results
+
+
+def environment():
+    """Describe the environment the benchmarks run in.
+
+    :return:
+    :rtype: dict
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"],
+                                capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit,
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count()}
+
+
+def save(file_path, results):
+    with open(file_path, "w") as f:
+        json.dump({'environment': environment(), 'results': results}, f,
+                  indent=2)
+
+
+def load(file_path):
+    with open(file_path) as f:
+        return json.load(f)['results']
+
+
+def result_key(result):
+    return (result['case'], result['n_particles'], result['density'],
+            result['engine'], result['broad_phase'])
+
+
+def compare(results, baseline, tolerance=0.1):
+    """Compare the rates of the results with the baseline.
+
+    Every metric ending with _per_second is a rate, higher is better.
+
+    :param results: new results
+    :type results: list[dict]
+    :param baseline: results to compare with
+    :type baseline: list[dict]
+    :param tolerance: largest relative drop that is not a regression
+    :type tolerance: float
+    :return: (key, metric, baseline value, new value, ratio) for every rate
+    present in both, and the same for the regressions only
+    :rtype: (list[tuple], list[tuple])
+    """
+    previous = {result_key(result): result for result in baseline}
+    rows = []
+    regressions = []
+    for result in results:
+        old = previous.get(result_key(result))
+        if old is None:
+            continue
+        for (metric, value) in result['metrics'].items():
+            if not metric.endswith('_per_second') or \
+                    metric not in old['metrics']:
+                continue
+            ratio = value / old['metrics'][metric]
+            row = (result_key(result), metric, old['metrics'][metric], value,
+                   ratio)
+            rows.append(row)
+            if ratio < 1 - tolerance:
+                regressions.append(row)
+    return rows, regressions
+
+
+def format_result(result):
+    metrics = ", ".join("{name}={value:.4g}".format(name=name, value=value)
+                        for (name, value) in result['metrics'].items())
+    return "{key}: {metrics}, peak RSS {rss:.0f} MiB".format(
+        key=" ".join(str(part) for part in result_key(result)),
+        metrics=metrics, rss=result['peak_rss_mib'])
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description=__doc__.split("\n")[0])
+    parser.add_argument("--cases", nargs="+", choices=CASES,
+                        default=list(CASES))
+    parser.add_argument("--sizes", nargs="+", type=int, default=SIZES)
+    parser.add_argument("--densities", nargs="+", choices=DENSITIES,
+                        default=list(DENSITIES))
+    parser.add_argument("--engines", nargs="+", choices=ENGINES,
+                        default=['numpy'])
+    parser.add_argument("--broad-phases", nargs="+", default=['grid'])
+    parser.add_argument("--min-time", type=float, default=MIN_TIME)
+    parser.add_argument("--output", help="save the results as JSON")
+    parser.add_argument("--compare", help="JSON results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args(arguments)
+
+    runs = plan(args.cases, args.sizes, args.densities, args.engines,
+                args.broad_phases)
+    results = run(runs, args.min_time,
+                  callback=lambda result: print(format_result(result),
+                                                flush=True))
+    if args.output:
+        save(args.output, results)
+    if args.compare:
+        (rows, regressions) = compare(results, load(args.compare),
+                                      args.tolerance)
+        for (key, metric, old, new, ratio) in rows:
+            print("{key} {metric}: {old:.4g} -> {new:.4g} ({ratio:.2f}x)"
+                  "{flag}".format(key=" ".join(str(part) for part in key),
+                                  metric=metric, old=old, new=new,
+                                  ratio=ratio,
+                                  flag=" REGRESSION"
+                                  if ratio < 1 - args.tolerance else ""))
+        return 1 if regressions else 0
+    return 0
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+"""Broad phase of particle-to-particle collision detection.
+
+A broad phase function takes a simulator and an optional mask of active
+particles, and returns a pair of index arrays (first, second) with the
+candidate pairs of colliding particles, i.e. the rows of the simulator's
+store that have to be checked by the narrow phase. If the mask is provided,
+only pairs with at least one active particle are returned. Pairs are
+returned with first < second, ordered by first, then by second, which is the
+order the reference loop visits them in.
+"""
+
+import numpy as np
+
+# Half of the 3x3 neighbourhood: the cell itself and the cells to the right
+# and above. Visiting only these offsets yields every pair exactly once.
+_NEIGHBOUR_OFFSETS = ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1))
+_ALL_NEIGHBOUR_OFFSETS = tuple((x, y) for x in (-1, 0, 1) for y in (-1, 0, 1))
+
+
+def interaction_range(particle_r):
+    """Return the largest center distance at which two particles can collide.
+
+    Particles are checked for collision if they overlap (see
+    Particle.overlaps) and their centers are at most a diameter apart
+    vertically.
+
+    :param particle_r: particle radius (meters)
+    :type particle_r: float
+    :return:
+    :rtype: float
+    """
+    return max(particle_r * 2, particle_r ** 2)
+
+
+def expand_ranges(starts, counts):
+    """Concatenate ranges [start, start + count) into a single array.
+
+    :param starts: first element of each range
+    :type starts: numpy.ndarray
+    :param counts: number of elements in each range
+    :type counts: numpy.ndarray
+    :return: the concatenated ranges and the index of the range every
+    element belongs to
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    owners = np.repeat(np.arange(counts.shape[0]), counts)
+    offsets = np.arange(owners.shape[0]) - np.repeat(
+        np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + offsets, owners
+
+
+def grid_cells(pos_x, pos_y, cell_size, columns=None, rows=None):
+    """Find the cells of a uniform grid of square cells the particles are in.
+
+    :param pos_x: x coordinates of particles
+    :type pos_x: numpy.ndarray
+    :param pos_y: y coordinates of particles
+    :type pos_y: numpy.ndarray
+    :param cell_size: cell side (meters)
+    :type cell_size: float
+    :param columns: number of columns of a grid starting at x = 0, None if
+    the grid is unbounded. particles out of the grid are put in the nearest
+    column
+    :type columns: int
+    :param rows: number of rows of a grid starting at y = 0, see columns
+    :type rows: int
+    :return: column and row of every particle
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    cell_x = np.floor(pos_x / cell_size).astype(np.int64)
+    cell_y = np.floor(pos_y / cell_size).astype(np.int64)
+    if columns is not None:
+        np.clip(cell_x, 0, columns - 1, out=cell_x)
+    if rows is not None:
+        np.clip(cell_y, 0, rows - 1, out=cell_y)
+    return cell_x, cell_y
+
+
+def grid_pairs(pos_x, pos_y, cell_size, active=None):
+    """Find candidate pairs using a uniform grid (cell list).
+
+    Every particle is put in a square cell of the provided size, then it is
+    only paired with the particles of its own and neighbouring cells. As long
+    as cell_size is not less than the interaction range, no colliding pair is
+    missed at the moment the pairs are collected. Note that collision response
+    moves particles, so a particle pushed by one collision may reach a
+    particle outside its neighbourhood; such pair will only be checked on the
+    next step.
+
+    If the mask of active particles is provided, only the neighbourhoods of
+    active particles are searched, so the cost is proportional to the number
+    of active particles.
+
+    :param pos_x: x coordinates of particles
+    :type pos_x: numpy.ndarray
+    :param pos_y: y coordinates of particles
+    :type pos_y: numpy.ndarray
+    :param cell_size: cell side (meters)
+    :type cell_size: float
+    :param active: mask of active particles, None if all are active
+    :type active: numpy.ndarray
+    :return:
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    if pos_x.shape[0] < 2:
+        empty = np.empty(0, dtype=np.intp)
+        return empty, empty
+
+    (cell_x, cell_y) = grid_cells(pos_x, pos_y, cell_size)
+    cell_x -= cell_x.min() - 1
+    cell_y -= cell_y.min() - 1
+    stride = int(cell_y.max()) + 2
+    keys = cell_x * stride + cell_y
+
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+
+    if active is None:
+        owner_rows = np.arange(keys.shape[0])
+        neighbour_offsets = _NEIGHBOUR_OFFSETS
+    else:
+        owner_rows = np.flatnonzero(active)
+        neighbour_offsets = _ALL_NEIGHBOUR_OFFSETS
+    owner_keys = keys[owner_rows]
+
+    first = []
+    second = []
+    for (offset_x, offset_y) in neighbour_offsets:
+        neighbour_keys = owner_keys + (offset_x * stride + offset_y)
+        starts = np.searchsorted(sorted_keys, neighbour_keys, side='left')
+        ends = np.searchsorted(sorted_keys, neighbour_keys, side='right')
+        positions, owners = expand_ranges(starts, ends - starts)
+        owners = owner_rows[owners]
+        others = order[positions]
+        if active is not None:
+            # Every pair of active particles is found twice, keep one
+            keep = (owners != others) & (~active[others] | (owners < others))
+        elif offset_x == 0 and offset_y == 0:
+            keep = owners < others
+        else:
+            keep = slice(None)
+        owners = owners[keep]
+        others = others[keep]
+        first.append(np.minimum(owners, others))
+        second.append(np.maximum(owners, others))
+
+    first = np.concatenate(first)
+    second = np.concatenate(second)
+    pair_order = np.lexsort((second, first))
+    return first[pair_order], second[pair_order]
+
+
+def sweep_pairs(pos_y, reach, active=None):
+    """Find candidate pairs using sort-and-sweep along the y axis.
+
+    pos_y must be sorted. For every particle, the scan over the following
+    particles stops at the first one that is more than reach above it, so
+    the cost is proportional to the number of pairs within the reach rather
+    than to the square of the number of particles.
+
+    :param pos_y: sorted y coordinates of particles
+    :type pos_y: numpy.ndarray
+    :param reach: largest vertical distance between paired particles (meters)
+    :type reach: float
+    :param active: mask of active particles, None if all are active
+    :type active: numpy.ndarray
+    :return:
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    starts = np.arange(1, pos_y.shape[0] + 1)
+    ends = np.searchsorted(pos_y, pos_y + reach, side='right')
+    second, first = expand_ranges(starts, np.maximum(ends - starts, 0))
+    if active is not None:
+        involved = active[first] | active[second]
+        first = first[involved]
+        second = second[involved]
+    return first, second
+
+
+def grid(simulator, active=None):
+    """Uniform grid broad phase keyed on cells of a particle diameter.
+
+    :param simulator:
+    :type simulator: particles.simulation.Simulator
+    :param active: mask of active particles, None if all are active
+    :type active: numpy.ndarray
+    :return:
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    store = simulator.store
+    return grid_pairs(store.pos_x, store.pos_y,
+                      interaction_range(simulator.particle_r), active)
+
+
+def sweep(simulator, active=None):
+    """Sort-and-sweep broad phase. Relies on the store being sorted by pos_y.
+
+    :param simulator:
+    :type simulator: particles.simulation.Simulator
+    :param active: mask of active particles, None if all are active
+    :type active: numpy.ndarray
+    :return:
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    return sweep_pairs(simulator.store.pos_y, simulator.particle_r * 2,
+                       active)
+
+
+# None stands for the reference loop over every pair of particles
+BROAD_PHASES = {
+    'all': None,
+    'grid': grid,
+    'sweep': sweep,
+}
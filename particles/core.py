@@ -3,8 +3,29 @@
 import struct
 from math import sqrt
 
+import numpy as np
+
+
+def _column_property(column, cast):
+    """Build a property that reads and writes one cell of the store column."""
+
+    def getter(self):
+        return cast(getattr(self.store, column)[self.index])
+
+    def setter(self, value):
+        getattr(self.store, column)[self.index] = value
+
+    return property(getter, setter)
+
 
 class Particle:
+    """A single particle.
+
+    A particle created directly (either from values or from bytes) holds its
+    values in plain attributes. The particles of a ParticleStore are
+    ParticleView objects instead, see view.
+    """
+
     STRUCT_FORMAT = "ddddh"
     STRUCT_SIZE = struct.calcsize(STRUCT_FORMAT)
 
@@ -22,6 +43,22 @@ class Particle:
             self.velocity_y = velocity_y
             self.id = id
 
+    @classmethod
+    def view(cls, store, index):
+        """Create a particle backed by the row `index` of `store`.
+
+        :param store: the store containing particle data
+        :type store: ParticleStore
+        :param index: row of the store
+        :type index: int
+        :return:
+        :rtype: ParticleView
+        """
+        particle = ParticleView.__new__(ParticleView)
+        particle.store = store
+        particle.index = index
+        return particle
+
     def __str__(self):
         return "Particle ({id}; {pos_x}; {pos_y}; {v_x}; {v_y})".format(
             pos_x=self.pos_x,
@@ -96,3 +133,174 @@ class Particle:
         :rtype: bool
         """
         return self.distance_to(other) < (particle_r ** 2)
+
+
+class ParticleView(Particle):
+    """A particle whose data lives in a row of a ParticleStore.
+
+    Reading or writing an attribute reads or writes the store, so the view
+    stays in sync with the simulation. Create views with Particle.view.
+    """
+
+    __slots__ = ['store', 'index']
+
+    pos_x = _column_property('pos_x', float)
+    pos_y = _column_property('pos_y', float)
+    velocity_x = _column_property('velocity_x', float)
+    velocity_y = _column_property('velocity_y', float)
+    id = _column_property('id', int)
+
+
+class ParticleStore:
+    """Structure-of-arrays storage for a set of particles.
+
+    Particle data is kept in contiguous NumPy columns:
+
+        * pos_x, pos_y, velocity_x, velocity_y - float64 columns. all four
+        are rows of a single (4, N) block `data`, so the whole float state can
+        be copied at once
+        * id - int16 column, same meaning as Particle.id
+
+    Indexing or iterating over the store yields Particle views, so code
+    written against lists of particles keeps working. Columns are always
+    modified in place, hence any view or column reference taken from the store
+    remains valid until the store is resized.
+    """
+
+    __slots__ = ['data', 'id', 'pos_x', 'pos_y', 'velocity_x', 'velocity_y',
+                 '_views']
+
+    def __init__(self, size=0):
+        self.data = np.zeros((4, size), dtype=np.float64)
+        self.id = np.zeros(size, dtype=np.int16)
+        self._bind_columns()
+
+    def _bind_columns(self):
+        (self.pos_x, self.pos_y, self.velocity_x,
+         self.velocity_y) = self.data
+        self._views = None
+
+    @classmethod
+    def from_particles(cls, particles):
+        """Create a store holding a copy of the provided particles.
+
+        :param particles: particles to copy
+        :type particles: collections.abc.Iterable[Particle]
+        :return:
+        :rtype: ParticleStore
+        """
+        if isinstance(particles, ParticleStore):
+            return particles.copy()
+        particles = list(particles)
+        store = cls(len(particles))
+        for (i, particle) in enumerate(particles):
+            store.data[:, i] = (particle.pos_x, particle.pos_y,
+                                particle.velocity_x, particle.velocity_y)
+            store.id[i] = particle.id
+        return store
+
+    def copy(self):
+        """Return an independent copy of the store.
+
+        :return:
+        :rtype: ParticleStore
+        """
+        store = ParticleStore.__new__(ParticleStore)
+        store.data = self.data.copy()
+        store.id = self.id.copy()
+        store._bind_columns()
+        return store
+
+    def frozen(self):
+        """Return a read-only copy of the store.
+
+        The float block is copied at once, so taking a frame of the
+        simulation costs two array copies whatever the number of particles.
+        The frame can be read through its columns or Particle views, but
+        writing to it raises ValueError. Its copy() is writable again.
+
+        :return:
+        :rtype: ParticleStore
+        """
+        store = ParticleStore.__new__(ParticleStore)
+        store.data = self.data.copy()
+        store.id = self.id.copy()
+        store.data.setflags(write=False)
+        store.id.setflags(write=False)
+        # the columns are bound after the flags are set, so they are
+        # read-only as well
+        store._bind_columns()
+        return store
+
+    def use_buffer(self, data):
+        """Move the float data into the provided (4, N) array.
+
+        The current values are copied into the array, which then becomes the
+        data block of the store. This is used to put the store in shared
+        memory.
+
+        :param data: float64 array of shape (4, len(self))
+        :type data: numpy.ndarray
+        :return:
+        """
+        data[:] = self.data
+        self.data = data
+        self._bind_columns()
+
+    def views(self):
+        """Return a list of Particle views, one per row.
+
+        :return:
+        :rtype: list[Particle]
+        """
+        if self._views is None:
+            self._views = [Particle.view(self, i) for i in range(len(self))]
+        return list(self._views)
+
+    def reorder(self, order):
+        """Permute the rows of the store in place.
+
+        :param order: new row order, i.e. row i becomes the old row order[i]
+        :type order: numpy.ndarray
+        :return:
+        """
+        self.data[:] = self.data[:, order]
+        self.id[:] = self.id[order]
+
+    def sort_by_y(self):
+        """Sort the rows by pos_y, keeping the relative order of equal rows.
+
+        Between two simulation steps the order barely changes, so the rows are
+        only permuted if they are out of order, and the permutation is found
+        with a stable sort (timsort), which runs in near-linear time on nearly
+        sorted data.
+
+        :return: the permutation applied to the rows, None if the rows were
+        already sorted
+        :rtype: numpy.ndarray
+        """
+        pos_y = self.pos_y
+        if np.all(pos_y[:-1] <= pos_y[1:]):
+            return None
+        order = np.argsort(pos_y, kind='stable')
+        self.reorder(order)
+        return order
+
+    def speed(self):
+        """Calculate the speed of every particle.
+
+        :return:
+        :rtype: numpy.ndarray
+        """
+        return np.sqrt(self.velocity_x ** 2 + self.velocity_y ** 2)
+
+    def __len__(self):
+        return self.id.shape[0]
+
+    def __getitem__(self, index):
+        if not -len(self) <= index < len(self):
+            raise IndexError("particle index out of range")
+        return Particle.view(self, index % len(self))
+
+    def __iter__(self):
+        return iter(self.views())
@@ -0,0 +1,594 @@
+# -*- coding: utf-8 -*-
+
+from math import sqrt
+
+import numpy as np
+
+from particles import kernels
+from particles.broadphase import BROAD_PHASES
+
+# Engines by name, filled by register_engine
+ENGINES = {}
+
+
+def register_engine(name):
+    """Class decorator adding an engine to ENGINES under the provided name.
+
+    An engine is instantiated with the simulator as the only argument and must
+    implement the phases described in PythonEngine.
+
+    :param name: engine name, the value of the engine argument of Simulator
+    :type name: str
+    :return:
+    """
+
+    def register(engine_class):
+        ENGINES[name] = engine_class
+        return engine_class
+
+    return register
+
+
+@register_engine('python')
+class PythonEngine:
+    """Reference implementation of the simulation phases.
+
+    An engine performs the phases of Simulator.next_state over the
+    simulator's particles:
+
+        * move - free flight of the particles under gravity
+        * sort - ordering of the store by pos_y, see ParticleStore.sort_by_y
+        * collide_particles - particle-to-particle collisions. expects the
+        store to be sorted by pos_y. the candidate pairs are found by the
+        simulator's broad phase, see particles.broadphase. if the simulator
+        has worker processes, the collisions are resolved by them instead,
+        see particles.parallel
+        * collide_walls - collisions with the box, the barrier and the hole
+
+    Every phase but sort takes an optional boolean mask of active particles.
+    If it is provided, only active particles are moved and checked against
+    the walls, and only the pairs with at least one active particle are
+    checked for collision. This is used by block time steps, see
+    Simulator.next_block_state, which also moves every particle for its own
+    period of time.
+
+    The particle-to-particle phases return the number of collisions, see
+    particles.stats.
+
+    This engine runs every phase as a plain Python loop over the columns of
+    the store, read into lists once per phase. Other engines must produce the
+    same results.
+    """
+
+    __slots__ = ['simulator']
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+
+    def move(self, time_step, active=None):
+        """
+        Move the particles for the provided period of time
+
+        :param time_step: period of time (seconds), either for all the
+        particles or one per particle
+        :type time_step: float | numpy.ndarray
+        :param active: mask of particles to move, None to move all of them
+        :type active: numpy.ndarray
+        :return:
+        """
+        data = self.simulator.store.data
+        g = self.simulator.g
+        pos_x, pos_y, velocity_x, velocity_y = data.tolist()
+        if isinstance(time_step, np.ndarray):
+            time_steps = time_step.tolist()
+        else:
+            time_steps = [time_step] * len(pos_x)
+        if active is None:
+            rows = range(len(pos_x))
+        else:
+            rows = np.flatnonzero(active).tolist()
+        for i in rows:
+            time_step = time_steps[i]
+            pos_x[i] += velocity_x[i] * time_step
+            pos_y[i] += velocity_y[i] * time_step - g * (time_step ** 2) / 2
+            velocity_y[i] -= g * time_step
+        data[:] = (pos_x, pos_y, velocity_x, velocity_y)
+
+    def sort(self):
+        """
+        Sort the particles by pos_y
+
+        :return: the permutation applied to the store, None if it was sorted
+        :rtype: numpy.ndarray
+        """
+        return self.simulator.store.sort_by_y()
+
+    def collide_particles(self, active=None):
+        """
+        Check whether any two particles collide, and if so, move them apart
+        and decrease their speed by v_loss
+
+        :param active: mask of active particles, None if all are active
+        :type active: numpy.ndarray
+        :return: number of collisions
+        :rtype: int
+        """
+        if self.simulator.pool is not None:
+            return self.simulator.pool.collide_particles(active)
+        broad_phase = BROAD_PHASES[self.simulator.broad_phase]
+        if broad_phase is None:
+            return self.collide_all_particles(active)
+        return self.collide_pairs(*broad_phase(self.simulator, active))
+
+    def collide_all_particles(self, active=None):
+        """
+        Check every pair of particles for collision
+
+        :param active: mask of active particles, None if all are active
+        :type active: numpy.ndarray
+        :return: number of collisions
+        :rtype: int
+        """
+        simulator = self.simulator
+        return resolve_all_pairs(simulator.store.data, active,
+                                 simulator.particle_r, 1 - simulator.v_loss)
+
+    def collide_pairs(self, first, second):
+        """
+        Check the provided candidate pairs for collision, in order.
+
+        This is the narrow phase of collide_particles, see resolve_pairs.
+
+        :param first: store rows of the first particle of each pair
+        :type first: numpy.ndarray
+        :param second: store rows of the second particle of each pair
+        :type second: numpy.ndarray
+        :return: number of collisions
+        :rtype: int
+        """
+        simulator = self.simulator
+        return resolve_pairs(simulator.store.data, first, second,
+                             simulator.particle_r, 1 - simulator.v_loss)
+
+    def collide_walls(self, active=None):
+        """
+        Check if any particle collides with walls. If so, move them and rotate
+        their velocity vector
+
+        :param active: mask of active particles, None if all are active
+        :type active: numpy.ndarray
+        :return:
+        """
+        simulator = self.simulator
+
+        x_min = simulator.x_min
+        x_max = simulator.x_max
+        y_min = simulator.y_min
+        y_max = simulator.y_max
+        barrier_x = simulator.barrier_x
+        barrier_x_min = simulator.barrier_x_min
+        barrier_x_max = simulator.barrier_x_max
+        barrier_x_left = simulator.barrier_x_left
+        barrier_x_right = simulator.barrier_x_right
+        hole_y_max = simulator.hole_y_max
+        hole_y_min = simulator.hole_y_min
+
+        delta_v_top = simulator.delta_v_top
+        delta_v_bottom = simulator.delta_v_bottom
+        delta_v_side = simulator.delta_v_side
+
+        data = simulator.store.data
+        pos_x, pos_y, velocity_x, velocity_y = data.tolist()
+        rows = range(len(pos_x))
+        if active is not None:
+            rows = np.flatnonzero(active).tolist()
+
+        for i in rows:
+            x = pos_x[i]
+            y = pos_y[i]
+            v_x = velocity_x[i]
+            v_y = velocity_y[i]
+            if y > y_max and v_y > 0:  # box ceiling
+                pos_y[i] = y_max
+                velocity_y[i] = -v_y - delta_v_top
+            elif y < y_min and v_y < 0:  # box floor
+                pos_y[i] = y_min
+                velocity_y[i] = -v_y + delta_v_bottom
+
+            if x > x_max and v_x > 0:  # box right side
+                pos_x[i] = x_max
+                velocity_x[i] = -v_x - delta_v_side
+            elif x < x_min and v_x < 0:  # box left side
+                pos_x[i] = x_min
+                velocity_x[i] = -v_x + delta_v_side
+            elif barrier_x_min < x < barrier_x_max:  # barrier collisions
+                v_y = velocity_y[i]  # collision with the top
+                y = pos_y[i]
+                if barrier_x_left < x < barrier_x_right:  # inside hole
+                    if y > hole_y_min and v_y > 0:
+                        pos_y[i] = hole_y_min
+                        velocity_y[i] = -v_y - delta_v_top
+                    elif y < hole_y_max and v_y < 0:
+                        pos_y[i] = hole_y_max
+                        velocity_y[i] = -v_y + delta_v_bottom
+                elif y < hole_y_max or y > hole_y_min:
+                    if x < barrier_x:
+                        pos_x[i] = barrier_x_min
+                        velocity_x[i] = -v_x - delta_v_side
+                    else:
+                        pos_x[i] = barrier_x_max
+                        velocity_x[i] = -v_x + delta_v_side
+
+        data[:] = (pos_x, pos_y, velocity_x, velocity_y)
+
+
+@register_engine('numpy')
+class NumpyEngine(PythonEngine):
+    """Engine running the move and wall phases as array operations.
+
+    Every branch of the reference wall loop is turned into a boolean mask
+    computed over the whole store, so the results are bit-compatible with
+    PythonEngine. Without a broad phase, the pairs too far apart vertically
+    are skipped with array operations, see resolve_close_pairs.
+    """
+
+    __slots__ = []
+
+    def collide_all_particles(self, active=None):
+        simulator = self.simulator
+        return resolve_close_pairs(simulator.store.data, active,
+                                   simulator.particle_r,
+                                   1 - simulator.v_loss)
+
+    def move(self, time_step, active=None):
+        store = self.simulator.store
+        g = self.simulator.g
+        rows = slice(None) if active is None else np.flatnonzero(active)
+        if isinstance(time_step, np.ndarray):
+            time_step = time_step[rows]
+        gravity_pull = g * (time_step ** 2) / 2
+        store.pos_x[rows] += store.velocity_x[rows] * time_step
+        store.pos_y[rows] += store.velocity_y[rows] * time_step - gravity_pull
+        store.velocity_y[rows] -= g * time_step
+
+    def collide_walls(self, active=None):
+        simulator = self.simulator
+        store = simulator.store
+        if active is None:
+            active = True
+        pos_x = store.pos_x
+        pos_y = store.pos_y
+        velocity_x = store.velocity_x
+        velocity_y = store.velocity_y
+
+        # Box ceiling and floor
+        ceiling = active & (pos_y > simulator.y_max) & (velocity_y > 0)
+        floor = (active & ~ceiling & (pos_y < simulator.y_min) &
+                 (velocity_y < 0))
+        pos_y[ceiling] = simulator.y_max
+        velocity_y[ceiling] = -velocity_y[ceiling] - simulator.delta_v_top
+        pos_y[floor] = simulator.y_min
+        velocity_y[floor] = -velocity_y[floor] + simulator.delta_v_bottom
+
+        # Box sides and the barrier. The barrier checks see the vertical
+        # state updated above, just like the reference loop does
+        right = active & (pos_x > simulator.x_max) & (velocity_x > 0)
+        left = (active & ~right & (pos_x < simulator.x_min) &
+                (velocity_x < 0))
+        barrier = (active & ~(right | left) &
+                   (simulator.barrier_x_min < pos_x) &
+                   (pos_x < simulator.barrier_x_max))
+        inside = (barrier & (simulator.barrier_x_left < pos_x) &
+                  (pos_x < simulator.barrier_x_right))
+        hole_top = inside & (pos_y > simulator.hole_y_min) & (velocity_y > 0)
+        hole_bottom = (inside & ~hole_top & (pos_y < simulator.hole_y_max) &
+                       (velocity_y < 0))
+        side = (barrier & ~inside & ((pos_y < simulator.hole_y_max) |
+                                     (pos_y > simulator.hole_y_min)))
+        side_left = side & (pos_x < simulator.barrier_x)
+        side_right = side & ~side_left
+
+        pos_x[right] = simulator.x_max
+        velocity_x[right] = -velocity_x[right] - simulator.delta_v_side
+        pos_x[left] = simulator.x_min
+        velocity_x[left] = -velocity_x[left] + simulator.delta_v_side
+        pos_y[hole_top] = simulator.hole_y_min
+        velocity_y[hole_top] = (-velocity_y[hole_top] -
+                                simulator.delta_v_top)
+        pos_y[hole_bottom] = simulator.hole_y_max
+        velocity_y[hole_bottom] = (-velocity_y[hole_bottom] +
+                                   simulator.delta_v_bottom)
+        pos_x[side_left] = simulator.barrier_x_min
+        velocity_x[side_left] = (-velocity_x[side_left] -
+                                 simulator.delta_v_side)
+        pos_x[side_right] = simulator.barrier_x_max
+        velocity_x[side_right] = (-velocity_x[side_right] +
+                                  simulator.delta_v_side)
+
+
+def resolve_all_pairs(data, active, particle_r, speed_factor):
+    """
+    Check every pair of particles for collision, in the order of the rows,
+    and resolve the collisions.
+
+    This is the reference loop of PythonEngine.collide_all_particles. The
+    checks and the collision response are the same as in resolve_pairs.
+
+    :param data: (4, N) block of pos_x, pos_y, velocity_x, velocity_y,
+    modified in place
+    :type data: numpy.ndarray
+    :param active: mask of active particles, None if all are active
+    :type active: numpy.ndarray
+    :param particle_r: particle radius (meters)
+    :type particle_r: float
+    :param speed_factor: ratio of velocity kept after a collision
+    :type speed_factor: float
+    :return: number of collisions
+    :rtype: int
+    """
+    particle_r_2 = particle_r * 2
+    particle_r_squared = particle_r ** 2
+
+    pos_x, pos_y, velocity_x, velocity_y = data.tolist()
+    size = len(pos_x)
+    if active is not None:
+        active = active.tolist()
+    collisions = 0
+
+    for i in range(size):
+        # only the rows i and j change while visiting the pair (i, j), so the
+        # values of the rows left to visit can be read in advance
+        pos_y_i = pos_y[i]
+        if active is None or active[i]:
+            others = enumerate(pos_y[i + 1:], i + 1)
+        else:
+            others = [(j, pos_y[j]) for j in range(i + 1, size) if active[j]]
+        for (j, pos_y_j) in others:
+            dy = pos_y_i - pos_y_j
+            if dy > particle_r_2 or dy < -particle_r_2:
+                continue
+            dx = pos_x[i] - pos_x[j]
+            distance_between_particles = sqrt(dx ** 2 + dy ** 2)
+            if not distance_between_particles < particle_r_squared:
+                continue
+
+            if pos_x[i] < pos_x[j]:
+                d_v_x = velocity_x[i] - velocity_x[j]
+            else:
+                d_v_x = velocity_x[j] - velocity_x[i]
+            if pos_y[i] < pos_y[j]:
+                d_v_y = velocity_y[i] - velocity_y[j]
+            else:
+                d_v_y = velocity_y[j] - velocity_y[i]
+            if not (d_v_x > 0 or d_v_y > 0):
+                continue
+
+            collisions += 1
+            velocity_x[i] *= speed_factor
+            velocity_y[i] *= speed_factor
+            velocity_x[j] *= speed_factor
+            velocity_y[j] *= speed_factor
+
+            distance_to_move = particle_r_2 - distance_between_particles
+            if dy > 0:
+                pos_x[i] += distance_to_move * (
+                    dx / distance_between_particles)
+                pos_y[i] += distance_to_move * (
+                    dy / distance_between_particles)
+                pos_y_i = pos_y[i]
+            else:
+                pos_x[j] -= distance_to_move * (
+                    dx / distance_between_particles)
+                pos_y[j] -= distance_to_move * (
+                    dy / distance_between_particles)
+
+    if collisions:
+        data[:] = (pos_x, pos_y, velocity_x, velocity_y)
+    return collisions
+
+
+def resolve_close_pairs(data, active, particle_r, speed_factor):
+    """
+    Check every pair of particles for collision like resolve_all_pairs, but
+    find the pairs close enough vertically with array operations instead of
+    visiting every pair.
+
+    Only the rows i and j change while visiting the pair (i, j), so the
+    partners of particle i can be found in advance, and again after every
+    collision that moves particle i. The results are the same as the ones of
+    resolve_all_pairs.
+
+    :param data: (4, N) block of pos_x, pos_y, velocity_x, velocity_y,
+    modified in place
+    :type data: numpy.ndarray
+    :param active: mask of active particles, None if all are active
+    :type active: numpy.ndarray
+    :param particle_r: particle radius (meters)
+    :type particle_r: float
+    :param speed_factor: ratio of velocity kept after a collision
+    :type speed_factor: float
+    :return: number of collisions
+    :rtype: int
+    """
+    particle_r_2 = particle_r * 2
+    particle_r_squared = particle_r ** 2
+
+    column_y = data[1].copy()
+    pos_x, pos_y, velocity_x, velocity_y = data.tolist()
+    size = len(pos_x)
+    collisions = 0
+
+    for i in range(size):
+        start = i + 1
+        while start < size:
+            others = start + np.flatnonzero(
+                np.abs(pos_y[i] - column_y[start:]) <= particle_r_2)
+            if active is not None and not active[i]:
+                others = others[active[others]]
+            start = size
+            for j in others.tolist():
+                dy = pos_y[i] - pos_y[j]
+                dx = pos_x[i] - pos_x[j]
+                distance_between_particles = sqrt(dx ** 2 + dy ** 2)
+                if not distance_between_particles < particle_r_squared:
+                    continue
+
+                if pos_x[i] < pos_x[j]:
+                    d_v_x = velocity_x[i] - velocity_x[j]
+                else:
+                    d_v_x = velocity_x[j] - velocity_x[i]
+                if pos_y[i] < pos_y[j]:
+                    d_v_y = velocity_y[i] - velocity_y[j]
+                else:
+                    d_v_y = velocity_y[j] - velocity_y[i]
+                if not (d_v_x > 0 or d_v_y > 0):
+                    continue
+
+                collisions += 1
+                velocity_x[i] *= speed_factor
+                velocity_y[i] *= speed_factor
+                velocity_x[j] *= speed_factor
+                velocity_y[j] *= speed_factor
+
+                distance_to_move = particle_r_2 - distance_between_particles
+                if dy > 0:
+                    pos_x[i] += distance_to_move * (
+                        dx / distance_between_particles)
+                    pos_y[i] += distance_to_move * (
+                        dy / distance_between_particles)
+                    column_y[i] = pos_y[i]
+                    # the partners left depend on the new pos_y
+                    start = j + 1
+                    break
+                pos_x[j] -= distance_to_move * (
+                    dx / distance_between_particles)
+                pos_y[j] -= distance_to_move * (
+                    dy / distance_between_particles)
+                column_y[j] = pos_y[j]
+
+    if collisions:
+        data[:] = (pos_x, pos_y, velocity_x, velocity_y)
+    return collisions
+
+
+def resolve_pairs(data, first, second, particle_r, speed_factor):
+    """
+    Check the provided candidate pairs for collision, in order, and resolve
+    the collisions.
+
+    The checks and the collision response are the same as in
+    resolve_all_pairs.
+
+    :param data: (4, N) block of pos_x, pos_y, velocity_x, velocity_y,
+    modified in place
+    :type data: numpy.ndarray
+    :param first: rows of the first particle of each pair
+    :type first: numpy.ndarray
+    :param second: rows of the second particle of each pair
+    :type second: numpy.ndarray
+    :param particle_r: particle radius (meters)
+    :type particle_r: float
+    :param speed_factor: ratio of velocity kept after a collision
+    :type speed_factor: float
+    :return: number of collisions
+    :rtype: int
+    """
+    if not first.shape[0]:
+        return 0
+    particle_r_2 = particle_r * 2
+    particle_r_squared = particle_r ** 2
+
+    pos_x, pos_y, velocity_x, velocity_y = data.tolist()
+    collisions = 0
+
+    for (i, j) in zip(first.tolist(), second.tolist()):
+        dy = pos_y[i] - pos_y[j]
+        if abs(dy) > particle_r_2:
+            continue
+        dx = pos_x[i] - pos_x[j]
+        distance_between_particles = sqrt(dx ** 2 + dy ** 2)
+        if not distance_between_particles < particle_r_squared:
+            continue
+
+        if pos_x[i] < pos_x[j]:
+            d_v_x = velocity_x[i] - velocity_x[j]
+        else:
+            d_v_x = velocity_x[j] - velocity_x[i]
+        if pos_y[i] < pos_y[j]:
+            d_v_y = velocity_y[i] - velocity_y[j]
+        else:
+            d_v_y = velocity_y[j] - velocity_y[i]
+        if not (d_v_x > 0 or d_v_y > 0):
+            continue
+
+        collisions += 1
+        velocity_x[i] *= speed_factor
+        velocity_y[i] *= speed_factor
+        velocity_x[j] *= speed_factor
+        velocity_y[j] *= speed_factor
+
+        distance_to_move = particle_r_2 - distance_between_particles
+        if dy > 0:
+            pos_x[i] += distance_to_move * (dx / distance_between_particles)
+            pos_y[i] += distance_to_move * (dy / distance_between_particles)
+        else:
+            pos_x[j] -= distance_to_move * (dx / distance_between_particles)
+            pos_y[j] -= distance_to_move * (dy / distance_between_particles)
+
+    if collisions:
+        data[:] = (pos_x, pos_y, velocity_x, velocity_y)
+    return collisions
+
+
+@register_engine('jit')
+class JitEngine(PythonEngine):
+    """Engine running every phase as a compiled kernel over the data block.
+
+    See particles.kernels. If numba is not installed, the kernels run as
+    plain Python, so the engine still works and gives the same results.
+    """
+
+    __slots__ = []
+
+    def active_mask(self, active):
+        if active is None:
+            return np.ones(len(self.simulator), dtype=np.bool_)
+        return active
+
+    def move(self, time_step, active=None):
+        simulator = self.simulator
+        if active is None and not isinstance(time_step, np.ndarray):
+            kernels.move(simulator.store.data, time_step, simulator.g)
+            return
+        rows = np.flatnonzero(self.active_mask(active))
+        time_steps = np.broadcast_to(time_step, len(simulator))[rows]
+        kernels.move_rows(simulator.store.data, rows,
+                          np.ascontiguousarray(time_steps, dtype=np.float64),
+                          simulator.g)
+
+    def collide_particles(self, active=None):
+        simulator = self.simulator
+        if (simulator.pool is not None or
+                BROAD_PHASES[simulator.broad_phase] is not None):
+            return super().collide_particles(active)
+        return kernels.collide_all_pairs(simulator.store.data,
+                                         self.active_mask(active),
+                                         simulator.particle_r,
+                                         1 - simulator.v_loss)
+
+    def collide_pairs(self, first, second):
+        simulator = self.simulator
+        return kernels.collide_pairs(simulator.store.data, first, second,
+                                     simulator.particle_r,
+                                     1 - simulator.v_loss)
+
+    def collide_walls(self, active=None):
+        simulator = self.simulator
+        kernels.collide_walls(
+            simulator.store.data, self.active_mask(active),
+            simulator.x_min, simulator.x_max, simulator.y_min,
+            simulator.y_max, simulator.barrier_x, simulator.barrier_x_min,
+            simulator.barrier_x_max, simulator.barrier_x_left,
+            simulator.barrier_x_right, simulator.hole_y_min,
+            simulator.hole_y_max, simulator.delta_v_top,
+            simulator.delta_v_bottom, simulator.delta_v_side)
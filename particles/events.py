@@ -0,0 +1,694 @@
+# -*- coding: utf-8 -*-
+
+import heapq
+from math import floor, inf, sqrt
+
+import numpy as np
+
+from particles.broadphase import grid_cells, interaction_range
+from particles.simulation import Simulator
+
+# Event kinds
+WALL_LEFT = 0
+WALL_RIGHT = 1
+FLOOR = 2
+CEILING = 3
+BARRIER = 4
+HOLE_EXIT = 5
+HOLE_ROOF = 6
+HOLE_FLOOR = 7
+PAIR = 8
+CELL_LEFT = 9
+CELL_RIGHT = 10
+CELL_DOWN = 11
+CELL_UP = 12
+
+CELL_KINDS = (CELL_LEFT, CELL_RIGHT, CELL_DOWN, CELL_UP)
+CELL_STEPS = {CELL_LEFT: (-1, 0), CELL_RIGHT: (1, 0), CELL_DOWN: (0, -1),
+              CELL_UP: (0, 1)}
+
+
+def time_down_to(pos_y, velocity_y, g, level):
+    """Return the time it takes to fall to the level.
+
+    Solve pos_y + velocity_y * t - g * t ** 2 / 2 = level for the moment the
+    particle crosses the level moving down. Only a crossing strictly in the
+    future counts, so a particle lying on the level, or moving down from it,
+    never reaches it (see EventSimulator.settle).
+
+    :return: time (seconds), inf if the level is never reached
+    :rtype: float
+    """
+    if not g:
+        if velocity_y < 0 and pos_y > level:
+            return (level - pos_y) / velocity_y
+        return inf
+    discriminant = velocity_y * velocity_y + 2 * g * (pos_y - level)
+    if discriminant <= 0:
+        return inf
+    time = (velocity_y + sqrt(discriminant)) / g
+    return time if time > 0 else inf
+
+
+def time_up_to(pos_y, velocity_y, g, level):
+    """Return the time it takes to rise to the level.
+
+    Solve pos_y + velocity_y * t - g * t ** 2 / 2 = level for the moment the
+    particle crosses the level moving up.
+
+    :return: time (seconds), inf if the level is never reached
+    :rtype: float
+    """
+    if pos_y >= level:
+        return 0.0 if velocity_y > 0 else inf
+    if velocity_y <= 0:
+        return inf
+    if not g:
+        return (level - pos_y) / velocity_y
+    discriminant = velocity_y * velocity_y - 2 * g * (level - pos_y)
+    if discriminant < 0:
+        return inf
+    return (velocity_y - sqrt(discriminant)) / g
+
+
+def time_across(pos_x, velocity_x, level):
+    """Return the time it takes to reach the vertical line x = level.
+
+    The particle is expected to move towards the line; if it has already
+    crossed it, the returned time is 0.
+
+    :return: time (seconds), inf if the particle does not move horizontally
+    :rtype: float
+    """
+    if not velocity_x:
+        return inf
+    return max((level - pos_x) / velocity_x, 0.0)
+
+
+def time_to_contact(d_x, d_y, d_v_x, d_v_y, a_y, sigma_squared):
+    """Return the time it takes two particles to touch when one of them
+    falls and the other one does not.
+
+    Solve |d + d_v * t + a * t ** 2 / 2| = sigma for the first moment the
+    particles come together, a = (0, a_y) being the relative acceleration.
+
+    :return: time (seconds), inf if the particles never touch
+    :rtype: float
+    """
+    coefficients = (a_y * a_y / 4, d_v_y * a_y,
+                    d_v_x * d_v_x + d_v_y * d_v_y + d_y * a_y,
+                    2 * (d_x * d_v_x + d_y * d_v_y),
+                    d_x * d_x + d_y * d_y - sigma_squared)
+    derivative = np.polyder(coefficients)
+    time = inf
+    for root in np.roots(coefficients):
+        if (root.real <= 0 or
+                abs(root.imag) > 1e-9 * max(1.0, abs(root.real))):
+            continue
+        # only count the particles coming together
+        if np.polyval(derivative, root.real) < 0:
+            time = min(time, root.real)
+    return time
+
+
+class EventSimulator(Simulator):
+    """Event-driven simulator of particles inside a box.
+
+    Instead of advancing all the particles by a small fixed time step, this
+    simulator computes exact times of the following events and jumps straight
+    from one event to the next one:
+
+        * collision of two particles. particles are hard disks of radius
+        particle_r. on collision, their velocities are exchanged along the
+        line between their centers, then multiplied by (1 - v_loss)
+        * collision with the box walls. the velocity change is the same as in
+        Simulator.next_state
+        * collision with the barrier, including the ceiling and the floor of
+        the hole. the corners of the barrier are not modelled: a particle
+        crossing the barrier face with its center between hole_y_min and
+        hole_y_max enters the hole, otherwise it bounces off the face
+
+    Between events, particles fly freely under gravity, so their positions
+    can be computed at any moment, which is how snapshots are produced. A
+    particle lying on the floor (or on the floor of the hole) without
+    bouncing back, e.g. with delta_v_bottom = 0, rests there: it slides along
+    the floor, unaffected by gravity, until a collision lifts it.
+
+    Every particle has exactly one predicted event in a priority queue: the
+    earliest one it takes part in. Events carry the collision counts of their
+    particles at prediction time, so an event made obsolete by an earlier
+    collision is recognized and dropped when it leaves the queue, instead of
+    being searched for and removed.
+
+    Particles are kept in the cells of a uniform grid (see
+    particles.broadphase.grid_cells) not smaller than the interaction range,
+    and leaving a cell is an event too. A particle can then only collide with
+    the particles of its own and the neighbouring cells, so a prediction only
+    checks those.
+
+    The parameters are the same as for Simulator; engine, broad_phase and
+    profile are not used. The following properties are specific to this class:
+        * reference_time - for each particle, the moment of time (relative
+        to time_elapsed at creation) its state in the store corresponds to
+        * clock - current moment of time, same origin as reference_time
+        * events - the event queue
+        * collision_count - number of events each particle has taken part in,
+        not counting the cell changes
+        * resting - for each particle, whether it rests on a floor
+        * cell_size - width and height of the cells of the grid
+        * cell_x, cell_y - for each particle, the column and row of its cell
+        * cells - the rows of the particles of every (column, row) cell
+    """
+
+    __slots__ = ['reference_time', 'clock', 'events', 'collision_count',
+                 'event_number', 'resting', 'cell_size', 'grid_shape',
+                 'cell_x', 'cell_y', 'cells']
+
+    @Simulator.particles.setter
+    def particles(self, particles):
+        Simulator.particles.fset(self, particles)
+        self.reset_events()
+
+    def reset_events(self):
+        """
+        Rebuild the event queue from the current state of particles
+
+        :return:
+        """
+        store = self.store
+        self.clock = 0.0
+        self.reference_time = np.zeros(len(self))
+        self.collision_count = np.zeros(len(self), dtype=np.int64)
+        self.resting = np.zeros(len(self), dtype=np.bool_)
+        self.events = []
+        self.event_number = 0
+
+        # particles may be placed slightly out of the box
+        np.clip(store.pos_x, self.x_min, self.x_max, out=store.pos_x)
+        np.clip(store.pos_y, self.y_min, self.y_max, out=store.pos_y)
+        for i in range(len(self)):
+            self.settle(i)
+
+        columns = max(int(self.box_width // interaction_range(
+            self.particle_r)), 1)
+        if len(self):
+            # about a particle per cell
+            columns = min(columns, max(int(self.box_width / sqrt(
+                self.box_width * self.box_height / len(self))), 1))
+        self.cell_size = self.box_width / columns
+        rows = max(int(self.box_height // self.cell_size), 1)
+        self.grid_shape = (columns, rows)
+        (self.cell_x, self.cell_y) = grid_cells(store.pos_x, store.pos_y,
+                                                self.cell_size, columns, rows)
+        self.cells = {}
+        for i in range(len(self)):
+            self.cells.setdefault((int(self.cell_x[i]), int(self.cell_y[i])),
+                                  set()).add(i)
+
+        for i in range(len(self)):
+            self.predict(i)
+
+    def gravity(self, i):
+        """
+        Return the acceleration of gravity the particle is subject to
+
+        :param i: index of the particle
+        :type i: int
+        :return:
+        :rtype: float
+        """
+        return 0.0 if self.resting[i] else self.g
+
+    def positions_at(self, t, rows=None):
+        """
+        Calculate the positions and vertical velocities of the particles (all
+        of them if rows is None) at the provided moment of time
+
+        :param t: moment of time, same origin as clock
+        :type t: float
+        :param rows: indices of the particles
+        :type rows: numpy.ndarray
+        :return: pos_x, pos_y, velocity_y
+        :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        """
+        store = self.store
+        if rows is None:
+            rows = slice(None)
+        dt = t - self.reference_time[rows]
+        g = np.where(self.resting[rows], 0.0, self.g)
+        return (store.pos_x[rows] + store.velocity_x[rows] * dt,
+                store.pos_y[rows] + store.velocity_y[rows] * dt -
+                g * dt * dt / 2,
+                store.velocity_y[rows] - g * dt)
+
+    def synchronize(self, i=None):
+        """
+        Move the particle (all the particles if i is None) to the current
+        moment of time
+
+        :param i: index of the particle
+        :type i: int
+        :return:
+        """
+        store = self.store
+        if i is None:
+            (store.pos_x[:], store.pos_y[:],
+             store.velocity_y[:]) = self.positions_at(self.clock)
+            self.reference_time[:] = self.clock
+            return
+        dt = self.clock - self.reference_time[i]
+        g = self.gravity(i)
+        store.pos_x[i] += store.velocity_x[i] * dt
+        store.pos_y[i] += store.velocity_y[i] * dt - g * dt * dt / 2
+        store.velocity_y[i] -= g * dt
+        self.reference_time[i] = self.clock
+
+    def floor_level(self, pos_x, pos_y):
+        """
+        Return the lowest pos_y of a particle, i.e. the floor of the hole
+        inside the barrier, the floor of the box elsewhere. A particle stuck
+        in the barrier below the hole is pushed out of it sideways instead
+        (see predict_boundary), so the floor of the box is returned.
+
+        :param pos_x: x of the particle
+        :type pos_x: float
+        :param pos_y: y of the particle
+        :type pos_y: float
+        :return:
+        :rtype: float
+        """
+        if (self.barrier_x_min < pos_x < self.barrier_x_max and
+                pos_y > self.hole_y_min - self.particle_r):
+            return self.hole_y_min
+        return self.y_min
+
+    def settle(self, i):
+        """
+        Keep the particle above the floor under it, after its velocity has
+        changed. A particle on the floor moving down bounces off it; if it
+        does not move up afterwards, it rests on the floor.
+
+        The particle must be synchronized.
+
+        :param i: index of the particle
+        :type i: int
+        :return:
+        """
+        store = self.store
+        level = self.floor_level(store.pos_x[i], store.pos_y[i])
+        if store.pos_y[i] > level:
+            self.resting[i] = False
+            return
+        store.pos_y[i] = level
+        if store.velocity_y[i] < 0:
+            store.velocity_y[i] = (-store.velocity_y[i] +
+                                   self.delta_v_bottom)
+        self.resting[i] = store.velocity_y[i] <= 0
+        if self.resting[i]:
+            store.velocity_y[i] = 0.0
+
+    def update_cell(self, i, cell_x=None, cell_y=None):
+        """
+        Move the particle to the provided cell, by default the cell of its
+        current position
+
+        :param i: index of the particle
+        :type i: int
+        :return:
+        """
+        if cell_x is None:
+            (cell_x, cell_y) = grid_cells(
+                self.store.pos_x[i:i + 1], self.store.pos_y[i:i + 1],
+                self.cell_size, *self.grid_shape)
+            (cell_x, cell_y) = (int(cell_x[0]), int(cell_y[0]))
+        cell = (int(self.cell_x[i]), int(self.cell_y[i]))
+        if cell == (cell_x, cell_y):
+            return
+        self.cells[cell].discard(i)
+        self.cells.setdefault((cell_x, cell_y), set()).add(i)
+        self.cell_x[i] = cell_x
+        self.cell_y[i] = cell_y
+
+    def neighbours(self, i):
+        """
+        Return the particles of the particle's own and neighbouring cells,
+        except the particle itself
+
+        :param i: index of the particle
+        :type i: int
+        :return:
+        :rtype: numpy.ndarray
+        """
+        (columns, rows) = self.grid_shape
+        cell_x = int(self.cell_x[i])
+        cell_y = int(self.cell_y[i])
+        cells = self.cells
+        found = []
+        for x in range(max(cell_x - 1, 0), min(cell_x + 2, columns)):
+            for y in range(max(cell_y - 1, 0), min(cell_y + 2, rows)):
+                found.extend(cells.get((x, y), ()))
+        found = np.array(found, dtype=np.intp)
+        return found[found != i]
+
+    def predict_cell(self, i, pos_x, pos_y, velocity_x, velocity_y, g):
+        """
+        Find the moment the particle leaves its cell
+
+        :return: time until the event and the event kind
+        :rtype: (float, int)
+        """
+        (columns, rows) = self.grid_shape
+        cell_size = self.cell_size
+        cell_x = self.cell_x[i]
+        cell_y = self.cell_y[i]
+        candidates = [(inf, CELL_LEFT)]
+        if cell_x > 0 and velocity_x < 0:
+            candidates.append((time_across(pos_x, velocity_x,
+                                           cell_x * cell_size), CELL_LEFT))
+        if cell_x < columns - 1 and velocity_x > 0:
+            candidates.append((time_across(
+                pos_x, velocity_x, (cell_x + 1) * cell_size), CELL_RIGHT))
+        if cell_y > 0:
+            bottom = cell_y * cell_size
+            if pos_y <= bottom and (velocity_y < 0 or
+                                    velocity_y == 0 and g > 0):
+                candidates.append((0.0, CELL_DOWN))
+            else:
+                candidates.append((time_down_to(max(pos_y, bottom),
+                                                velocity_y, g, bottom),
+                                   CELL_DOWN))
+        if cell_y < rows - 1:
+            top = (cell_y + 1) * cell_size
+            candidates.append((time_up_to(min(pos_y, top), velocity_y, g,
+                                          top), CELL_UP))
+        return min(candidates)
+
+    def predict_boundary(self, pos_x, pos_y, velocity_x, velocity_y, g):
+        """
+        Find the earliest collision of a particle with the walls or the
+        barrier
+
+        :return: time until the event and the event kind
+        :rtype: (float, int)
+        """
+        candidates = [
+            (time_across(pos_x, velocity_x, self.x_min) if velocity_x < 0
+             else inf, WALL_LEFT),
+            (time_across(pos_x, velocity_x, self.x_max) if velocity_x > 0
+             else inf, WALL_RIGHT),
+            (time_down_to(pos_y, velocity_y, g, self.y_min), FLOOR),
+            (time_up_to(pos_y, velocity_y, g, self.y_max), CEILING),
+        ]
+
+        barrier_x_min = self.barrier_x_min
+        barrier_x_max = self.barrier_x_max
+        inside = ((barrier_x_min < pos_x or velocity_x > 0 and
+                   pos_x == barrier_x_min) and
+                  (pos_x < barrier_x_max or velocity_x < 0 and
+                   pos_x == barrier_x_max))
+        if inside:
+            if not self.hole_y_min <= pos_y <= self.hole_y_max:
+                # The particle is stuck in the barrier, push it out
+                return 0.0, BARRIER
+            candidates.append(
+                (time_across(pos_x, velocity_x, barrier_x_max
+                             if velocity_x > 0 else barrier_x_min),
+                 HOLE_EXIT))
+            candidates.append(
+                (time_up_to(pos_y, velocity_y, g, self.hole_y_max),
+                 HOLE_ROOF))
+            candidates.append(
+                (time_down_to(pos_y, velocity_y, g, self.hole_y_min),
+                 HOLE_FLOOR))
+        elif pos_x <= barrier_x_min and velocity_x > 0:
+            candidates.append(
+                (time_across(pos_x, velocity_x, barrier_x_min), BARRIER))
+        elif pos_x >= barrier_x_max and velocity_x < 0:
+            candidates.append(
+                (time_across(pos_x, velocity_x, barrier_x_max), BARRIER))
+        return min(candidates)
+
+    def predict_pair(self, i, pos_x, pos_y, velocity_x, velocity_y, g):
+        """
+        Find the earliest collision of the particle with another particle of
+        its neighbourhood
+
+        :param i: index of the particle
+        :type i: int
+        :return: time until the collision and the index of the other
+        particle, (inf, -1) if there is no collision
+        :rtype: (float, int)
+        """
+        others = self.neighbours(i)
+        if not others.shape[0]:
+            return inf, -1
+        store = self.store
+        (others_x, others_y, others_velocity_y) = self.positions_at(
+            self.clock, others)
+        d_x = others_x - pos_x
+        d_y = others_y - pos_y
+        d_v_x = store.velocity_x[others] - velocity_x
+        d_v_y = others_velocity_y - velocity_y
+        # relative acceleration, if only one of the particles rests
+        a_y = g - np.where(self.resting[others], 0.0, self.g)
+        sigma_squared = (2 * self.particle_r) ** 2
+
+        b = d_x * d_v_x + d_y * d_v_y
+        v_squared = d_v_x * d_v_x + d_v_y * d_v_y
+        r_squared = d_x * d_x + d_y * d_y
+        discriminant = b * b - v_squared * (r_squared - sigma_squared)
+        # Overlapping particles are not checked, allowing a rounding error
+        # for particles that have just touched
+        apart = r_squared >= sigma_squared * (1 - 1e-9)
+        valid = apart & (b < 0) & (discriminant >= 0) & (a_y == 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            times = np.where(valid, -(b + np.sqrt(discriminant)) / v_squared,
+                             inf)
+        for k in np.flatnonzero(apart & (a_y != 0)):
+            times[k] = time_to_contact(d_x[k], d_y[k], d_v_x[k], d_v_y[k],
+                                       a_y[k], sigma_squared)
+        k = int(np.argmin(times))
+        if times[k] == inf:
+            return inf, -1
+        return max(float(times[k]), 0.0), int(others[k])
+
+    def predict(self, i):
+        """
+        Predict the next event of the particle and put it in the queue
+
+        :param i: index of the particle
+        :type i: int
+        :return:
+        """
+        store = self.store
+        dt = self.clock - self.reference_time[i]
+        g = self.gravity(i)
+        pos_x = float(store.pos_x[i] + store.velocity_x[i] * dt)
+        pos_y = float(store.pos_y[i] + store.velocity_y[i] * dt -
+                      g * dt * dt / 2)
+        velocity_x = float(store.velocity_x[i])
+        velocity_y = float(store.velocity_y[i] - g * dt)
+        motion = (pos_x, pos_y, velocity_x, velocity_y, g)
+        time, kind = min(self.predict_boundary(*motion),
+                         self.predict_cell(i, *motion))
+        j = -1
+        pair_time, other = self.predict_pair(i, *motion)
+        if pair_time < time:
+            time, kind, j = pair_time, PAIR, other
+        if time == inf:
+            return
+        self.event_number += 1
+        heapq.heappush(self.events, (
+            self.clock + time, self.event_number, kind, i, j,
+            int(self.collision_count[i]),
+            int(self.collision_count[j]) if j >= 0 else 0))
+
+    def peek_event(self):
+        """
+        Drop obsolete events from the top of the queue and return the next
+        valid one
+
+        :return: the event, None if there are no events left
+        """
+        events = self.events
+        collision_count = self.collision_count
+        while events:
+            event = events[0]
+            (time, _, kind, i, j, count_i, count_j) = event
+            if collision_count[i] != count_i:
+                heapq.heappop(events)
+            elif j >= 0 and collision_count[j] != count_j:
+                # The partner has changed its course, so the particle is
+                # left without a prediction
+                heapq.heappop(events)
+                self.predict(i)
+            else:
+                return event
+        return None
+
+    def process_event(self, event):
+        """
+        Advance the clock to the event and change the velocities of the
+        particles involved
+
+        :return:
+        """
+        heapq.heappop(self.events)
+        (time, _, kind, i, j, _, _) = event
+        self.clock = max(self.clock, time)
+        self.synchronize(i)
+        if kind in CELL_KINDS:
+            # the course of the particle does not change, so the predictions
+            # of the others stay valid
+            (step_x, step_y) = CELL_STEPS[kind]
+            self.update_cell(i, int(self.cell_x[i]) + step_x,
+                             int(self.cell_y[i]) + step_y)
+            self.predict(i)
+            return
+        if kind == PAIR:
+            self.synchronize(j)
+            self.collide(i, j)
+            self.collision_count[j] += 1
+            self.settle(j)
+            self.update_cell(j)
+        else:
+            self.bounce(i, kind)
+        self.collision_count[i] += 1
+        self.settle(i)
+        self.update_cell(i)
+        self.predict(i)
+        if kind == PAIR:
+            self.predict(j)
+
+    def collide(self, i, j):
+        """
+        Resolve the collision of two touching particles
+
+        :return:
+        """
+        store = self.store
+        d_x = store.pos_x[j] - store.pos_x[i]
+        d_y = store.pos_y[j] - store.pos_y[i]
+        distance = sqrt(d_x * d_x + d_y * d_y)
+        n_x = d_x / distance
+        n_y = d_y / distance
+        impulse = ((store.velocity_x[j] - store.velocity_x[i]) * n_x +
+                   (store.velocity_y[j] - store.velocity_y[i]) * n_y)
+        speed_factor = 1 - self.v_loss
+        store.velocity_x[i] = (store.velocity_x[i] +
+                               impulse * n_x) * speed_factor
+        store.velocity_y[i] = (store.velocity_y[i] +
+                               impulse * n_y) * speed_factor
+        store.velocity_x[j] = (store.velocity_x[j] -
+                               impulse * n_x) * speed_factor
+        store.velocity_y[j] = (store.velocity_y[j] -
+                               impulse * n_y) * speed_factor
+
+    def bounce(self, i, kind):
+        """
+        Resolve the collision of the particle with the walls or the barrier
+
+        :return:
+        """
+        store = self.store
+        pos_x = store.pos_x[i]
+        velocity_x = store.velocity_x[i]
+        velocity_y = store.velocity_y[i]
+        if kind == WALL_LEFT:
+            store.pos_x[i] = self.x_min
+            if velocity_x < 0:
+                store.velocity_x[i] = -velocity_x + self.delta_v_side
+        elif kind == WALL_RIGHT:
+            store.pos_x[i] = self.x_max
+            if velocity_x > 0:
+                store.velocity_x[i] = -velocity_x - self.delta_v_side
+        elif kind == FLOOR:
+            store.pos_y[i] = self.y_min
+            if velocity_y <= 0:
+                store.velocity_y[i] = -velocity_y + self.delta_v_bottom
+        elif kind == CEILING:
+            store.pos_y[i] = self.y_max
+            if velocity_y > 0:
+                store.velocity_y[i] = -velocity_y - self.delta_v_top
+        elif kind == BARRIER:
+            from_left = pos_x < self.barrier_x
+            store.pos_x[i] = (self.barrier_x_min if from_left
+                              else self.barrier_x_max)
+            if not self.hole_y_min <= store.pos_y[i] <= self.hole_y_max:
+                if from_left and velocity_x > 0:
+                    store.velocity_x[i] = -velocity_x - self.delta_v_side
+                elif not from_left and velocity_x < 0:
+                    store.velocity_x[i] = -velocity_x + self.delta_v_side
+        elif kind == HOLE_EXIT:
+            store.pos_x[i] = (self.barrier_x_max if velocity_x > 0
+                              else self.barrier_x_min)
+        elif kind == HOLE_ROOF:
+            store.pos_y[i] = self.hole_y_max
+            if velocity_y > 0:
+                store.velocity_y[i] = -velocity_y - self.delta_v_top
+        elif kind == HOLE_FLOOR:
+            store.pos_y[i] = self.hole_y_min
+            if velocity_y <= 0:
+                store.velocity_y[i] = -velocity_y + self.delta_v_bottom
+
+    def advance_to(self, t):
+        """
+        Process all the events up to the provided moment of time, then move
+        all the particles to it
+
+        :param t: moment of time, same origin as clock
+        :type t: float
+        :return:
+        """
+        event = self.peek_event()
+        while event is not None and event[0] <= t:
+            self.process_event(event)
+            self.steps += 1
+            event = self.peek_event()
+        self.clock = max(self.clock, t)
+        self.synchronize()
+
+    def next_state(self):
+        """
+        Process the next event
+
+        :return: period of time between the previous and the current state
+        :rtype: float
+        """
+        start = self.clock
+        event = self.peek_event()
+        if event is None:
+            return 0.0
+        self.process_event(event)
+        self.synchronize()
+        time_step = self.clock - start
+        self.time_elapsed += time_step
+        return time_step
+
+    def snapshot_times(self, num_seconds, num_snapshots, start_time=None,
+                       start_snapshot=0):
+        """
+        Simulate particle movement for the provided number of seconds, yield
+        the time and the state of every snapshot, see
+        Simulator.snapshot_times. The simulator is advanced exactly to the
+        requested moments of time, the state is its store
+
+        :param num_seconds: number of seconds to simulate
+        :type num_seconds: float
+        :param num_snapshots: number of snapshots to save in one second (frequency)
+        :type num_snapshots: float
+        :param start_time: time_elapsed at the start, defaults to the current
+        :type start_time: float
+        :param start_snapshot: number of snapshots already taken
+        :type start_snapshot: int
+        :return:
+        """
+        if start_time is None:
+            start_time = self.time_elapsed
+        start = self.clock - (self.time_elapsed - start_time)
+        for t in range(start_snapshot + 1,
+                       floor(num_seconds * num_snapshots) + 1):
+            snap_second = 1 / num_snapshots * t
+            self.advance_to(start + snap_second)
+            self.time_elapsed = start_time + snap_second
+            yield (snap_second, self.store)
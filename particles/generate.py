@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+"""Headless generation of recordings.
+
+Takes the arguments of the former pib-generate program in the same order::
+
+    python -m particles.generate n_left n_right particle_r v_init v_loss \\
+        box_width box_height barrier_x barrier_width hole_y hole_height \\
+        delta_v_top delta_v_bottom delta_v_side g min_to_simulate fps \\
+        output_file
+
+and writes the recording with Simulator.simulate_to_file. Progress is
+reported on stdout as JSON lines with the fields:
+
+    * status - "running", "done" or "interrupted"
+    * progress - percentage of the simulated time
+    * time - seconds simulated
+    * snapshots - number of snapshots written
+    * steps - number of simulation steps performed
+    * steps_per_second - steps performed per second of wall time
+    * wall_seconds - seconds since the start
+
+SIGINT and SIGTERM stop the simulation after the current snapshot, the
+recording is flushed and closed, then the program exits with EXIT_INTERRUPTED.
+"""
+
+import argparse
+import json
+import signal
+import sys
+import time
+
+from particles.recording import COMPRESSIONS, load_checkpoint
+from particles.simulation import Simulator
+
+POSITIONAL = (('n_left', int), ('n_right', int), ('particle_r', float),
+              ('v_init', float), ('v_loss', float), ('box_width', float),
+              ('box_height', float), ('barrier_x', float),
+              ('barrier_width', float), ('hole_y', float),
+              ('hole_height', float), ('delta_v_top', float),
+              ('delta_v_bottom', float), ('delta_v_side', float),
+              ('g', float), ('min_to_simulate', float), ('fps', float),
+              ('output_file', str))
+
+EXIT_INTERRUPTED = 130
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m particles.generate",
+        description="Simulate particles in a box and record the simulation")
+    for (name, type_) in POSITIONAL:
+        parser.add_argument(name, type=type_)
+    parser.add_argument("--engine", default='numpy')
+    parser.add_argument("--broad-phase", default='all')
+    parser.add_argument("--max-block-level", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--compression", default=None,
+                        choices=sorted(COMPRESSIONS),
+                        help="write a version 2 recording, see "
+                             "particles.recording")
+    parser.add_argument("--quantise", action="store_true",
+                        help="store positions of a version 2 recording as "
+                             "float32")
+    parser.add_argument("--delta", action="store_true",
+                        help="delta encode snapshots of a version 2 "
+                             "recording")
+    parser.add_argument("--checkpoint-interval", type=int, default=None,
+                        help="number of snapshots between checkpoints")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue the recording from its checkpoint")
+    parser.add_argument("--stats", action="store_true",
+                        help="write the per-phase statistics next to the "
+                             "recording, see particles.stats")
+    parser.add_argument("--observables", action="store_true",
+                        help="write the observables of every snapshot next "
+                             "to the recording, see particles.observables")
+    parser.add_argument("--report-interval", type=float, default=0.5,
+                        help="seconds of wall time between progress lines")
+    return parser
+
+
+class Progress:
+    """Reporter of the progress as JSON lines.
+
+    :param output: text stream
+    :param num_seconds: number of seconds to simulate
+    :type num_seconds: float
+    :param interval: seconds of wall time between lines
+    :type interval: float
+    """
+
+    __slots__ = ['output', 'num_seconds', 'interval', 'start', 'last']
+
+    def __init__(self, output, num_seconds, interval):
+        self.output = output
+        self.num_seconds = num_seconds
+        self.interval = interval
+        self.start = time.perf_counter()
+        self.last = None
+
+    def report(self, status, simulator, start_time, snapshots, force=False):
+        """
+        Write a line, unless the previous one was written less than interval
+        seconds ago and force is not set
+
+        :return:
+        """
+        now = time.perf_counter()
+        if not force and self.last is not None and \
+                now - self.last < self.interval:
+            return
+        self.last = now
+        wall_seconds = now - self.start
+        simulated = simulator.time_elapsed - start_time
+        line = {'status': status,
+                'progress': (100 * min(simulated / self.num_seconds, 1)
+                             if self.num_seconds else 100),
+                'time': simulated,
+                'snapshots': snapshots,
+                'steps': simulator.steps,
+                'steps_per_second': (simulator.steps / wall_seconds
+                                     if wall_seconds else 0.0),
+                'wall_seconds': wall_seconds}
+        self.output.write(json.dumps(line) + "\n")
+        self.output.flush()
+
+
+def main(arguments=None, output=sys.stdout):
+    args = make_parser().parse_args(arguments)
+    num_seconds = args.min_to_simulate * 60
+    options = {'engine': args.engine, 'broad_phase': args.broad_phase,
+               'max_block_level': args.max_block_level,
+               'workers': args.workers, 'profile': args.stats}
+    if args.resume:
+        simulator = Simulator.resume(args.output_file, **options)
+        start_time = load_checkpoint(args.output_file)['start_time']
+    else:
+        simulator = Simulator(
+            box_width=args.box_width, box_height=args.box_height,
+            delta_v_top=args.delta_v_top, delta_v_bottom=args.delta_v_bottom,
+            delta_v_side=args.delta_v_side, barrier_x=args.barrier_x,
+            barrier_width=args.barrier_width, hole_y=args.hole_y,
+            hole_height=args.hole_height, v_loss=args.v_loss,
+            particle_r=args.particle_r, n_left=args.n_left,
+            n_right=args.n_right, v_init=args.v_init, g=args.g, **options)
+        start_time = simulator.time_elapsed
+
+    stopped = []
+
+    def stop(signum, frame):
+        stopped.append(signum)
+
+    handlers = {signum: signal.signal(signum, stop)
+                for signum in (signal.SIGINT, signal.SIGTERM)}
+    progress = Progress(output, num_seconds, args.report_interval)
+    recording = simulator.simulate_to_file(
+        args.output_file, num_seconds, args.fps,
+        compression=args.compression, quantise=args.quantise,
+        delta=args.delta,
+        checkpoint_interval=args.checkpoint_interval, resume=args.resume,
+        record_stats=args.stats, record_observables=args.observables)
+    snapshots = 0
+    try:
+        for _ in recording:
+            snapshots += 1
+            if stopped:
+                break
+            progress.report("running", simulator, start_time, snapshots)
+    finally:
+        # closing the recording writes the buffered snapshots
+        recording.close()
+        simulator.close()
+        for (signum, handler) in handlers.items():
+            signal.signal(signum, handler)
+    progress.report("interrupted" if stopped else "done", simulator,
+                    start_time, snapshots, force=True)
+    return EXIT_INTERRUPTED if stopped else 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+"""Compiled kernels of the simulation phases.
+
+The kernels work on the (4, N) float block of a ParticleStore (rows are
+pos_x, pos_y, velocity_x, velocity_y) and repeat the reference loops of
+particles.engines.PythonEngine statement by statement, so their results are
+bit-compatible with it.
+
+The kernels are compiled with numba if it is installed. Otherwise they are
+plain Python functions, which gives the same results, only slower.
+"""
+
+from math import sqrt
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+JIT_AVAILABLE = njit is not None
+
+
+def jit(function):
+    """Compile the function with numba, if it is available.
+
+    :param function: kernel to compile
+    :return: the compiled kernel or the function itself
+    """
+    if njit is None:
+        return function
+    return njit(cache=True)(function)
+
+
+@jit
+def move(data, time_step, g):
+    gravity_pull = g * (time_step ** 2) / 2
+    for i in range(data.shape[1]):
+        data[0, i] += data[2, i] * time_step
+        data[1, i] += data[3, i] * time_step - gravity_pull
+        data[3, i] -= g * time_step
+
+
+@jit
+def move_rows(data, rows, time_steps, g):
+    for k in range(rows.shape[0]):
+        i = rows[k]
+        time_step = time_steps[k]
+        data[0, i] += data[2, i] * time_step
+        data[1, i] += data[3, i] * time_step - g * (time_step ** 2) / 2
+        data[3, i] -= g * time_step
+
+
+@jit
+def collide_pair(data, i, j, particle_r, speed_factor):
+    """Check two particles for collision and resolve it.
+
+    :return: 1 if the particles collided, 0 otherwise
+    """
+    particle_r_2 = particle_r * 2
+    dy = data[1, i] - data[1, j]
+    if abs(dy) > particle_r_2:
+        return 0
+    dx = data[0, i] - data[0, j]
+    distance_between_particles = sqrt(dx ** 2 + dy ** 2)
+    if not distance_between_particles < particle_r ** 2:
+        return 0
+
+    if data[0, i] < data[0, j]:
+        d_v_x = data[2, i] - data[2, j]
+    else:
+        d_v_x = data[2, j] - data[2, i]
+    if data[1, i] < data[1, j]:
+        d_v_y = data[3, i] - data[3, j]
+    else:
+        d_v_y = data[3, j] - data[3, i]
+    if not (d_v_x > 0 or d_v_y > 0):
+        return 0
+
+    data[2, i] *= speed_factor
+    data[3, i] *= speed_factor
+    data[2, j] *= speed_factor
+    data[3, j] *= speed_factor
+
+    distance_to_move = particle_r_2 - distance_between_particles
+    if dy > 0:
+        data[0, i] += distance_to_move * (dx / distance_between_particles)
+        data[1, i] += distance_to_move * (dy / distance_between_particles)
+    else:
+        data[0, j] -= distance_to_move * (dx / distance_between_particles)
+        data[1, j] -= distance_to_move * (dy / distance_between_particles)
+    return 1
+
+
+@jit
+def collide_pairs(data, first, second, particle_r, speed_factor):
+    collisions = 0
+    for k in range(first.shape[0]):
+        collisions += collide_pair(data, first[k], second[k], particle_r,
+                                   speed_factor)
+    return collisions
+
+
+@jit
+def collide_all_pairs(data, active, particle_r, speed_factor):
+    collisions = 0
+    size = data.shape[1]
+    for i in range(size):
+        for j in range(i + 1, size):
+            if active[i] or active[j]:
+                collisions += collide_pair(data, i, j, particle_r,
+                                           speed_factor)
+    return collisions
+
+
+@jit
+def collide_walls(data, active, x_min, x_max, y_min, y_max, barrier_x,
+                  barrier_x_min, barrier_x_max, barrier_x_left,
+                  barrier_x_right, hole_y_min, hole_y_max, delta_v_top,
+                  delta_v_bottom, delta_v_side):
+    for i in range(data.shape[1]):
+        if not active[i]:
+            continue
+        pos_x = data[0, i]
+        pos_y = data[1, i]
+        velocity_x = data[2, i]
+        velocity_y = data[3, i]
+        if pos_y > y_max and velocity_y > 0:  # box ceiling
+            data[1, i] = y_max
+            data[3, i] = -velocity_y - delta_v_top
+        elif pos_y < y_min and velocity_y < 0:  # box floor
+            data[1, i] = y_min
+            data[3, i] = -velocity_y + delta_v_bottom
+
+        if pos_x > x_max and velocity_x > 0:  # box right side
+            data[0, i] = x_max
+            data[2, i] = -velocity_x - delta_v_side
+        elif pos_x < x_min and velocity_x < 0:  # box left side
+            data[0, i] = x_min
+            data[2, i] = -velocity_x + delta_v_side
+        elif barrier_x_min < pos_x < barrier_x_max:  # barrier collisions
+            velocity_y = data[3, i]
+            pos_y = data[1, i]
+            if barrier_x_left < pos_x < barrier_x_right:  # inside hole
+                if pos_y > hole_y_min and velocity_y > 0:
+                    data[1, i] = hole_y_min
+                    data[3, i] = -velocity_y - delta_v_top
+                elif pos_y < hole_y_max and velocity_y < 0:
+                    data[1, i] = hole_y_max
+                    data[3, i] = -velocity_y + delta_v_bottom
+            elif pos_y < hole_y_max or pos_y > hole_y_min:
+                if pos_x < barrier_x:
+                    data[0, i] = barrier_x_min
+                    data[2, i] = -data[2, i] - delta_v_side
+                else:
+                    data[0, i] = barrier_x_max
+                    data[2, i] = -data[2, i] + delta_v_side
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+"""Thermodynamic observables of the simulation.
+
+The observables of a state are computed from the whole store at once (see
+measure) and stored as a record of OBSERVABLES_DTYPE:
+
+    * time - time of the snapshot, as recorded with it
+    * kinetic_energy, potential_energy - total energy of the particles, per
+    unit of mass. the potential energy is measured from y = 0
+    * temperature - mean kinetic energy of a particle, in units where the
+    particle mass and the Boltzmann constant are 1 (two degrees of freedom)
+    * population - number of particles by side of origin (the low bit of the
+    id) and current side of the barrier, population[origin][side], 0 being
+    the left side
+    * speed_edges, speed_counts - histogram of the speeds, from 0 to the
+    largest speed
+    * height_edges, height_counts - histogram of pos_y, over its range
+
+Simulator.simulate_to_file can write the observables of every snapshot next
+to the recording (see observables_path): OBSERVABLES_MAGIC followed by a
+record per snapshot, the first one being the initial state.
+"""
+
+import os
+
+import numpy as np
+
+BINS = 20
+
+OBSERVABLES_MAGIC = b"PIBOBS\x00\x01"
+OBSERVABLES_MAGIC_SIZE = len(OBSERVABLES_MAGIC)
+
+OBSERVABLES_DTYPE = np.dtype([('time', '<f8'),
+                              ('kinetic_energy', '<f8'),
+                              ('potential_energy', '<f8'),
+                              ('temperature', '<f8'),
+                              ('population', '<i8', (2, 2)),
+                              ('speed_edges', '<f8', (BINS + 1,)),
+                              ('speed_counts', '<i8', (BINS,)),
+                              ('height_edges', '<f8', (BINS + 1,)),
+                              ('height_counts', '<i8', (BINS,))])
+
+
+def measure(simulator, time, out=None, store=None):
+    """Compute the observables of a state of the simulator.
+
+    :param simulator:
+    :type simulator: particles.simulation.Simulator
+    :param time: time of the state
+    :type time: float
+    :param out: record to fill, a new one by default
+    :type out: numpy.void
+    :param store: the state, by default the simulator's store
+    :type store: particles.core.ParticleStore
+    :return:
+    :rtype: numpy.void
+    """
+    if out is None:
+        out = np.zeros(1, dtype=OBSERVABLES_DTYPE)[0]
+    if store is None:
+        store = simulator.store
+    squared_speed = store.velocity_x ** 2 + store.velocity_y ** 2
+    speed = np.sqrt(squared_speed)
+    kinetic_energy = float(squared_speed.sum()) / 2
+
+    out['time'] = time
+    out['kinetic_energy'] = kinetic_energy
+    out['potential_energy'] = simulator.g * float(store.pos_y.sum())
+    out['temperature'] = kinetic_energy / len(store) if len(store) else 0.0
+    out['population'] = np.bincount(
+        2 * (store.id & 1) + (store.pos_x > simulator.barrier_x),
+        minlength=4).reshape(2, 2)
+    max_speed = float(speed.max()) if len(store) else 0.0
+    (out['speed_counts'], out['speed_edges']) = np.histogram(
+        speed, bins=BINS, range=(0.0, max_speed or 1.0))
+    (out['height_counts'], out['height_edges']) = np.histogram(
+        store.pos_y, bins=BINS)
+    return out
+
+
+def histogram_density(counts, edges):
+    """Normalize a histogram so that it integrates to 1, like
+    numpy.histogram(..., density=True).
+
+    :param counts: number of values in every bin
+    :type counts: numpy.ndarray
+    :param edges: edges of the bins
+    :type edges: numpy.ndarray
+    :return:
+    :rtype: numpy.ndarray
+    """
+    total = counts.sum()
+    if not total:
+        return np.zeros(counts.shape)
+    return counts / (total * np.diff(edges))
+
+
+def observables_path(file_path):
+    """Return the path to the observables of the recording.
+
+    :param file_path: path to the recording
+    :type file_path: str
+    :return:
+    :rtype: str
+    """
+    return file_path + ".observables"
+
+
+class ObservablesWriter:
+    """Writer of the observables of a recording.
+
+    :param file: binary file open for writing
+    :param resume: keep the first `resume` records and continue after them,
+    None to start a new file
+    :type resume: int
+    """
+
+    __slots__ = ['file', 'record']
+
+    def __init__(self, file, resume=None):
+        self.file = file
+        self.record = np.zeros(1, dtype=OBSERVABLES_DTYPE)
+        if resume is None:
+            file.write(OBSERVABLES_MAGIC)
+        else:
+            file.seek(OBSERVABLES_MAGIC_SIZE +
+                      resume * OBSERVABLES_DTYPE.itemsize)
+            file.truncate()
+
+    def write(self, simulator, time, store=None):
+        """
+        Compute and append the observables of a state of the simulator
+
+        :param simulator:
+        :type simulator: particles.simulation.Simulator
+        :param time: time of the snapshot
+        :type time: float
+        :param store: the state, by default the simulator's store
+        :type store: particles.core.ParticleStore
+        :return:
+        """
+        measure(simulator, time, self.record[0], store)
+        self.file.write(self.record.tobytes())
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def load_observables(file_path):
+    """Read the observables written next to the recording.
+
+    The records are mapped into memory rather than read, so loading them
+    again while the recording is being written is cheap. A record that is
+    not completely written yet is ignored.
+
+    :param file_path: path to the recording
+    :type file_path: str
+    :return: a record per snapshot, None if the recording has none
+    :rtype: numpy.ndarray
+    """
+    path = observables_path(file_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        if f.read(OBSERVABLES_MAGIC_SIZE) != OBSERVABLES_MAGIC:
+            raise ValueError("{path} is not an observables file".format(
+                path=path))
+        size = os.fstat(f.fileno()).st_size - OBSERVABLES_MAGIC_SIZE
+    count = size // OBSERVABLES_DTYPE.itemsize
+    if not count:
+        return np.zeros(0, dtype=OBSERVABLES_DTYPE)
+    return np.memmap(path, dtype=OBSERVABLES_DTYPE, mode='r',
+                     offset=OBSERVABLES_MAGIC_SIZE, shape=(count,))
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+"""Parallel particle-to-particle collision resolution.
+
+The box is split into vertical strips, one per worker process. Particle data
+lives in shared memory, so the workers read and write it directly. A worker
+resolves the collisions between the particles of its strip and writes back
+only the rows of those particles, so the workers never touch the same row.
+
+The pairs of particles from different strips can only be found near the
+cuts between strips. These particles (the halo) are collected by the main
+process, which resolves their collisions after all the workers are done.
+"""
+
+import multiprocessing
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from particles.broadphase import grid_pairs, interaction_range
+from particles.engines import resolve_pairs
+
+# Shared particle data of the worker process, set by attach_shared_data
+_shared_data = None
+
+
+def attach_shared_data(buffer, size):
+    """Initialize a worker process with the shared particle data.
+
+    :param buffer: shared float64 buffer of 4 * size elements
+    :type buffer: multiprocessing.sharedctypes.RawArray
+    :param size: number of particles
+    :type size: int
+    :return:
+    """
+    global _shared_data
+    _shared_data = np.frombuffer(buffer, dtype=np.float64).reshape(4, size)
+
+
+def collide_strip(rows, active, particle_r, speed_factor):
+    """Resolve collisions between the particles of a strip.
+
+    Runs in a worker process.
+
+    :param rows: rows of the particles of the strip, in ascending order
+    :type rows: numpy.ndarray
+    :param active: mask of active particles of the strip, None if all are
+    active
+    :type active: numpy.ndarray
+    :param particle_r: particle radius (meters)
+    :type particle_r: float
+    :param speed_factor: ratio of velocity kept after a collision
+    :type speed_factor: float
+    :return: number of collisions
+    :rtype: int
+    """
+    strip = _shared_data[:, rows]
+    first, second = grid_pairs(strip[0], strip[1],
+                               interaction_range(particle_r), active)
+    collisions = resolve_pairs(strip, first, second, particle_r,
+                               speed_factor)
+    if collisions:
+        _shared_data[:, rows] = strip
+    return collisions
+
+
+class StripPool:
+    """Process pool resolving particle collisions strip by strip.
+
+    The cuts between strips are chosen so that every strip holds about the
+    same number of particles; the cut closest to the barrier is moved to
+    barrier_x, since few particles interact across the barrier.
+
+    The pool moves the simulator's store into shared memory. If the store is
+    replaced, the data is moved again on the next step, and if the number of
+    particles changes, the worker processes are restarted.
+
+    The worker processes are stopped by close(), when leaving a with block,
+    or at the latest when the pool is garbage collected.
+    """
+
+    __slots__ = ['simulator', 'workers', 'executor', 'shared_buffer',
+                 'shared_data', 'finalizer', '__weakref__']
+
+    def __init__(self, simulator, workers):
+        self.simulator = simulator
+        self.workers = workers
+        self.executor = None
+        self.shared_buffer = None
+        self.shared_data = None
+        self.finalizer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def prepare(self):
+        """Make sure the store is in shared memory and the workers are up.
+
+        :return:
+        """
+        store = self.simulator.store
+        size = len(store)
+        if self.shared_data is None or self.shared_data.shape[1] != size:
+            self.close()
+            self.shared_buffer = multiprocessing.RawArray('d', 4 * size)
+            self.shared_data = np.frombuffer(
+                self.shared_buffer, dtype=np.float64).reshape(4, size)
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=attach_shared_data,
+                initargs=(self.shared_buffer, size))
+            # must not refer to the pool, or it would never be collected
+            self.finalizer = weakref.finalize(self, self.executor.shutdown)
+        if store.data is not self.shared_data:
+            store.use_buffer(self.shared_data)
+
+    def cuts(self):
+        """Calculate x coordinates of the cuts between strips.
+
+        :return:
+        :rtype: numpy.ndarray
+        """
+        simulator = self.simulator
+        cuts = np.quantile(simulator.store.pos_x,
+                           np.arange(1, self.workers) / self.workers)
+        cuts[np.argmin(np.abs(cuts - simulator.barrier_x))] = \
+            simulator.barrier_x
+        return np.sort(cuts)
+
+    def collide_particles(self, active=None):
+        """Resolve particle-to-particle collisions in parallel.
+
+        :param active: mask of active particles, None if all are active
+        :type active: numpy.ndarray
+        :return: number of collisions
+        :rtype: int
+        """
+        self.prepare()
+        simulator = self.simulator
+        store = simulator.store
+        particle_r = simulator.particle_r
+        speed_factor = 1 - simulator.v_loss
+        reach = interaction_range(particle_r)
+
+        cuts = self.cuts()
+        strips = np.searchsorted(cuts, store.pos_x, side='right')
+        futures = []
+        for strip in range(self.workers):
+            rows = np.flatnonzero(strips == strip)
+            if rows.shape[0] < 2:
+                continue
+            futures.append(self.executor.submit(
+                collide_strip, rows,
+                None if active is None else active[rows],
+                particle_r, speed_factor))
+        collisions = sum(future.result() for future in futures)
+
+        # Halo: pairs across the cuts
+        pos_x = store.pos_x
+        halo = np.flatnonzero(
+            np.min(np.abs(pos_x[:, None] - cuts[None, :]), axis=1) < reach)
+        first, second = grid_pairs(pos_x[halo], store.pos_y[halo], reach,
+                                   None if active is None else active[halo])
+        first = halo[first]
+        second = halo[second]
+        across = strips[first] != strips[second]
+        first = first[across]
+        second = second[across]
+        pair_order = np.lexsort((second, first))
+        collisions += resolve_pairs(store.data, first[pair_order],
+                                    second[pair_order], particle_r,
+                                    speed_factor)
+        return collisions
+
+    def close(self):
+        """Shut the worker processes down.
+
+        The store keeps using the shared buffer, which is released once it
+        is no longer referenced. The workers are started again if the pool is
+        used afterwards.
+
+        :return:
+        """
+        if self.finalizer is not None:
+            self.finalizer()
+            self.finalizer = None
+        self.executor = None
+        self.shared_buffer = None
+        self.shared_data = None
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+"""Placement of non-overlapping particles."""
+
+from math import floor, sqrt
+
+import numpy as np
+
+from particles.broadphase import grid_pairs
+
+
+def place_points(rng, count, x_min, x_max, y_min, y_max, min_distance,
+                 max_rounds=20):
+    """Place points uniformly within a rectangle, at least min_distance apart.
+
+    Points are thrown in batches (Poisson-disk dart throwing). The pairs of
+    close points are found with a uniform grid (see grid_pairs) among the
+    points placed so far and the new batch, and a candidate is dropped if it
+    is too close to any point placed before it or to an earlier candidate.
+
+    If the rectangle is too crowded to be filled in max_rounds batches, or a
+    batch places less than an eighth of the missing points, the points are
+    put on random sites of a square lattice instead, each shifted by less
+    than half the spare space between the sites.
+
+    :param rng: random number generator
+    :type rng: numpy.random.Generator
+    :param count: number of points
+    :type count: int
+    :param x_min: left edge of the rectangle
+    :type x_min: float
+    :param x_max: right edge of the rectangle
+    :type x_max: float
+    :param y_min: bottom edge of the rectangle
+    :type y_min: float
+    :param y_max: top edge of the rectangle
+    :type y_max: float
+    :param min_distance: smallest allowed distance between points
+    :type min_distance: float
+    :param max_rounds: number of batches before switching to the lattice
+    :type max_rounds: int
+    :return: x and y coordinates of the points
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    if count and (x_max < x_min or y_max < y_min):
+        raise ValueError("the rectangle is empty")
+    pos_x = np.empty(0)
+    pos_y = np.empty(0)
+    for _ in range(max_rounds):
+        missing = count - pos_x.shape[0]
+        if not missing:
+            return pos_x, pos_y
+        batch = 2 * missing + 16
+        all_x = np.concatenate((pos_x, rng.uniform(x_min, x_max, batch)))
+        all_y = np.concatenate((pos_y, rng.uniform(y_min, y_max, batch)))
+        rejected = np.zeros(all_x.shape[0], dtype=bool)
+        if min_distance > 0:
+            (first, second) = grid_pairs(all_x, all_y, min_distance)
+            close = (np.hypot(all_x[first] - all_x[second],
+                              all_y[first] - all_y[second]) < min_distance)
+            # first < second, so the later point of a close pair is dropped
+            rejected[second[close]] = True
+        accepted = np.flatnonzero(~rejected)[:count]
+        pos_x = all_x[accepted]
+        pos_y = all_y[accepted]
+        if count - pos_x.shape[0] > missing * 7 / 8:
+            break
+    if pos_x.shape[0] == count:
+        return pos_x, pos_y
+    return place_on_lattice(rng, count, x_min, x_max, y_min, y_max,
+                            min_distance)
+
+
+def place_on_lattice(rng, count, x_min, x_max, y_min, y_max, min_distance):
+    """Place points on random sites of a jittered square lattice.
+
+    The lattice spacing is the largest one that has enough sites. Every point
+    is shifted by at most half of the spacing beyond min_distance along each
+    axis, so the points stay at least min_distance apart.
+
+    :param rng: random number generator
+    :type rng: numpy.random.Generator
+    :param count: number of points
+    :type count: int
+    :param x_min: left edge of the rectangle
+    :type x_min: float
+    :param x_max: right edge of the rectangle
+    :type x_max: float
+    :param y_min: bottom edge of the rectangle
+    :type y_min: float
+    :param y_max: top edge of the rectangle
+    :type y_max: float
+    :param min_distance: smallest allowed distance between points
+    :type min_distance: float
+    :return: x and y coordinates of the points
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    width = x_max - x_min
+    height = y_max - y_min
+
+    def sites(spacing):
+        return floor(width / spacing) + 1, floor(height / spacing) + 1
+
+    spacing = sqrt(width * height / count) if width * height else 0.0
+    while spacing > 0 and sites(spacing)[0] * sites(spacing)[1] < count:
+        spacing *= 0.99
+    if spacing < min_distance or spacing == 0:
+        raise ValueError("{count} particles do not fit in the box".format(
+            count=count))
+    (n_x, n_y) = sites(spacing)
+    chosen = rng.choice(n_x * n_y, count, replace=False)
+    jitter = (spacing - min_distance) / 2
+    pos_x = x_min + (chosen // n_y) * spacing + rng.uniform(-jitter, jitter,
+                                                            count)
+    pos_y = y_min + (chosen % n_y) * spacing + rng.uniform(-jitter, jitter,
+                                                           count)
+    return np.clip(pos_x, x_min, x_max), np.clip(pos_y, y_min, y_max)
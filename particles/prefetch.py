@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+"""Background decoding of the frames of a recording.
+
+A FramePrefetcher owns a worker thread with its own Playback of the
+recording. The thread decodes the frames around the cursor, i.e. the frame
+being displayed, into a ring of at most ahead + behind + 1 frames: up to
+ahead frames in the direction the cursor last moved, then up to behind
+frames in the other direction, so scrubbing either way finds its frames
+ready. A decoded Frame holds everything needed to draw it and plot its
+observables, so the thread showing it only has to upload and draw.
+
+A frame requested before it is decoded is counted as dropped instead of
+waiting for it, unless a timeout is given.
+
+The frames of a recording that is still being written become available to
+the worker thread after refresh() (see Playback.refresh).
+"""
+
+import threading
+
+from particles.observables import measure
+from particles.recording import store_from_records
+from particles.render import circle_offsets, vertex_buffer
+
+
+class Frame:
+    """A decoded frame of a recording.
+
+    :param index: index of the snapshot
+    :type index: int
+    :param time: time of the snapshot
+    :type time: float
+    :param ids: ids of the particles
+    :type ids: numpy.ndarray
+    :param xy: vertices of the particles, see particles.render.vertex_buffer
+    :type xy: numpy.ndarray
+    :param observables: record of particles.observables.OBSERVABLES_DTYPE
+    :type observables: numpy.void
+    """
+
+    __slots__ = ['index', 'time', 'ids', 'xy', 'observables']
+
+    def __init__(self, index, time, ids, xy, observables):
+        self.index = index
+        self.time = time
+        self.ids = ids
+        self.xy = xy
+        self.observables = observables
+
+
+class FramePrefetcher:
+    """Decoder of the frames around the cursor, in a background thread.
+
+    :param playback: playback of the recording, used by the worker thread
+    only. it must not be shared with other threads
+    :type playback: particles.simulation.Playback
+    :param ahead: number of frames decoded in the direction of the cursor
+    :type ahead: int
+    :param behind: number of frames decoded in the other direction
+    :type behind: int
+    """
+
+    __slots__ = ['playback', 'ahead', 'behind', 'offsets', 'frames',
+                 'condition', 'cursor', 'direction', 'dropped', 'closed',
+                 'stale', 'thread']
+
+    def __init__(self, playback, ahead=16, behind=4):
+        self.playback = playback
+        self.ahead = ahead
+        self.behind = behind
+        self.offsets = circle_offsets(playback.simulator.particle_r)
+        self.frames = {}
+        self.condition = threading.Condition()
+        self.cursor = 0
+        self.direction = 1
+        self.dropped = 0
+        self.closed = False
+        self.stale = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def seek(self, index):
+        """
+        Move the cursor to the provided frame
+
+        :param index: index of the snapshot
+        :type index: int
+        :return:
+        """
+        with self.condition:
+            if index != self.cursor:
+                self.direction = 1 if index > self.cursor else -1
+            self.cursor = index
+            self.condition.notify_all()
+
+    def refresh(self):
+        """
+        Make the worker thread refresh its playback before decoding the next
+        frame
+
+        :return:
+        """
+        with self.condition:
+            self.stale = True
+            self.condition.notify_all()
+
+    def get(self, index, timeout=0.0):
+        """
+        Return the decoded frame, waiting at most timeout seconds for it
+
+        :param index: index of the snapshot
+        :type index: int
+        :param timeout: seconds to wait, None to wait until it is decoded
+        :type timeout: float
+        :return: the frame, None if it is not decoded yet, which counts as a
+        dropped frame
+        :rtype: Frame
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: index in self.frames or self.closed, timeout)
+            frame = self.frames.get(index)
+            if frame is None:
+                self.dropped += 1
+            return frame
+
+    def wanted(self, size):
+        """
+        Return the indices of the ring, in the order they are decoded
+
+        :param size: number of snapshots
+        :type size: int
+        :return:
+        :rtype: list[int]
+        """
+        cursor = self.cursor
+        direction = self.direction
+        indices = [cursor + direction * k for k in range(self.ahead + 1)]
+        indices.extend(cursor - direction * k
+                       for k in range(1, self.behind + 1))
+        return [index for index in indices if 0 <= index < size]
+
+    def next_index(self):
+        """
+        Drop the frames out of the ring and return the next one to decode
+
+        :return: index of the snapshot, None if the ring is complete
+        :rtype: int
+        """
+        wanted = self.wanted(len(self.playback))
+        kept = set(wanted)
+        for index in [index for index in self.frames if index not in kept]:
+            del self.frames[index]
+        for index in wanted:
+            if index not in self.frames:
+                return index
+        return None
+
+    def decode(self, index):
+        """
+        Decode the frame
+
+        :param index: index of the snapshot
+        :type index: int
+        :return:
+        :rtype: Frame
+        """
+        playback = self.playback
+        snapshot = playback.snapshot(index)
+        time = float(snapshot['time'])
+        store = store_from_records(snapshot['particles'])
+        recorded = playback.recorded_observables
+        if recorded is not None and index < len(recorded):
+            observables = recorded[index]
+        else:
+            observables = measure(playback.simulator, time, store=store)
+        xy = vertex_buffer(store.pos_x, store.pos_y, self.offsets)
+        return Frame(index, time, store.id, xy, observables)
+
+    def run(self):
+        condition = self.condition
+        while True:
+            with condition:
+                condition.wait_for(lambda: self.closed or self.stale or
+                                   self.next_index() is not None)
+                if self.closed:
+                    return
+                stale = self.stale
+                self.stale = False
+                index = None if stale else self.next_index()
+            if stale:
+                # the playback is only used by this thread
+                self.playback.refresh()
+                continue
+            frame = self.decode(index)
+            with condition:
+                # the cursor may have moved away while decoding
+                if index in self.wanted(len(self.playback)):
+                    self.frames[index] = frame
+                condition.notify_all()
+
+    def close(self):
+        """
+        Stop the worker thread
+
+        :return:
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
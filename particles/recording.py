@@ -0,0 +1,930 @@
+# -*- coding: utf-8 -*-
+
+"""Reading and writing simulation recordings.
+
+Recordings come in two versions.
+
+Version 1 consists of the head, i.e. the simulator's parameters packed with
+HEAD_FORMAT, followed by snapshots. A snapshot is the time packed as a double,
+followed by every particle packed with Particle.STRUCT_FORMAT. The first
+snapshot is the initial state of the simulator.
+
+Version 2 starts with MAGIC and the V2_HEAD_FORMAT options (compression,
+position precision, delta encoding), followed by the same head as version 1.
+Snapshots are stored in chunks, each chunk being a CHUNK_FORMAT prefix
+(compressed size, number of snapshots) and the compressed snapshots.
+Snapshots have the layout of version 1, except that positions are float32 if
+the recording is quantised. A closed recording ends with the chunk index, an
+array of INDEX_DTYPE, and the FOOTER_FORMAT footer (number of chunks, offset
+of the index, END_MAGIC). A recording without the footer, e.g. one of an
+interrupted simulation, is read by scanning its chunks.
+
+A recording may be accompanied by a checkpoint, a pickled dictionary stored
+next to it (see checkpoint_path), which holds everything needed to continue
+the simulation and the recording from its last checkpointed snapshot.
+
+The per-phase statistics of a profiled simulation (see particles.stats) may
+be streamed next to the recording as well (see stats_path), as JSON lines
+holding the number of the snapshot, the time and the statistics of the
+simulation steps since the previous line.
+
+Delta encoded version 2 recordings store the quantum (DELTA_HEAD_FORMAT) and
+the sorted particle ids right after the head, and every snapshot lists the
+particles in that order. The first snapshot of a chunk is a keyframe, i.e. a
+snapshot without ids (keyframe_dtype). It is followed by the
+DELTA_WIDTHS_FORMAT widths, the size in bytes of the deltas of every float
+column in the chunk, and by the other snapshots of the chunk, which store
+every float value as the number of quanta it moved since the previous
+snapshot (delta_dtype). Every column uses int16 deltas if they fit in the
+chunk, int32 otherwise. Values are rounded relative to the keyframe, so the
+error of any value is at most half a quantum and does not accumulate.
+
+At the default quantum, a particle moving at a few meters per second moves
+by more than int16 quanta between snapshots taken at up to a few hundred
+frames per second, so positions and velocities mostly need int32 deltas. On
+a box of 50 such particles, delta encoded recordings are about 5-6 times
+smaller than version 1 with zlib and 6.5-10 times with lzma, the higher
+ratios at the higher frame rates.
+"""
+
+import argparse
+import json
+import lzma
+import mmap
+import os
+import pickle
+import struct
+import zlib
+
+import numpy as np
+
+from particles.core import Particle, ParticleStore
+
+HEAD_FORMAT = "ddddddddddddi"
+HEAD_SIZE = struct.calcsize(HEAD_FORMAT)
+HEAD_FIELDS = ('box_width', 'box_height', 'delta_v_top', 'delta_v_bottom',
+               'delta_v_side', 'barrier_x', 'barrier_width', 'hole_y',
+               'hole_height', 'v_loss', 'particle_r', 'g', 'n_particles')
+
+MAGIC = b"PIBREC\x00\x02"
+MAGIC_SIZE = len(MAGIC)
+V2_HEAD_FORMAT = "=BBBx"
+V2_HEAD_SIZE = struct.calcsize(V2_HEAD_FORMAT)
+DELTA_HEAD_FORMAT = "=d"
+DELTA_HEAD_SIZE = struct.calcsize(DELTA_HEAD_FORMAT)
+DEFAULT_QUANTUM = 1e-6
+DELTA_LIMIT = np.iinfo(np.int32).max
+SHORT_LIMIT = np.iinfo(np.int16).max
+DELTA_WIDTHS_FORMAT = "=4B"
+DELTA_WIDTHS_SIZE = struct.calcsize(DELTA_WIDTHS_FORMAT)
+CHUNK_FORMAT = "=II"
+CHUNK_SIZE = struct.calcsize(CHUNK_FORMAT)
+END_MAGIC = b"PIBINDEX"
+FOOTER_FORMAT = "=QQ8s"
+FOOTER_SIZE = struct.calcsize(FOOTER_FORMAT)
+
+INDEX_DTYPE = np.dtype([('offset', '=u8'), ('size', '=u4'),
+                        ('frames', '=u4')])
+
+COMPRESSIONS = ('none', 'zlib', 'lzma')
+
+# Packed particle record, same layout as Particle.STRUCT_FORMAT
+PARTICLE_DTYPE = np.dtype([('pos_x', '=f8'), ('pos_y', '=f8'),
+                           ('velocity_x', '=f8'), ('velocity_y', '=f8'),
+                           ('id', '=i2')])
+
+assert PARTICLE_DTYPE.itemsize == Particle.STRUCT_SIZE
+
+COLUMNS = ('pos_x', 'pos_y', 'velocity_x', 'velocity_y', 'id')
+FLOAT_COLUMNS = COLUMNS[:4]
+
+
+# Same as PARTICLE_DTYPE, with positions quantised to float32
+QUANTISED_PARTICLE_DTYPE = np.dtype([('pos_x', '=f4'), ('pos_y', '=f4'),
+                                     ('velocity_x', '=f8'),
+                                     ('velocity_y', '=f8'), ('id', '=i2')])
+
+
+def snapshot_dtype(n_particles, quantise=False):
+    """Return the dtype of a packed snapshot of n_particles particles.
+
+    :param n_particles: number of particles
+    :type n_particles: int
+    :param quantise: store positions as float32
+    :type quantise: bool
+    :return:
+    :rtype: numpy.dtype
+    """
+    particle_dtype = QUANTISED_PARTICLE_DTYPE if quantise else PARTICLE_DTYPE
+    return np.dtype([('time', '=f8'),
+                     ('particles', particle_dtype, (n_particles,))])
+
+
+def keyframe_dtype(n_particles, quantise=False):
+    """Return the dtype of a keyframe of a delta encoded recording.
+
+    :param n_particles: number of particles
+    :type n_particles: int
+    :param quantise: store positions as float32
+    :type quantise: bool
+    :return:
+    :rtype: numpy.dtype
+    """
+    particle_dtype = QUANTISED_PARTICLE_DTYPE if quantise else PARTICLE_DTYPE
+    return np.dtype([('time', '=f8'),
+                     ('particles', [(column, particle_dtype[column])
+                                    for column in FLOAT_COLUMNS],
+                      (n_particles,))])
+
+
+def delta_dtype(n_particles, widths=(4, 4, 4, 4)):
+    """Return the dtype of a delta encoded snapshot.
+
+    :param n_particles: number of particles
+    :type n_particles: int
+    :param widths: size in bytes of the deltas of every float column
+    :type widths: tuple[int]
+    :return:
+    :rtype: numpy.dtype
+    """
+    return np.dtype([('time', '=f8'),
+                     ('particles', [(column, '=i{width}'.format(width=width))
+                                    for (column, width)
+                                    in zip(FLOAT_COLUMNS, widths)],
+                      (n_particles,))])
+
+
+def dump_records(store, records):
+    """Copy the particles of the store into packed particle records.
+
+    :param store:
+    :type store: particles.core.ParticleStore
+    :param records: array of PARTICLE_DTYPE of length len(store)
+    :type records: numpy.ndarray
+    :return:
+    """
+    for column in COLUMNS:
+        records[column] = getattr(store, column)
+
+
+def load_records(store, records):
+    """Copy packed particle records into the store, without reallocating it.
+
+    :param store:
+    :type store: particles.core.ParticleStore
+    :param records: array of PARTICLE_DTYPE of length len(store)
+    :type records: numpy.ndarray
+    :return:
+    """
+    for column in COLUMNS:
+        np.copyto(getattr(store, column), records[column])
+
+
+def store_from_records(records):
+    """Create a store holding a copy of packed particle records.
+
+    :param records: array of PARTICLE_DTYPE
+    :type records: numpy.ndarray
+    :return:
+    :rtype: particles.core.ParticleStore
+    """
+    store = ParticleStore(len(records))
+    load_records(store, records)
+    return store
+
+
+def pack_head(simulator):
+    """Pack the simulator's parameters into the recording head.
+
+    :param simulator:
+    :type simulator: particles.simulation.Simulator
+    :return:
+    :rtype: bytes
+    """
+    return struct.pack(HEAD_FORMAT, simulator.box_width,
+                       simulator.box_height, simulator.delta_v_top,
+                       simulator.delta_v_bottom, simulator.delta_v_side,
+                       simulator.barrier_x,
+                       simulator.barrier_width, simulator.hole_y,
+                       simulator.hole_height, simulator.v_loss,
+                       simulator.particle_r, simulator.g,
+                       len(simulator))
+
+
+class SnapshotWriter:
+    """Buffered writer of snapshots.
+
+    Snapshots are packed into a preallocated buffer of flush_interval
+    snapshots, which is written to the file in a single call once it is full
+    or flush() is called. The output is byte-identical to packing every
+    particle with struct.
+
+    :param file: binary file open for writing
+    :param n_particles: number of particles in every snapshot
+    :type n_particles: int
+    :param flush_interval: number of snapshots to buffer before writing
+    :type flush_interval: int
+    """
+
+    __slots__ = ['file', 'buffer', 'buffered']
+
+    def __init__(self, file, n_particles, flush_interval=1):
+        if flush_interval < 1:
+            raise ValueError("flush_interval must be positive")
+        self.file = file
+        self.buffer = np.zeros(flush_interval,
+                               dtype=snapshot_dtype(n_particles))
+        self.buffered = 0
+
+    def write_head(self, simulator):
+        """
+        Write the simulator's parameters
+
+        :param simulator:
+        :type simulator: particles.simulation.Simulator
+        :return:
+        """
+        self.write_packed_head(pack_head(simulator), simulator.store.id)
+
+    def write_packed_head(self, head, ids=None):
+        """
+        Write the simulator's parameters packed with HEAD_FORMAT
+
+        :param head:
+        :type head: bytes
+        :param ids: ids of the particles, used by delta encoded recordings
+        :type ids: numpy.ndarray
+        :return:
+        """
+        self.file.write(head)
+        # readers following the recording can open it before the first flush
+        self.file.flush()
+
+    def write_snapshot(self, time_elapsed, store):
+        """
+        Add a snapshot to the buffer, write the buffer if it is full
+
+        :param time_elapsed: time of the snapshot
+        :type time_elapsed: float
+        :param store: particles of the snapshot
+        :type store: particles.core.ParticleStore
+        :return:
+        """
+        snapshot = self.buffer[self.buffered]
+        snapshot['time'] = time_elapsed
+        dump_records(store, snapshot['particles'])
+        self.advance()
+
+    def write_frame(self, frame):
+        """
+        Add a snapshot read from a recording to the buffer, write the buffer
+        if it is full
+
+        :param frame: record with fields `time` and `particles`
+        :type frame: numpy.void
+        :return:
+        """
+        self.buffer[self.buffered] = frame
+        self.advance()
+
+    def advance(self):
+        self.buffered += 1
+        if self.buffered == self.buffer.shape[0]:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered snapshots to the file
+
+        :return:
+        """
+        if self.buffered:
+            self.file.write(self.buffer[:self.buffered].view(np.uint8))
+            self.buffered = 0
+        self.file.flush()
+
+    def checkpoint(self):
+        """
+        Write the buffered snapshots, return the state of the writer needed
+        to continue the recording with restore()
+
+        :return:
+        :rtype: dict
+        """
+        self.flush()
+        return {'offset': self.file.tell()}
+
+    def restore(self, state):
+        """
+        Drop everything written after the checkpoint and continue writing
+        from it. The file must be open for reading and writing
+
+        :param state: value returned by checkpoint()
+        :type state: dict
+        :return:
+        """
+        self.file.seek(state['offset'])
+        self.file.truncate()
+
+    def close(self):
+        """
+        Write the remaining snapshots, the file is left open
+
+        :return:
+        """
+        self.flush()
+
+
+def compress(data, compression):
+    """Compress data with one of COMPRESSIONS.
+
+    :param data:
+    :type data: bytes
+    :param compression:
+    :type compression: str
+    :return:
+    :rtype: bytes
+    """
+    if compression == 'zlib':
+        return zlib.compress(data)
+    if compression == 'lzma':
+        return lzma.compress(data)
+    return data
+
+
+def decompress(data, compression):
+    """Decompress data compressed with one of COMPRESSIONS.
+
+    :param data:
+    :type data: bytes
+    :param compression:
+    :type compression: str
+    :return:
+    :rtype: bytes
+    """
+    if compression == 'zlib':
+        return zlib.decompress(data)
+    if compression == 'lzma':
+        return lzma.decompress(data)
+    return data
+
+
+class ChunkedWriter(SnapshotWriter):
+    """Writer of version 2 recordings.
+
+    Every flush_interval snapshots are compressed into a chunk. close() writes
+    the last chunk and the chunk index.
+
+    With delta, snapshots are delta encoded and every chunk starts with a
+    keyframe. The deltas of every column are stored as int16 if they fit,
+    int32 otherwise. A chunk is cut short if a value moves by more than
+    DELTA_LIMIT quanta between two snapshots.
+
+    :param file: binary file open for writing
+    :param n_particles: number of particles in every snapshot
+    :type n_particles: int
+    :param flush_interval: number of snapshots in a chunk
+    :type flush_interval: int
+    :param compression: one of COMPRESSIONS
+    :type compression: str
+    :param quantise: store positions as float32
+    :type quantise: bool
+    :param delta: delta encode snapshots
+    :type delta: bool
+    :param quantum: precision of delta encoded values
+    :type quantum: float
+    """
+
+    __slots__ = ['compression', 'quantise', 'delta', 'quantum', 'ids',
+                 'index']
+
+    def __init__(self, file, n_particles, flush_interval=64,
+                 compression='zlib', quantise=False, delta=False,
+                 quantum=DEFAULT_QUANTUM):
+        if flush_interval < 1:
+            raise ValueError("flush_interval must be positive")
+        if compression not in COMPRESSIONS:
+            raise ValueError("unknown compression {compression}, expected one "
+                             "of {compressions}".format(
+                                 compression=compression,
+                                 compressions=", ".join(COMPRESSIONS)))
+        if quantum <= 0:
+            raise ValueError("quantum must be positive")
+        self.file = file
+        self.compression = compression
+        self.quantise = quantise
+        self.delta = delta
+        self.quantum = quantum
+        self.ids = None
+        self.buffer = np.zeros(flush_interval,
+                               dtype=snapshot_dtype(n_particles, quantise))
+        self.buffered = 0
+        self.index = []
+
+    def write_packed_head(self, head, ids=None):
+        self.file.write(MAGIC)
+        self.file.write(struct.pack(V2_HEAD_FORMAT,
+                                    COMPRESSIONS.index(self.compression),
+                                    self.quantise, self.delta))
+        self.file.write(head)
+        if self.delta:
+            if ids is None:
+                raise ValueError("delta encoded recordings require ids")
+            self.ids = np.sort(ids).astype(PARTICLE_DTYPE['id'])
+            self.file.write(struct.pack(DELTA_HEAD_FORMAT, self.quantum))
+            self.file.write(self.ids.tobytes())
+        self.file.flush()
+
+    def flush(self):
+        """
+        Write the buffered snapshots to the file as a chunk
+
+        :return:
+        """
+        if self.buffered:
+            frames = self.buffer[:self.buffered]
+            if self.delta:
+                self.sort_by_id(frames)
+                start = 0
+                while start < len(frames):
+                    (data, count) = self.encode(frames[start:])
+                    self.write_chunk(data, count)
+                    start += count
+            else:
+                self.write_chunk(frames.tobytes(), len(frames))
+            self.buffered = 0
+        self.file.flush()
+
+    def sort_by_id(self, frames):
+        """
+        Put the particles of every snapshot in the order of self.ids
+
+        :param frames: snapshots
+        :type frames: numpy.ndarray
+        :return:
+        """
+        particles = frames['particles']
+        order = np.argsort(particles['id'], axis=1, kind='stable')
+        frames['particles'] = np.take_along_axis(particles, order, axis=1)
+        if (frames['particles']['id'] != self.ids).any():
+            raise ValueError("particle ids changed during the recording")
+
+    def encode(self, frames):
+        """
+        Delta encode the longest prefix of the snapshots that fits in a chunk
+
+        :param frames: snapshots sorted by id
+        :type frames: numpy.ndarray
+        :return: encoded chunk and number of snapshots in it
+        :rtype: (bytes, int)
+        """
+        n_particles = frames.dtype['particles'].shape[0]
+        keyframe = np.zeros(1, dtype=keyframe_dtype(n_particles,
+                                                     self.quantise))
+        keyframe['time'] = frames['time'][0]
+        count = len(frames)
+        columns = []
+        for column in FLOAT_COLUMNS:
+            values = frames['particles'][column]
+            keyframe['particles'][column] = values[0]
+            steps = np.diff(np.rint((values - values[0]) / self.quantum),
+                            axis=0)
+            overflow = np.flatnonzero(
+                (np.abs(steps) > DELTA_LIMIT).any(axis=1))
+            if len(overflow):
+                count = min(count, overflow[0] + 1)
+            columns.append(steps)
+
+        columns = [steps[:count - 1] for steps in columns]
+        widths = [2 if not steps.size or np.abs(steps).max() <= SHORT_LIMIT
+                  else 4 for steps in columns]
+        deltas = np.zeros(count - 1, dtype=delta_dtype(n_particles, widths))
+        deltas['time'] = frames['time'][1:count]
+        for (column, steps) in zip(FLOAT_COLUMNS, columns):
+            deltas['particles'][column] = steps
+        return (keyframe.tobytes() +
+                struct.pack(DELTA_WIDTHS_FORMAT, *widths) +
+                deltas.tobytes(), count)
+
+    def checkpoint(self):
+        state = SnapshotWriter.checkpoint(self)
+        state['index'] = list(self.index)
+        state['ids'] = self.ids
+        return state
+
+    def restore(self, state):
+        SnapshotWriter.restore(self, state)
+        self.index = list(state['index'])
+        self.ids = state['ids']
+
+    def write_chunk(self, data, frames):
+        """
+        Compress data and write it as a chunk of the given number of snapshots
+
+        :param data:
+        :type data: bytes
+        :param frames:
+        :type frames: int
+        :return:
+        """
+        data = compress(data, self.compression)
+        self.file.write(struct.pack(CHUNK_FORMAT, len(data), frames))
+        self.index.append((self.file.tell(), len(data), frames))
+        self.file.write(data)
+
+    def close(self):
+        """
+        Write the remaining snapshots and the chunk index, the file is left
+        open
+
+        :return:
+        """
+        self.flush()
+        offset = self.file.tell()
+        self.file.write(np.array(self.index, dtype=INDEX_DTYPE).tobytes())
+        self.file.write(struct.pack(FOOTER_FORMAT, len(self.index), offset,
+                                    END_MAGIC))
+        self.file.flush()
+
+
+class RawReader:
+    """Reader of version 1 recordings.
+
+    With memory_map the file is mapped into memory and snapshot() returns
+    read-only views into the mapping. Otherwise, snapshots are read into a
+    buffer that is reused by the next call.
+
+    The number of snapshots is read at creation and by refresh(), so a
+    recording that is still being written can be followed.
+
+    :param file: binary file open for reading, positioned at its start
+    :param memory_map: map the file into memory instead of reading it
+    :type memory_map: bool
+    """
+
+    version = 1
+
+    def __init__(self, file, memory_map=False):
+        self.file = file
+        self.head = file.read(HEAD_SIZE)
+        self.n_particles = struct.unpack(HEAD_FORMAT, self.head)[-1]
+        self.dtype = snapshot_dtype(self.n_particles)
+        self.memory_map = memory_map
+        self.map = None
+        self.frames = None
+        self.length = 0
+        if not memory_map:
+            self.buffer = np.zeros(1, dtype=self.dtype)
+        self.refresh()
+
+    def __len__(self):
+        return self.length
+
+    def refresh(self):
+        """
+        Take the snapshots appended to the file since the last refresh into
+        account. A snapshot that is not completely written yet is ignored.
+
+        :return: number of snapshots
+        :rtype: int
+        """
+        size = os.fstat(self.file.fileno()).st_size
+        length = max(size - HEAD_SIZE, 0) // self.dtype.itemsize
+        if self.memory_map and (self.frames is None or length != self.length):
+            # a mapping does not grow with the file, map it again. the
+            # previous mapping is released together with the last view of it
+            self.map = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+            self.frames = np.frombuffer(self.map, dtype=self.dtype,
+                                        count=length, offset=HEAD_SIZE)
+        self.length = length
+        return length
+
+    def snapshot(self, index):
+        """
+        Return the snapshot with the given index as a record with fields
+        `time` and `particles`
+
+        :param index: index of the snapshot
+        :type index: int
+        :return:
+        :rtype: numpy.void
+        """
+        if self.frames is not None:
+            return self.frames[index]
+        self.file.seek(HEAD_SIZE + self.dtype.itemsize * index)
+        self.file.readinto(self.buffer.view(np.uint8))
+        return self.buffer[0]
+
+    def close(self):
+        if self.map is not None:
+            self.frames = None
+            try:
+                self.map.close()
+            except BufferError:
+                # views of the snapshots are still alive, the mapping is
+                # released together with the last of them
+                pass
+
+
+class ChunkedReader:
+    """Reader of version 2 recordings.
+
+    The chunk of the requested snapshot is found through the chunk index and
+    decompressed as a whole. The last decompressed chunk is kept, so reading
+    snapshots in order decompresses every chunk once.
+
+    The chunks of a recording that is still being written are indexed by
+    scanning them, refresh() scans the ones appended since.
+
+    :param file: binary file open for reading, positioned after MAGIC
+    """
+
+    version = 2
+
+    def __init__(self, file):
+        self.file = file
+        (compression, quantise, delta) = struct.unpack(
+            V2_HEAD_FORMAT, file.read(V2_HEAD_SIZE))
+        self.compression = COMPRESSIONS[compression]
+        self.quantise = bool(quantise)
+        self.delta = bool(delta)
+        self.head = file.read(HEAD_SIZE)
+        self.n_particles = struct.unpack(HEAD_FORMAT, self.head)[-1]
+        self.dtype = snapshot_dtype(self.n_particles, self.quantise)
+        if self.delta:
+            (self.quantum,) = struct.unpack(DELTA_HEAD_FORMAT,
+                                            file.read(DELTA_HEAD_SIZE))
+            self.ids = np.frombuffer(
+                file.read(self.n_particles * PARTICLE_DTYPE['id'].itemsize),
+                dtype=PARTICLE_DTYPE['id'])
+        self.data_offset = file.tell()
+        self.scan_offset = self.data_offset
+        self.complete = False
+        self.index = np.zeros(0, dtype=INDEX_DTYPE)
+        self.first_frames = np.zeros(1, dtype=np.int64)
+        self.chunk_of_frame = np.zeros(0, dtype=np.int64)
+        self.chunk = -1
+        self.frames = None
+        self.refresh()
+
+    def read_index(self):
+        """
+        Read the chunk index from the end of the file
+
+        :return: the index or None if the file has no footer
+        :rtype: numpy.ndarray
+        """
+        size = os.fstat(self.file.fileno()).st_size
+        if size < MAGIC_SIZE + FOOTER_SIZE:
+            return None
+        self.file.seek(size - FOOTER_SIZE)
+        (n_chunks, offset, end_magic) = struct.unpack(
+            FOOTER_FORMAT, self.file.read(FOOTER_SIZE))
+        if end_magic != END_MAGIC:
+            return None
+        self.file.seek(offset)
+        return np.frombuffer(self.file.read(n_chunks * INDEX_DTYPE.itemsize),
+                             dtype=INDEX_DTYPE)
+
+    def scan_chunks(self):
+        """
+        Index the chunks after the ones already scanned by walking through
+        the chunk prefixes. Stops at the first incomplete chunk, or at the
+        chunk index of a closed recording (read as a chunk of no snapshots).
+
+        :return: index of the new chunks
+        :rtype: numpy.ndarray
+        """
+        size = os.fstat(self.file.fileno()).st_size
+        offset = self.scan_offset
+        index = []
+        while offset + CHUNK_SIZE <= size:
+            self.file.seek(offset)
+            (chunk_size, frames) = struct.unpack(CHUNK_FORMAT,
+                                                 self.file.read(CHUNK_SIZE))
+            if not frames or offset + CHUNK_SIZE + chunk_size > size:
+                break
+            index.append((offset + CHUNK_SIZE, chunk_size, frames))
+            offset += CHUNK_SIZE + chunk_size
+        self.scan_offset = offset
+        return np.array(index, dtype=INDEX_DTYPE)
+
+    def refresh(self):
+        """
+        Take the chunks appended to the file since the last refresh into
+        account. Once the recording is closed, its chunk index is used and
+        the file is not scanned anymore.
+
+        :return: number of snapshots
+        :rtype: int
+        """
+        if self.complete:
+            return len(self)
+        index = self.read_index()
+        if index is not None:
+            self.complete = True
+            self.index = index
+        else:
+            chunks = self.scan_chunks()
+            if not len(chunks):
+                return len(self)
+            self.index = np.concatenate((self.index, chunks))
+        self.first_frames = np.zeros(len(self.index) + 1, dtype=np.int64)
+        np.cumsum(self.index['frames'], out=self.first_frames[1:])
+        self.chunk_of_frame = np.repeat(np.arange(len(self.index)),
+                                        self.index['frames'])
+        return len(self)
+
+    def __len__(self):
+        return int(self.first_frames[-1])
+
+    def decode(self, data, count):
+        """
+        Reconstruct the snapshots of a delta encoded chunk
+
+        :param data: decompressed chunk
+        :type data: bytes
+        :param count: number of snapshots in the chunk
+        :type count: int
+        :return:
+        :rtype: numpy.ndarray
+        """
+        keyframe_type = keyframe_dtype(self.n_particles, self.quantise)
+        keyframe = np.frombuffer(data, dtype=keyframe_type, count=1)[0]
+        offset = keyframe_type.itemsize
+        widths = struct.unpack_from(DELTA_WIDTHS_FORMAT, data, offset)
+        deltas = np.frombuffer(data, dtype=delta_dtype(self.n_particles,
+                                                       widths),
+                               count=count - 1,
+                               offset=offset + DELTA_WIDTHS_SIZE)
+        frames = np.zeros(count, dtype=snapshot_dtype(self.n_particles))
+        frames['time'][0] = keyframe['time']
+        frames['time'][1:] = deltas['time']
+        particles = frames['particles']
+        for column in FLOAT_COLUMNS:
+            key = keyframe['particles'][column].astype(np.float64)
+            particles[column][0] = key
+            steps = np.cumsum(deltas['particles'][column], axis=0,
+                              dtype=np.int64)
+            particles[column][1:] = key + steps * self.quantum
+        particles['id'] = self.ids
+        frames.flags.writeable = False
+        return frames
+
+    def snapshot(self, index):
+        """
+        Return the snapshot with the given index as a record with fields
+        `time` and `particles`. The record is a read-only view into the
+        decompressed chunk.
+
+        :param index: index of the snapshot
+        :type index: int
+        :return:
+        :rtype: numpy.void
+        """
+        chunk = self.chunk_of_frame[index]
+        if chunk != self.chunk:
+            (offset, size, frames) = self.index[chunk]
+            self.file.seek(offset)
+            data = decompress(self.file.read(size), self.compression)
+            if self.delta:
+                self.frames = self.decode(data, frames)
+            else:
+                self.frames = np.frombuffer(data, dtype=self.dtype,
+                                            count=frames)
+            self.chunk = chunk
+        return self.frames[index - self.first_frames[chunk]]
+
+    def close(self):
+        pass
+
+
+def checkpoint_path(file_path):
+    """Return the path to the checkpoint of the recording.
+
+    :param file_path: path to the recording
+    :type file_path: str
+    :return:
+    :rtype: str
+    """
+    return file_path + ".checkpoint"
+
+
+def stats_path(file_path):
+    """Return the path to the per-phase statistics of the recording.
+
+    :param file_path: path to the recording
+    :type file_path: str
+    :return:
+    :rtype: str
+    """
+    return file_path + ".stats"
+
+
+def read_stats(file_path):
+    """Read the per-phase statistics streamed next to the recording.
+
+    :param file_path: path to the recording
+    :type file_path: str
+    :return: a dict per line
+    :rtype: list[dict]
+    """
+    with open(stats_path(file_path)) as f:
+        return [json.loads(line) for line in f]
+
+
+def save_checkpoint(file_path, checkpoint):
+    """Save the checkpoint of the recording, replacing the previous one
+    atomically.
+
+    :param file_path: path to the recording
+    :type file_path: str
+    :param checkpoint:
+    :type checkpoint: dict
+    :return:
+    """
+    path = checkpoint_path(file_path)
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump(checkpoint, f)
+    os.replace(path + ".tmp", path)
+
+
+def load_checkpoint(file_path):
+    """Load the checkpoint of the recording.
+
+    :param file_path: path to the recording
+    :type file_path: str
+    :return:
+    :rtype: dict
+    """
+    with open(checkpoint_path(file_path), "rb") as f:
+        return pickle.load(f)
+
+
+def open_recording(file, memory_map=False):
+    """Return a reader of the recording, detecting its version.
+
+    :param file: binary file open for reading
+    :param memory_map: map version 1 recordings into memory
+    :type memory_map: bool
+    :return:
+    :rtype: RawReader | ChunkedReader
+    """
+    file.seek(0)
+    if file.read(MAGIC_SIZE) == MAGIC:
+        return ChunkedReader(file)
+    file.seek(0)
+    return RawReader(file, memory_map)
+
+
+def upgrade(source, destination, compression='zlib', quantise=False,
+            flush_interval=64, delta=False, quantum=DEFAULT_QUANTUM):
+    """Convert a recording to version 2.
+
+    :param source: path to the recording
+    :type source: str
+    :param destination: path to the version 2 recording
+    :type destination: str
+    :param compression: one of COMPRESSIONS
+    :type compression: str
+    :param quantise: store positions as float32
+    :type quantise: bool
+    :param flush_interval: number of snapshots in a chunk
+    :type flush_interval: int
+    :param delta: delta encode snapshots
+    :type delta: bool
+    :param quantum: precision of delta encoded values
+    :type quantum: float
+    :return:
+    """
+    with open(source, "rb") as f_in, open(destination, "wb") as f_out:
+        reader = open_recording(f_in)
+        writer = ChunkedWriter(f_out, reader.n_particles, flush_interval,
+                               compression, quantise, delta, quantum)
+        writer.write_packed_head(reader.head,
+                                 reader.snapshot(0)['particles']['id'])
+        for index in range(len(reader)):
+            writer.write_frame(reader.snapshot(index))
+        writer.close()
+        reader.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert a recording to the compressed version 2 format")
+    parser.add_argument("source")
+    parser.add_argument("destination")
+    parser.add_argument("--compression", choices=COMPRESSIONS,
+                        default='zlib')
+    parser.add_argument("--quantise", action="store_true",
+                        help="store positions as float32")
+    parser.add_argument("--chunk", type=int, default=64,
+                        help="number of snapshots in a chunk")
+    parser.add_argument("--delta", action="store_true",
+                        help="delta encode snapshots")
+    parser.add_argument("--quantum", type=float, default=DEFAULT_QUANTUM,
+                        help="precision of delta encoded values")
+    args = parser.parse_args()
+    upgrade(args.source, args.destination, args.compression, args.quantise,
+            args.chunk, args.delta, args.quantum)
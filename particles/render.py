@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+"""Vertex and colour buffers for drawing the particles.
+
+Every particle is drawn as a triangle fan of VERTICES vertices around its
+center (see circle_offsets). The buffers are built with NumPy broadcasting
+from the columns of a snapshot, and do not depend on OpenGL, so they can be
+built and checked without a display.
+
+All the fans are drawn with a single glMultiDrawArrays call, whose arguments
+are built by fan_arguments, or with a glDrawArrays call per particle if the
+OpenGL implementation lacks glMultiDrawArrays (see draw_fans). Drawing
+requires PyOpenGL.
+"""
+
+import numpy as np
+
+try:
+    from OpenGL.GL import glDrawArrays, glMultiDrawArrays, GL_TRIANGLE_FAN
+except ImportError:
+    glDrawArrays = glMultiDrawArrays = GL_TRIANGLE_FAN = None
+
+# Colour of the particles by side of origin (the low bit of the id)
+COLOR_LEFT = (255, 0, 0)
+COLOR_RIGHT = (0, 255, 0)
+
+# Number of sides of the polygon approximating a particle
+SEGMENTS = 8
+
+# Vertices of a particle's triangle fan: the closed outline and the center
+VERTICES = SEGMENTS + 2
+
+
+def circle_offsets(particle_r, segments=SEGMENTS):
+    """Return the offsets of the fan vertices from the particle center.
+
+    The fan starts on the outline at angle 0, goes around it counterclockwise
+    back to angle 0, and ends at the center.
+
+    :param particle_r: particle radius (meters)
+    :type particle_r: float
+    :param segments: number of sides of the polygon
+    :type segments: int
+    :return: (segments + 2, 2) array of x and y offsets
+    :rtype: numpy.ndarray
+    """
+    angles = np.radians(np.arange(segments + 1) * (360 / segments))
+    outline = particle_r * np.column_stack((np.cos(angles), np.sin(angles)))
+    return np.vstack((outline, (0, 0)))
+
+
+def vertex_buffer(pos_x, pos_y, offsets, out=None):
+    """Build the vertices of every particle's fan.
+
+    :param pos_x: x of the particle centers
+    :type pos_x: numpy.ndarray
+    :param pos_y: y of the particle centers
+    :type pos_y: numpy.ndarray
+    :param offsets: offsets of the vertices, see circle_offsets
+    :type offsets: numpy.ndarray
+    :param out: (N * len(offsets), 2) float64 array to fill, a new one by
+    default
+    :type out: numpy.ndarray
+    :return: vertices, particle after particle
+    :rtype: numpy.ndarray
+    """
+    size = pos_x.shape[0]
+    if out is None:
+        out = np.empty((size * offsets.shape[0], 2))
+    vertices = out.reshape(size, offsets.shape[0], 2)
+    np.add(pos_x[:, None], offsets[:, 0], out=vertices[:, :, 0])
+    np.add(pos_y[:, None], offsets[:, 1], out=vertices[:, :, 1])
+    return out
+
+
+def color_buffer(ids, vertices=VERTICES):
+    """Build the colours of every vertex, by side of origin of the particle.
+
+    :param ids: ids of the particles
+    :type ids: numpy.ndarray
+    :param vertices: number of vertices of a particle
+    :type vertices: int
+    :return: (N * vertices, 3) array of unsigned bytes
+    :rtype: numpy.ndarray
+    """
+    colors = np.array((COLOR_LEFT, COLOR_RIGHT), dtype=np.ubyte)
+    return np.repeat(colors[ids & 1], vertices, axis=0)
+
+
+def fan_arguments(count, vertices=VERTICES):
+    """Build the arguments of glMultiDrawArrays drawing every fan.
+
+    :param count: number of particles
+    :type count: int
+    :param vertices: number of vertices of a particle
+    :type vertices: int
+    :return: index of the first vertex and number of vertices of every fan
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    first = np.arange(count, dtype=np.int32) * vertices
+    counts = np.full(count, vertices, dtype=np.int32)
+    return first, counts
+
+
+def draw_fans(first, counts, single_call=True):
+    """Draw the fans from the enabled vertex and colour arrays.
+
+    Requires a current OpenGL context.
+
+    :param first: index of the first vertex of every fan
+    :type first: numpy.ndarray
+    :param counts: number of vertices of every fan
+    :type counts: numpy.ndarray
+    :param single_call: draw every fan at once if glMultiDrawArrays is
+    available, otherwise draw them one by one
+    :type single_call: bool
+    :return: True if the fans were drawn in a single call
+    :rtype: bool
+    """
+    if not first.shape[0]:
+        return True
+    if single_call and bool(glMultiDrawArrays):
+        glMultiDrawArrays(GL_TRIANGLE_FAN, first, counts, first.shape[0])
+        return True
+    for (start, count) in zip(first.tolist(), counts.tolist()):
+        glDrawArrays(GL_TRIANGLE_FAN, start, count)
+    return False
+
+
+class ParticleBuffers:
+    """Buffers of the particles, updated from snapshot to snapshot.
+
+    The vertex buffer is refilled in place on every update. The colour buffer
+    only depends on the ids, so it is rebuilt only when the order of the
+    particles changes, and update tells whether it has to be uploaded again.
+    first and counts are the arguments of draw_fans.
+
+    :param particle_r: particle radius (meters)
+    :type particle_r: float
+    """
+
+    __slots__ = ['offsets', 'xy', 'color', 'ids', 'first', 'counts']
+
+    def __init__(self, particle_r):
+        self.offsets = circle_offsets(particle_r)
+        self.xy = np.empty((0, 2))
+        self.color = np.empty((0, 3), dtype=np.ubyte)
+        self.ids = None
+        (self.first, self.counts) = fan_arguments(0)
+
+    def __len__(self):
+        return 0 if self.ids is None else self.ids.shape[0]
+
+    def update(self, pos_x, pos_y, ids):
+        """
+        Fill the buffers with the provided snapshot
+
+        :param pos_x: x of the particle centers
+        :type pos_x: numpy.ndarray
+        :param pos_y: y of the particle centers
+        :type pos_y: numpy.ndarray
+        :param ids: ids of the particles
+        :type ids: numpy.ndarray
+        :return: True if the colour buffer changed
+        :rtype: bool
+        """
+        if self.xy.shape[0] != pos_x.shape[0] * self.offsets.shape[0]:
+            xy = np.empty((pos_x.shape[0] * self.offsets.shape[0], 2))
+        else:
+            xy = self.xy
+        return self.set_vertices(vertex_buffer(pos_x, pos_y, self.offsets,
+                                               xy), ids)
+
+    def set_vertices(self, xy, ids):
+        """
+        Use the provided vertex buffer, built with vertex_buffer from the
+        offsets of these buffers, e.g. by particles.prefetch
+
+        :param xy: vertices of the particles
+        :type xy: numpy.ndarray
+        :param ids: ids of the particles
+        :type ids: numpy.ndarray
+        :return: True if the colour buffer changed
+        :rtype: bool
+        """
+        if xy.shape[0] != self.xy.shape[0]:
+            (self.first, self.counts) = fan_arguments(
+                ids.shape[0], self.offsets.shape[0])
+        self.xy = xy
+        if self.ids is not None and np.array_equal(self.ids, ids):
+            return False
+        self.ids = np.array(ids, copy=True)
+        self.color = color_buffer(self.ids, self.offsets.shape[0])
+        return True
@@ -1,10 +1,22 @@
 # -*- coding: utf-8 -*-
 
-from particles.core import Particle
+from particles.core import ParticleStore
+from particles.engines import ENGINES
+from particles.broadphase import BROAD_PHASES
+from particles.parallel import StripPool
+from particles.placement import place_points
+from particles.stats import SimulationStats, ProfilingEngine
+from particles.observables import (ObservablesWriter, observables_path,
+                                   load_observables, measure)
+from particles.recording import (HEAD_FORMAT, HEAD_FIELDS, SnapshotWriter,
+                                 ChunkedWriter, load_records, open_recording,
+                                 store_from_records, checkpoint_path,
+                                 save_checkpoint, load_checkpoint, stats_path)
 import random, struct
-import copy
+import json
 import os.path
-from math import sin, cos, floor, sqrt
+import numpy as np
+from math import floor, sqrt
 
 
 class Simulator:
@@ -25,6 +37,26 @@ class Simulator:
         after two particles collide
         * particle_r - particle radius (meters)
         * g - gravitational acceleration (meters per square second)
+        * engine - name of the engine performing the simulation phases, one of
+        the keys of particles.engines.ENGINES. "python" is the reference
+        implementation, "numpy" (the default) runs movement and wall
+        collisions as array operations, "jit" runs every phase as a kernel
+        compiled with numba
+        * broad_phase - name of the broad phase of particle-to-particle
+        collision detection, one of the keys of
+        particles.broadphase.BROAD_PHASES. "all" checks every pair of
+        particles, "grid" only checks particles in neighbouring cells of a
+        uniform grid, "sweep" only checks particles less than a diameter
+        apart vertically
+        * max_block_level - enables block time steps if greater than 0. slow
+        particles are then checked for collisions every 2 ** k steps, where
+        k <= max_block_level, see next_block_state
+        * workers - number of worker processes resolving particle-to-particle
+        collisions. if greater than 1, the box is split into vertical strips
+        processed in parallel, see particles.parallel. call close(), or use
+        the simulator in a with block, to stop the workers
+        * profile - enables the per-phase statistics, see stats and
+        set_profiling
 
     The following parameters are only used during initialization and not saved:
         * n_left - number of particles created within the left side of the box
@@ -35,7 +67,7 @@ class Simulator:
 
     This class also provides an option to simulate from a specific state.
     To do so, instantiate a simulator with the following parameter:
-        * particles - a list of Particle objects
+        * particles - a list of Particle objects or a ParticleStore
 
     If the parameter is specified, then n_left, n_right and v_init will be
     ignored. Otherwise, a new list of particles will be created.
@@ -58,20 +90,28 @@ class Simulator:
 
     This class also provides some properties that are generated during
     simulation and can be of use:
+        * store - ParticleStore holding the state of every particle. the
+        particles property returns a list of Particle views into it
         * time_elapsed - number of seconds passed since the start of the
         simulation.
         * time_step - number of seconds to be elapsed between current and next
         step. should not be set manually.
+        * steps - number of steps performed by simulate
+        * stats - per-phase wall time and counts of the next_state calls, a
+        particles.stats.SimulationStats. None unless profiling is enabled
     """
 
-    STRUCT_FORMAT = "ddddddddddddi"
+    STRUCT_FORMAT = HEAD_FORMAT
     STRUCT_SIZE = struct.calcsize(STRUCT_FORMAT)
+    # IDs are int16 and the lowest bit is the side, see distribute_particles
+    MAX_PARTICLES = 1 << 14
 
     __slots__ = ['box_width', 'box_height',
                  'delta_v_top', 'delta_v_bottom', 'delta_v_side',
                  'barrier_x', 'barrier_width', 'hole_y', 'hole_height',
-                 'v_loss', 'g', 'particle_r', 'particles', 'time_step',
-                 'time_elapsed',
+                 'v_loss', 'g', 'particle_r', 'store', 'engine', 'broad_phase',
+                 'max_block_level', 'pool', 'time_step',
+                 'time_elapsed', 'steps', 'stats',
                  'x_min', 'x_max', 'y_min', 'y_max', 'barrier_x_min',
                  'barrier_x_max',
                  'barrier_x_left', 'barrier_x_right', 'hole_y_min',
@@ -87,8 +127,28 @@ class Simulator:
                  n_left: int = 500, n_right: int = 500,
                  v_init: float = 0.0,
                  g: float = 9.8,
-                 particles: list = None):
+                 particles=None,
+                 engine: str = 'numpy',
+                 broad_phase: str = 'all',
+                 max_block_level: int = 0,
+                 workers: int = 1,
+                 profile: bool = False):
         # TODO: add argument validation
+        if engine not in ENGINES:
+            raise ValueError("unknown engine {engine}, expected one of "
+                             "{engines}".format(engine=engine,
+                                                engines=", ".join(ENGINES)))
+        if broad_phase not in BROAD_PHASES:
+            raise ValueError("unknown broad phase {broad_phase}, expected one "
+                             "of {broad_phases}".format(
+                                 broad_phase=broad_phase,
+                                 broad_phases=", ".join(BROAD_PHASES)))
+        self.engine = ENGINES[engine](self)
+        self.stats = None
+        self.set_profiling(profile)
+        self.broad_phase = broad_phase
+        self.max_block_level = max_block_level
+        self.pool = StripPool(self, workers) if workers > 1 else None
         self.box_width = box_width
         self.box_height = box_height
         self.delta_v_top = delta_v_top
@@ -102,6 +162,7 @@ class Simulator:
         self.particle_r = particle_r
         self.g = g
         self.time_elapsed = 0.0
+        self.steps = 0
 
         self.x_min = particle_r
         self.x_max = self.box_width - particle_r
@@ -123,38 +184,127 @@ class Simulator:
                                                        n_right=n_right,
                                                        v_init=v_init)
 
+    @property
+    def particles(self):
+        """
+        Return a list of Particle views into the simulator's store
+
+        :return:
+        :rtype: list[Particle]
+        """
+        return self.store.views()
+
+    @particles.setter
+    def particles(self, particles):
+        self.store = ParticleStore.from_particles(particles)
+
     def state(self):
         """
-        Return the copy of all current particle data
+        Return a read-only copy of all current particle data
 
         :return:
+        :rtype: ParticleStore
         """
-        return copy.deepcopy(self.particles)
+        return self.store.frozen()
 
-    def simulate(self, num_seconds, num_snapshots):
+    def simulate(self, num_seconds, num_snapshots, start_time=None,
+                 start_snapshot=0):
         """
         Simulate particle movement for the provided number of seconds, yield
         snapshots with the provided frequency
 
+        Every snapshot is a pair of the time since the start and a read-only
+        copy of the particles (see ParticleStore.frozen), which stays valid
+        while the simulation goes on.
+
+        :param num_seconds: number of seconds to simulate
+        :type num_seconds: float
+        :param num_snapshots: number of snapshots to save in one second (frequency)
+        :type num_snapshots: float
+        :param start_time: time_elapsed at the start, defaults to the current
+        :type start_time: float
+        :param start_snapshot: number of snapshots already taken
+        :type start_snapshot: int
+        :return:
+        """
+        for (curr_t, frame) in self.snapshot_times(num_seconds, num_snapshots,
+                                                   start_time, start_snapshot):
+            yield (curr_t, frame.frozen())
+
+    def snapshot_times(self, num_seconds, num_snapshots, start_time=None,
+                       start_snapshot=0):
+        """
+        Simulate particle movement for the provided number of seconds, yield
+        the time since the start and the state of every snapshot
+
+        The snapshot k is taken at exactly k / num_snapshots seconds, whatever
+        the time step. Snapshots falling at the end of a step are the state of
+        the simulator. Snapshots falling inside a step are the state before
+        the step, moved under gravity to the time of the snapshot, i.e. the
+        particles in flight before the collisions at the end of the step (with
+        block time steps, of the block step). Any number of snapshots may fall
+        inside a single step.
+
+        The state is a ParticleStore that is only valid until the generator
+        is resumed: the simulator's store, or a store reused for every
+        snapshot. This is simulate without copying the particles, for
+        consumers reading the state before resuming the generator, like
+        simulate_to_file.
+
+        An interrupted simulation is continued by passing the value of
+        time_elapsed at its start as start_time and the number of snapshots
+        it yielded as start_snapshot. The state before a step is not kept by
+        the simulator, so the simulation can only be interrupted once every
+        snapshot falling inside the step in progress has been yielded, i.e.
+        when the next one falls at or after time_elapsed.
+
         :param num_seconds: number of seconds to simulate
         :type num_seconds: float
         :param num_snapshots: number of snapshots to save in one second (frequency)
         :type num_snapshots: float
+        :param start_time: time_elapsed at the start, defaults to the current
+        :type start_time: float
+        :param start_snapshot: number of snapshots already taken
+        :type start_snapshot: int
         :return:
         """
-        curr_t = 0
-        snap_seconds = [1 / num_snapshots * t for t in
-                        range(1, floor(num_seconds * num_snapshots) + 1)]
-        while curr_t < num_seconds and snap_seconds:
+        if start_time is None:
+            start_time = self.time_elapsed
+        last_snapshot = floor(num_seconds * num_snapshots)
+        snapshot = start_snapshot + 1
+        store = self.store
+        previous = ParticleStore(len(self))
+        frame = ParticleStore(len(self))
+        g = self.g
+        while snapshot <= last_snapshot:
+            curr_t = self.time_elapsed - start_time
+            np.copyto(previous.data, store.data)
+            np.copyto(previous.id, store.id)
             time_step = self.next_state()
-            if curr_t < snap_seconds[0] < curr_t + time_step:
-                snap_seconds.pop(0)
-                yield (curr_t, copy.copy(self.particles))
-            curr_t += time_step
+            self.steps += 1
             self.time_elapsed += time_step
+            next_t = self.time_elapsed - start_time
+            while snapshot <= last_snapshot:
+                snap_second = 1 / num_snapshots * snapshot
+                if snap_second >= next_t:
+                    if snap_second == next_t:
+                        snapshot += 1
+                        yield (snap_second, store)
+                    break
+                dt = snap_second - curr_t
+                np.copyto(frame.data, previous.data)
+                np.copyto(frame.id, previous.id)
+                frame.pos_x += frame.velocity_x * dt
+                frame.pos_y += frame.velocity_y * dt - g * (dt ** 2) / 2
+                frame.velocity_y -= g * dt
+                snapshot += 1
+                yield (snap_second, frame)
 
     def simulate_to_file(self, file_path, num_seconds, num_snapshots,
-                         write_head=True):
+                         write_head=True, flush_interval=None,
+                         compression=None, quantise=False, delta=False,
+                         checkpoint_interval=None, resume=False,
+                         record_stats=False, record_observables=False):
         """
         Simulate particle movement for the provided number of seconds, save
         num_snapshots per second in file.
@@ -162,6 +312,35 @@ class Simulator:
         If write_head is True, write the simulator's parameters and current
         state at the beginning of the file.
 
+        Snapshots are written in batches of flush_interval snapshots, by
+        default 1 for version 1 recordings and 64 for version 2. The remaining
+        snapshots are written when the simulation is over or the generator is
+        closed.
+
+        If compression is given, write a version 2 recording, i.e. snapshots
+        compressed in chunks of flush_interval snapshots, see
+        particles.recording. With delta, every chunk is a keyframe followed
+        by snapshots encoded as differences from the previous one.
+
+        Every checkpoint_interval snapshots the buffered snapshots are written
+        and the checkpoint of the recording is saved (see
+        particles.recording.checkpoint_path). A snapshot falling inside a step
+        is taken from the state before the step, so the checkpoint is delayed
+        until the last snapshot of the step in progress, see snapshot_times:
+        the checkpoint only holds the state at the end of the step, which is
+        the state the following snapshots are taken from. It is removed once the
+        simulation is over. With resume, the recording is cut at its
+        checkpoint and continued from there, the simulator must be restored
+        from the same checkpoint with Simulator.resume and every argument must
+        be the same as the ones of the interrupted call.
+
+        With record_stats, the per-phase statistics of the steps between
+        snapshots are written next to the recording, see
+        particles.recording.stats_path. Profiling must be enabled.
+
+        With record_observables, the observables of every written snapshot
+        are written next to the recording, see particles.observables.
+
         :param file_path: path to the destination file
         :type file_path: str
         :param num_seconds: number of seconds to simulate
@@ -170,28 +349,165 @@ class Simulator:
         :type num_snapshots: float
         :param write_head: flag determining if the
         :type write_head: bool
+        :param flush_interval: number of snapshots written at once
+        :type flush_interval: int
+        :param compression: None for a version 1 recording, or one of
+        particles.recording.COMPRESSIONS
+        :type compression: str
+        :param quantise: store positions as float32, version 2 only
+        :type quantise: bool
+        :param delta: delta encode snapshots, version 2 only
+        :type delta: bool
+        :param checkpoint_interval: number of snapshots between checkpoints
+        :type checkpoint_interval: int
+        :param resume: continue the recording from its checkpoint
+        :type resume: bool
+        :param record_stats: write the per-phase statistics
+        :type record_stats: bool
+        :param record_observables: write the observables of the snapshots
+        :type record_observables: bool
         :return:
         """
-        with open(file_path, "wb") as f:
-            if write_head:
-                f.write(struct.pack(self.STRUCT_FORMAT, self.box_width,
-                                    self.box_height, self.delta_v_top,
-                                    self.delta_v_bottom, self.delta_v_side,
-                                    self.barrier_x,
-                                    self.barrier_width, self.hole_y,
-                                    self.hole_height, self.v_loss,
-                                    self.particle_r, self.g,
-                                    len(self.particles)))
-                f.write(struct.pack("d", self.time_elapsed))
-                for particle in self.particles:
-                    f.write(bytes(particle))
-
-            for (time_elapsed, particles) in self.simulate(
-                    num_seconds=num_seconds, num_snapshots=num_snapshots):
-                f.write(struct.pack("d", time_elapsed))
-                for particle in particles:
-                    f.write(bytes(particle))
-                yield
+        if compression is not None and not write_head:
+            raise ValueError("version 2 recordings can not be written "
+                             "without the head")
+        if compression is None and (quantise or delta):
+            raise ValueError("quantise and delta require a compression")
+        if record_stats and self.stats is None:
+            raise ValueError("record_stats requires profiling, see "
+                             "set_profiling")
+        options = {'num_seconds': num_seconds,
+                   'num_snapshots': num_snapshots, 'write_head': write_head,
+                   'compression': compression, 'quantise': quantise,
+                   'delta': delta, 'record_stats': record_stats,
+                   'record_observables': record_observables}
+        if resume:
+            checkpoint = load_checkpoint(file_path)
+            if checkpoint['options'] != options:
+                raise ValueError("arguments differ from the ones of the "
+                                 "checkpointed recording: {options}".format(
+                                     options=checkpoint['options']))
+            start_time = checkpoint['start_time']
+            start_snapshot = checkpoint['snapshots']
+            if (1 / num_snapshots * (start_snapshot + 1) <
+                    checkpoint['time_elapsed'] - start_time):
+                raise ValueError("the checkpoint was saved while snapshots "
+                                 "were pending inside a step")
+        else:
+            start_time = self.time_elapsed
+            start_snapshot = 0
+
+        with open(file_path, "r+b" if resume else "wb") as f:
+            if compression is None:
+                writer = SnapshotWriter(f, len(self), flush_interval or 1)
+            else:
+                writer = ChunkedWriter(f, len(self), flush_interval or 64,
+                                       compression, quantise, delta)
+            stats_file = None
+            observables = None
+            try:
+                if resume:
+                    writer.restore(checkpoint['writer'])
+                elif write_head:
+                    writer.write_head(self)
+                    writer.write_snapshot(self.time_elapsed, self.store)
+                if record_observables:
+                    if resume:
+                        observables = ObservablesWriter(
+                            open(observables_path(file_path), "r+b"),
+                            start_snapshot + bool(write_head))
+                    else:
+                        observables = ObservablesWriter(
+                            open(observables_path(file_path), "wb"))
+                        if write_head:
+                            observables.write(self, self.time_elapsed)
+                if record_stats:
+                    stats_file = open(stats_path(file_path),
+                                      "r+b" if resume else "wb")
+                    if resume:
+                        stats_file.seek(checkpoint['stats_offset'])
+                        stats_file.truncate()
+                    # only the steps of this recording are reported
+                    self.stats.take_interval()
+
+                snapshots = start_snapshot
+                checkpoint_due = False
+                for (time_elapsed, frame) in self.snapshot_times(
+                        num_seconds=num_seconds, num_snapshots=num_snapshots,
+                        start_time=start_time, start_snapshot=start_snapshot):
+                    writer.write_snapshot(time_elapsed, frame)
+                    if observables is not None:
+                        observables.write(self, time_elapsed, frame)
+                        if not writer.buffered:
+                            # keep up with the snapshots for readers
+                            # following the recording
+                            observables.flush()
+                    snapshots += 1
+                    if stats_file is not None:
+                        line = dict(self.stats.take_interval(),
+                                    snapshot=snapshots, time=time_elapsed)
+                        stats_file.write(json.dumps(line).encode() + b"\n")
+                    if (checkpoint_interval and
+                            snapshots % checkpoint_interval == 0):
+                        checkpoint_due = True
+                    # wait until the next snapshot is not taken from the
+                    # state before the step in progress, it is not restored
+                    if checkpoint_due and (
+                            1 / num_snapshots * (snapshots + 1) >=
+                            self.time_elapsed - start_time):
+                        checkpoint_due = False
+                        if stats_file is not None:
+                            stats_file.flush()
+                        if observables is not None:
+                            observables.flush()
+                        # the state at the end of the step, see above
+                        save_checkpoint(file_path, {
+                            'options': options,
+                            'start_time': start_time,
+                            'snapshots': snapshots,
+                            'time_elapsed': self.time_elapsed,
+                            'data': self.store.data.copy(),
+                            'id': self.store.id.copy(),
+                            'random': random.getstate(),
+                            'writer': writer.checkpoint(),
+                            'stats_offset': (stats_file.tell()
+                                             if stats_file is not None
+                                             else None)})
+                    yield
+            finally:
+                writer.close()
+                if stats_file is not None:
+                    stats_file.close()
+                if observables is not None:
+                    observables.close()
+        if checkpoint_interval and os.path.exists(checkpoint_path(file_path)):
+            os.remove(checkpoint_path(file_path))
+
+    @classmethod
+    def resume(cls, file_path, **kwargs):
+        """
+        Restore the simulator of an interrupted recording from its checkpoint.
+
+        The parameters are read from the head of the recording, the state of
+        the particles, time_elapsed and the state of the random number
+        generator from the checkpoint. Continue the recording with
+        simulate_to_file(..., resume=True).
+
+        :param file_path: path to the recording
+        :type file_path: str
+        :param kwargs: other arguments of the simulator, e.g. engine
+        :return:
+        :rtype: Simulator
+        """
+        checkpoint = load_checkpoint(file_path)
+        store = ParticleStore(len(checkpoint['id']))
+        store.data[:] = checkpoint['data']
+        store.id[:] = checkpoint['id']
+        simulator = cls(**Playback(file_path).parameters,
+                        n_left=0, n_right=0, particles=store, **kwargs)
+        simulator.time_elapsed = checkpoint['time_elapsed']
+        random.setstate(checkpoint['random'])
+        return simulator
 
     def next_state(self):
         """
@@ -203,115 +519,115 @@ class Simulator:
         particle collides with walls. If so, move them and rotate their
         velocity vector
 
+        Every phase is performed by the simulator's engine. If block time
+        steps are enabled, perform a block step instead, see next_block_state.
 
         :return: period of time after which there make a simulation
         :rtype: float
         """
+        if self.max_block_level:
+            return self.next_block_state()
+
         time_step = self.calculate_time_step()
-        gravity_pull = self.g * (time_step ** 2) / 2
 
-        # Create links to speed the code up
-        particles = self.particles
-        particle_r = self.particle_r
-        particle_r_2 = particle_r * 2
-        particle_r_squared = particle_r ** 2
+        engine = self.engine
+        engine.move(time_step)
+        engine.sort()
+        engine.collide_particles()
+        engine.collide_walls()
+        if self.stats is not None:
+            self.stats.end_step()
+        return time_step
 
-        speed_factor = 1 - self.v_loss
+    def next_block_state(self):
+        """
+        Perform simulation of the particle movement using block time steps.
+
+        The base time step is calculated as usual, then every particle gets a
+        level k, so that it will not travel over an eighth of its radius in
+        2 ** k base steps (see calculate_block_levels). The block step
+        consists of 2 ** K base steps, where K is the highest level.
+
+        A particle of level k is active in every (2 ** k)-th base step. Only
+        the active particles move, each for the time elapsed since its own
+        previous move, and are checked for collisions. Pairs with at least
+        one active particle are checked, so any two particles are checked at
+        the pace of the faster one. A particle whose velocity changes in a
+        collision becomes level 0, and a particle whose speed grows past the
+        limit of its level gets a lower level, until the end of the block
+        step. Levels only decrease, so every particle is active in the last
+        base step, and the block step ends with all particles at the same
+        time.
 
-        x_min = self.x_min
-        x_max = self.x_max
-        y_min = self.y_min
-        y_max = self.y_max
-        barrier_x = self.barrier_x
-        barrier_x_min = self.barrier_x_min
-        barrier_x_max = self.barrier_x_max
-        barrier_x_left = self.barrier_x_left
-        barrier_x_right = self.barrier_x_right
-        hole_y_max = self.hole_y_max
-        hole_y_min = self.hole_y_min
-
-        delta_v_top = self.delta_v_top
-        delta_v_bottom = self.delta_v_bottom
-        delta_v_side = self.delta_v_side
-
-        # Move all the particles
-        for particle in self.particles:
-            particle.pos_x += particle.velocity_x * time_step
-            particle.pos_y += particle.velocity_y * time_step - gravity_pull
-            particle.velocity_y -= self.g * time_step
-
-        particles.sort(key=lambda x: x.pos_y)
-
-        # Check collisions between particles
-        for (i, particle) in enumerate(particles):
-            particle_overlaps = particle.overlaps
-            particle_is_approaching = particle.is_approaching
-            particle_distance_to = particle.distance_to
-            for other_particle in particles[i + 1:]:
-                dy = particle.pos_y - other_particle.pos_y
-                if dy < particle_r_squared:
-                    continue
-                if particle_overlaps(other_particle,
-                                     particle_r) and particle_is_approaching(
-                    other_particle):
-                    particle.velocity_x *= speed_factor
-                    particle.velocity_y *= speed_factor
-                    other_particle.velocity_x *= speed_factor
-                    other_particle.velocity_y *= speed_factor
-
-                    dx = particle.pos_x - other_particle.pos_x
-                    distance_between_particles = particle_distance_to(
-                        other_particle)
-                    distance_to_move = particle_r_2 - distance_between_particles
-                    if dy > 0:
-                        particle.pos_x += distance_to_move * (
-                            dx / distance_between_particles)
-                        particle.pos_y += distance_to_move * (
-                            dy / distance_between_particles)
-                    else:
-                        other_particle.pos_x -= distance_to_move * (
-                            dx / distance_between_particles)
-                        other_particle.pos_y -= distance_to_move * (
-                            dy / distance_between_particles)
-
-        # Check collision with walls
-
-        for particle in particles:
-            pos_x = particle.pos_x
-            pos_y = particle.pos_y
-            velocity_x = particle.velocity_x
-            velocity_y = particle.velocity_y
-            if pos_y > y_max and velocity_y > 0:  # box ceiling
-                particle.pos_y = y_max
-                particle.velocity_y = -velocity_y - delta_v_top
-            elif pos_y < y_min and velocity_y < 0:  # box floor
-                particle.pos_y = y_min
-                particle.velocity_y = -velocity_y + delta_v_bottom
-
-            if pos_x > x_max and velocity_x > 0:  # box right side
-                particle.pos_x = x_max
-                particle.velocity_x = -velocity_x - delta_v_side
-            elif pos_x < x_min and velocity_x < 0:  # box left side
-                particle.pos_x = x_min
-                particle.velocity_x = -velocity_x + delta_v_side
-            elif barrier_x_min < pos_x < barrier_x_max:  # barrier collisions
-                velocity_y = particle.velocity_y  # collision with the top
-                pos_y = particle.pos_y
-                if barrier_x_left < pos_x < barrier_x_right:  # inside hole
-                    if pos_y > hole_y_min and velocity_y > 0:
-                        particle.pos_y = hole_y_min
-                        particle.velocity_y = -velocity_y - delta_v_top
-                    elif pos_y < hole_y_max and velocity_y < 0:
-                        particle.pos_y = hole_y_max
-                        particle.velocity_y = -velocity_y + delta_v_bottom
-                elif pos_y < hole_y_max or pos_y > hole_y_min:
-                    if pos_x < barrier_x:
-                        particle.pos_x = barrier_x_min
-                        particle.velocity_x = -particle.velocity_x - delta_v_side
-                    else:
-                        particle.pos_x = barrier_x_max
-                        particle.velocity_x = -particle.velocity_x + delta_v_side
-        return time_step
+        :return: period of time after which there make a simulation
+        :rtype: float
+        """
+        time_step = self.calculate_time_step()
+        levels = self.calculate_block_levels(time_step)
+        num_steps = 1 << int(levels.max())
+        # base step of the previous move of every particle
+        moved = np.zeros(len(self), dtype=np.int64)
+
+        store = self.store
+        engine = self.engine
+        for step in range(1, num_steps + 1):
+            active = step % np.left_shift(1, levels) == 0
+            engine.move(time_step * (step - moved), active)
+            moved[active] = step
+            order = engine.sort()
+            if order is not None:
+                levels = levels[order]
+                moved = moved[order]
+                active = active[order]
+            velocities = store.data[2:].copy()
+            engine.collide_particles(active)
+            engine.collide_walls(active)
+            levels[(store.data[2:] != velocities).any(axis=0)] = 0
+            np.minimum(levels, self.calculate_block_levels(time_step),
+                       out=levels)
+        if self.stats is not None:
+            self.stats.end_step()
+        return time_step * num_steps
+
+    def set_profiling(self, enabled):
+        """
+        Enable or disable the per-phase statistics.
+
+        When enabled, the engine is wrapped in a
+        particles.stats.ProfilingEngine and every next_state call is recorded
+        in stats. Disabling it restores the engine and sets stats to None.
+
+        :param enabled:
+        :type enabled: bool
+        :return:
+        """
+        if enabled and self.stats is None:
+            self.stats = SimulationStats()
+            self.engine = ProfilingEngine(self.engine, self.stats)
+        elif not enabled and self.stats is not None:
+            self.stats = None
+            self.engine = self.engine.engine
+
+    def calculate_block_levels(self, time_step):
+        """Calculate the block time step level of every particle.
+
+        A particle has level k if in 2 ** k time steps it will not travel over
+        an eighth of its radius, taking into account the speed it gains
+        because of gravity. The level never exceeds max_block_level.
+
+        :param time_step: base time step
+        :type time_step: float
+        :return:
+        :rtype: numpy.ndarray
+        """
+        speed = self.store.speed()
+        max_distance = self.particle_r / 8
+        levels = np.zeros(len(self), dtype=np.int64)
+        for level in range(1, self.max_block_level + 1):
+            block_time = time_step * (1 << level)
+            fits = (speed + self.g * block_time) * block_time <= max_distance
+            levels[fits & (levels == level - 1)] = level
+        return levels
 
     def calculate_time_step(self):
         """Calculate the time step for simulation.
@@ -327,8 +643,7 @@ class Simulator:
         :return:
         :rtype: float
         """
-        fastest_particle = max(self.particles, key=lambda x: x.speed())
-        max_velocity = fastest_particle.speed()
+        max_velocity = float(self.store.speed().max())
         max_distance = self.particle_r / 8
         return max_distance / max_velocity if max_velocity else sqrt(
             self.particle_r / (4 * self.g))
@@ -360,6 +675,12 @@ class Simulator:
 
             The next particle created on the right side will have ID "1011".
 
+        Particles are placed uniformly and not overlapping each other (see
+        Particle.overlaps) with particles.placement.place_points. Random
+        numbers are drawn from a NumPy generator seeded from the random
+        module, so seeding the random module makes the distribution
+        reproducible. IDs are int16, so at most MAX_PARTICLES particles can
+        be created, otherwise ValueError is raised.
 
         :param n_left: number of particles to be created within the left side
         of the box
@@ -371,9 +692,12 @@ class Simulator:
         must be a positive number
         :type v_init: float
         :return:
+        :rtype: ParticleStore
         """
-        particles = []
-        particles_right = []
+        if n_left + n_right > self.MAX_PARTICLES:
+            raise ValueError("at most {max} particles can be created".format(
+                max=self.MAX_PARTICLES))
+        rng = np.random.default_rng(random.getrandbits(64))
         # Use local variables instead of class properties to speed things up
         box_width = self.box_width
         box_height = self.box_height
@@ -383,46 +707,42 @@ class Simulator:
         half_particle_r = self.particle_r / 2
         padding_top = box_height - half_particle_r
 
-        # Generate particles @ the left
         padding_barrier_left = barrier_x - barrier_width / 2 - half_particle_r
         padding_barrier_right = barrier_x + barrier_width / 2 + half_particle_r
         padding_right_wall = box_width - half_particle_r
 
-        for i in range(n_left):
-            touching = True
-            particle_id = (i << 1)
-            while touching:
-                touching = False
-                pos_x = random.uniform(half_particle_r, padding_barrier_left)
-                pos_y = random.uniform(half_particle_r, padding_top)
-                angle = random.vonmisesvariate(0.0, 0.0)
-                particle = Particle(particle_id, pos_x, pos_y,
-                                    v_init * cos(angle), v_init * sin(angle))
-                for par in particles:
-                    if particle.overlaps(par, particle_r):
-                        touching = True
-                        break
-            particles.append(particle)
-
-        # Generate particles @ the right
-        for i in range(n_left, n_left + n_right):
-            touching = True
-            particle_id = 1 | (i << 1)
-            while touching:
-                touching = False
-                pos_x = random.uniform(padding_barrier_right,
-                                       padding_right_wall)
-                pos_y = random.uniform(half_particle_r, padding_top)
-                angle = random.vonmisesvariate(0.0, 0.0)
-                particle = Particle(particle_id, pos_x, pos_y,
-                                    v_init * cos(angle), v_init * sin(angle))
-                for par in particles_right:
-                    if particle.overlaps(par, particle_r):
-                        touching = True
-                        break
-            particles_right.append(particle)
-        particles.extend(particles_right)
-        return particles
+        # Generate particles @ the left, then @ the right
+        (left_x, left_y) = place_points(rng, n_left, half_particle_r,
+                                        padding_barrier_left, half_particle_r,
+                                        padding_top, particle_r ** 2)
+        (right_x, right_y) = place_points(rng, n_right, padding_barrier_right,
+                                          padding_right_wall, half_particle_r,
+                                          padding_top, particle_r ** 2)
+        angle = rng.uniform(0.0, 2 * np.pi, n_left + n_right)
+
+        store = ParticleStore(n_left + n_right)
+        store.pos_x[:] = np.concatenate((left_x, right_x))
+        store.pos_y[:] = np.concatenate((left_y, right_y))
+        store.velocity_x[:] = v_init * np.cos(angle)
+        store.velocity_y[:] = v_init * np.sin(angle)
+        store.id[:] = np.arange(n_left + n_right) << 1
+        store.id[n_left:] |= 1
+        return store
+
+    def close(self):
+        """
+        Stop the worker processes, if any
+
+        :return:
+        """
+        if self.pool is not None:
+            self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     def __len__(self):
         """
@@ -430,48 +750,56 @@ class Simulator:
 
         :return:
         """
-        return len(self.particles)
+        return len(self.store)
 
 
 class Playback:
-    def __init__(self, file_name):
+    """Reader of a recording written by Simulator.simulate_to_file.
+
+    Both versions of recordings are supported, the version is detected from
+    the file. With memory_map a version 1 recording is mapped into memory and
+    every snapshot is exposed as a NumPy structured-array view into the
+    mapping, so accessing any snapshot neither reads nor copies anything
+    until its data is used.
+
+    The observables written with the recording (see
+    particles.observables) are read at creation into recorded_observables,
+    None if there are none.
+
+    A recording that is still being written can be followed: refresh() takes
+    the snapshots flushed since the playback was opened or last refreshed
+    into account, the length is not looked up on every call otherwise.
+    Snapshots of a version 2 recording become available chunk by chunk.
+
+    :param file_name: path to the recording
+    :type file_name: str
+    :param memory_map: map the file into memory instead of reading it
+    :type memory_map: bool
+    """
+
+    def __init__(self, file_name, memory_map=False):
         self.file_name = file_name
         self.file = open(file_name, mode='br')
-        (box_width, box_height, delta_v_top,
-         delta_v_bottom, delta_v_side, barrier_x,
-         barrier_width, hole_y, hole_height, v_loss,
-         particle_r, g, n_particles) = struct.unpack(Simulator.STRUCT_FORMAT,
-                                                     self.file.read(
-                                                         Simulator.STRUCT_SIZE))
-        (time_elapsed,) = struct.unpack("d",
-                                        self.file.read(struct.calcsize("d")))
-        particles = []
-        for i in range(n_particles):
-            data = self.file.read(Particle.STRUCT_SIZE)
-            particles.append(Particle(data))
-        self.simulator = Simulator(box_width=box_width, box_height=box_height,
-                                   delta_v_top=delta_v_top,
-                                   delta_v_bottom=delta_v_bottom,
-                                   delta_v_side=delta_v_side,
-                                   barrier_x=barrier_x,
-                                   barrier_width=barrier_width, hole_y=hole_y,
-                                   hole_height=hole_height,
-                                   v_loss=v_loss,
-                                   particle_r=particle_r,
-                                   g=g,
-                                   particles=particles)
-        self.simulator.time_elapsed = time_elapsed
-
-        self.pointer = self.file.tell()
-        self.current_state = 0
-
-        self.size_double = struct.calcsize("d")
+        self.reader = open_recording(self.file, memory_map)
+        self.parameters = dict(zip(HEAD_FIELDS, struct.unpack(
+            Simulator.STRUCT_FORMAT, self.reader.head)))
+        self.parameters.pop('n_particles')
+        self.recorded_observables = load_observables(file_name)
+        if not len(self.reader):
+            raise ValueError("{file_name} has no snapshots yet".format(
+                file_name=file_name))
+
+        snapshot = self.snapshot(0)
+        self.simulator = Simulator(**self.parameters,
+                                   n_left=0, n_right=0,
+                                   particles=store_from_records(
+                                       snapshot['particles']))
+        self.simulator.time_elapsed = float(snapshot['time'])
 
-        self.snapshot_data_size = Simulator.STRUCT_SIZE
-        self.snapshot_size = (self.size_double +
-                              len(self.simulator) * Particle.STRUCT_SIZE)
+        self.current_state = 0
 
     def __del__(self):
+        self.reader.close()
         self.file.close()
 
     def __len__(self):
@@ -480,11 +808,36 @@ class Playback:
 
         :return:
         """
-        snapshot_data_size = os.path.getsize(
-            self.file_name) - Simulator.STRUCT_SIZE
-        snapshot_size = struct.calcsize("d") + len(
-            self.simulator) * Particle.STRUCT_SIZE
-        return snapshot_data_size // snapshot_size
+        return len(self.reader)
+
+    def refresh(self):
+        """
+        Take the snapshots and observables written to the recording since
+        the last refresh into account
+
+        :return: number of snapshots in the playback
+        :rtype: int
+        """
+        length = self.reader.refresh()
+        self.recorded_observables = load_observables(self.file_name)
+        return length
+
+    def snapshot(self, index):
+        """
+        Return the snapshot with the given index as a record with fields
+        `time` and `particles`, the latter being an array of
+        particles.recording.PARTICLE_DTYPE, or QUANTISED_PARTICLE_DTYPE for
+        quantised recordings.
+
+        With memory_map the record is a read-only view into the file. If not,
+        it is only valid until the next call.
+
+        :param index: index of the snapshot
+        :type index: int
+        :return:
+        :rtype: numpy.void
+        """
+        return self.reader.snapshot(index)
 
     def set_state(self, new_state):
         """
@@ -503,16 +856,24 @@ class Playback:
                 new_state=new_state
             ))
 
-        self.file.seek(
-            self.snapshot_data_size + self.snapshot_size * new_state)
-        (self.simulator.time_elapsed,) = struct.unpack("d", self.file.read(
-            self.size_double))
-        self.simulator.particles = [
-            Particle(self.file.read(Particle.STRUCT_SIZE))
-            for particle in self.simulator.particles]
-        self.pointer = self.file.tell()
+        snapshot = self.snapshot(new_state)
+        self.simulator.time_elapsed = float(snapshot['time'])
+        load_records(self.simulator.store, snapshot['particles'])
         self.current_state = new_state
 
+    def observables(self):
+        """
+        Return the observables of the current state, as recorded, or
+        computed from the current snapshot if they were not recorded.
+
+        :return: record of particles.observables.OBSERVABLES_DTYPE
+        :rtype: numpy.void
+        """
+        recorded = self.recorded_observables
+        if recorded is not None and self.current_state < len(recorded):
+            return recorded[self.current_state]
+        return measure(self.simulator, self.simulator.time_elapsed)
+
     def next_state(self):
         """
         Read data from the file for the next simulation
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+"""Per-phase statistics of the simulation steps.
+
+Profiling is enabled with Simulator(..., profile=True) or
+Simulator.set_profiling(True). The simulator's engine is then wrapped in a
+ProfilingEngine, which times every phase and counts what happens in it, and
+the counts of every next_state call are accumulated in Simulator.stats, a
+SimulationStats. When profiling is disabled, the engine is not wrapped and
+stats is None, so the simulation runs exactly the same code as without this
+module.
+"""
+
+from time import perf_counter
+
+import numpy as np
+
+from particles.broadphase import BROAD_PHASES
+
+# Seconds of wall time spent in each phase
+PHASES = ('move', 'sort', 'broad_phase', 'narrow_phase', 'walls')
+
+# Counts of events:
+#   * base_steps - moves of the particles, more than one per next_state call
+#   with block time steps
+#   * candidates - pairs checked by the narrow phase. with the "all" broad
+#   phase, the number of pairs with an active particle. not counted when the
+#   collisions are resolved by worker processes
+#   * overlaps - candidate pairs overlapping before the collisions are
+#   resolved, see Particle.overlaps
+#   * collisions - pairs of particles that collided
+#   * wall_hits - collisions with the box floor, ceiling and sides
+#   * barrier_hits - collisions with the barrier faces and the hole edges
+#   * hole_passages - particles that moved to the other side of the barrier
+COUNTERS = ('base_steps', 'candidates', 'overlaps', 'collisions', 'wall_hits',
+            'barrier_hits', 'hole_passages')
+
+FIELDS = ('steps',) + tuple(phase + '_seconds' for phase in PHASES) + \
+    COUNTERS
+
+
+class SimulationStats:
+    """Accumulator of the per-phase statistics.
+
+    The statistics of the next_state call in progress are collected in
+    current. end_step moves them to last and adds them to totals and to
+    interval, the totals since the previous take_interval call. Every dict
+    has the keys of FIELDS, where steps is the number of next_state calls.
+    """
+
+    __slots__ = ['current', 'last', 'totals', 'interval']
+
+    def __init__(self):
+        self.current = dict.fromkeys(FIELDS, 0)
+        self.last = dict.fromkeys(FIELDS, 0)
+        self.totals = dict.fromkeys(FIELDS, 0)
+        self.interval = dict.fromkeys(FIELDS, 0)
+
+    def end_step(self):
+        """
+        Finish the statistics of a next_state call
+
+        :return:
+        """
+        current = self.current
+        current['steps'] = 1
+        for name in FIELDS:
+            self.totals[name] += current[name]
+            self.interval[name] += current[name]
+        self.last = current
+        self.current = dict.fromkeys(FIELDS, 0)
+
+    def take_interval(self):
+        """
+        Return the totals since the previous call and start a new interval
+
+        :return:
+        :rtype: dict
+        """
+        interval = self.interval
+        self.interval = dict.fromkeys(FIELDS, 0)
+        return interval
+
+    def reset(self):
+        """
+        Clear every statistic
+
+        :return:
+        """
+        self.__init__()
+
+
+class ProfilingEngine:
+    """Engine timing and counting the phases of another engine.
+
+    The phases are delegated to the wrapped engine. Everything the wrapper
+    counts is derived from the state of the store around the phases, so the
+    engines need no instrumentation:
+
+        * the broad phase is run separately from the narrow phase, unless
+        every pair is checked or the collisions are resolved by worker
+        processes, in which case the whole phase counts as narrow
+        * wall and barrier hits are the particles whose velocity changed in
+        collide_walls, by the limit their position was set to
+        * hole passages compare the side of the barrier of every particle
+        before move and after collide_walls
+
+    :param engine: wrapped engine
+    :param stats: statistics to update
+    :type stats: SimulationStats
+    """
+
+    __slots__ = ['engine', 'simulator', 'stats', 'sides']
+
+    def __init__(self, engine, stats):
+        self.engine = engine
+        self.simulator = engine.simulator
+        self.stats = stats
+        self.sides = None
+
+    def move(self, time_step, active=None):
+        store = self.simulator.store
+        self.sides = store.pos_x < self.simulator.barrier_x
+        start = perf_counter()
+        self.engine.move(time_step, active)
+        current = self.stats.current
+        current['move_seconds'] += perf_counter() - start
+        current['base_steps'] += 1
+
+    def sort(self):
+        start = perf_counter()
+        order = self.engine.sort()
+        self.stats.current['sort_seconds'] += perf_counter() - start
+        if order is not None and self.sides is not None:
+            self.sides = self.sides[order]
+        return order
+
+    def collide_particles(self, active=None):
+        simulator = self.simulator
+        current = self.stats.current
+        broad_phase = BROAD_PHASES[simulator.broad_phase]
+        if simulator.pool is None and broad_phase is not None:
+            start = perf_counter()
+            (first, second) = broad_phase(simulator, active)
+            current['broad_phase_seconds'] += perf_counter() - start
+            current['candidates'] += first.shape[0]
+            current['overlaps'] += self.count_overlaps(first, second)
+            start = perf_counter()
+            collisions = self.engine.collide_pairs(first, second)
+            current['narrow_phase_seconds'] += perf_counter() - start
+        else:
+            if simulator.pool is None:
+                size = len(simulator)
+                n_active = size if active is None else int(active.sum())
+                current['candidates'] += (n_active * (size - n_active) +
+                                          n_active * (n_active - 1) // 2)
+            current['overlaps'] += self.count_overlaps(
+                *BROAD_PHASES['grid'](simulator, active))
+            start = perf_counter()
+            collisions = self.engine.collide_particles(active)
+            current['narrow_phase_seconds'] += perf_counter() - start
+        current['collisions'] += collisions
+        return collisions
+
+    def collide_pairs(self, first, second):
+        return self.engine.collide_pairs(first, second)
+
+    def collide_walls(self, active=None):
+        simulator = self.simulator
+        store = simulator.store
+        before = store.data[2:].copy()
+        start = perf_counter()
+        self.engine.collide_walls(active)
+        current = self.stats.current
+        current['walls_seconds'] += perf_counter() - start
+
+        (pos_x, pos_y, velocity_x, velocity_y) = store.data
+        hit_x = velocity_x != before[0]
+        hit_y = velocity_y != before[1]
+        current['wall_hits'] += int(
+            (hit_x & ((pos_x == simulator.x_min) |
+                      (pos_x == simulator.x_max))).sum() +
+            (hit_y & ((pos_y == simulator.y_min) |
+                      (pos_y == simulator.y_max))).sum())
+        current['barrier_hits'] += int(
+            (hit_x & ((pos_x == simulator.barrier_x_min) |
+                      (pos_x == simulator.barrier_x_max))).sum() +
+            (hit_y & ((pos_y == simulator.hole_y_min) |
+                      (pos_y == simulator.hole_y_max))).sum())
+        if self.sides is not None:
+            current['hole_passages'] += int(
+                (self.sides != (pos_x < simulator.barrier_x)).sum())
+            self.sides = None
+
+    def count_overlaps(self, first, second):
+        """
+        Count the overlapping pairs among the provided ones
+
+        :param first: store rows of the first particle of each pair
+        :type first: numpy.ndarray
+        :param second: store rows of the second particle of each pair
+        :type second: numpy.ndarray
+        :return:
+        :rtype: int
+        """
+        store = self.simulator.store
+        particle_r = self.simulator.particle_r
+        dx = store.pos_x[first] - store.pos_x[second]
+        dy = store.pos_y[first] - store.pos_y[second]
+        return int(((np.abs(dy) <= particle_r * 2) &
+                    (np.hypot(dx, dy) < particle_r ** 2)).sum())
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+"""Parameter sweeps.
+
+A sweep runs the simulation for every combination of the provided parameter
+values, in a pool of worker processes, and writes one recording per
+combination to the output directory together with SUMMARY_FILE, a CSV table
+with a row per combination.
+
+Usage::
+
+    python -m particles.sweep output_dir 10 30 \\
+        --set box_width=10 --set box_height=10 ... \\
+        --param v_loss=0.1,0.2,0.3 --param n_left=100,500
+"""
+
+import argparse
+import csv
+import inspect
+import itertools
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from particles.simulation import Simulator
+
+SUMMARY_FILE = "summary.csv"
+RESULT_FIELDS = ('index', 'file', 'seed', 'wall_seconds', 'snapshots',
+                 'n_left_final', 'n_right_final', 'error')
+
+
+def expand_grid(grid):
+    """Return every combination of the parameter values.
+
+    :param grid: values of every parameter
+    :type grid: dict[str, list]
+    :return: combinations, the last parameter changing fastest
+    :rtype: list[dict]
+    """
+    names = list(grid)
+    return [dict(zip(names, values))
+            for values in itertools.product(*(grid[name] for name in names))]
+
+
+def run_combination(job):
+    """Run a single simulation of the sweep and record it.
+
+    Errors are reported in the result instead of being raised, so a failing
+    combination does not stop the sweep.
+
+    :param job: index, seed, file, parameters of the simulator and arguments
+    of simulate_to_file
+    :type job: dict
+    :return: row of the summary
+    :rtype: dict
+    """
+    result = {'index': job['index'], 'file': job['file'], 'seed': job['seed'],
+              'snapshots': 0, 'error': ''}
+    start = time.perf_counter()
+    try:
+        random.seed(job['seed'])
+        with Simulator(**job['parameters']) as simulator:
+            for _ in simulator.simulate_to_file(job['path'],
+                                                **job['recording']):
+                result['snapshots'] += 1
+            n_right = int((simulator.store.pos_x >
+                           simulator.barrier_x).sum())
+        result['n_left_final'] = len(simulator) - n_right
+        result['n_right_final'] = n_right
+    except Exception as error:
+        result['error'] = "{name}: {error}".format(
+            name=type(error).__name__, error=error)
+    result['wall_seconds'] = time.perf_counter() - start
+    return result
+
+
+def run_sweep(grid, output_dir, num_seconds, num_snapshots, base=None,
+              workers=None, seed=0, callback=None, **recording):
+    """Run the simulation for every combination of the parameter values.
+
+    :param grid: values of every swept parameter of Simulator
+    :type grid: dict[str, list]
+    :param output_dir: directory for the recordings and the summary
+    :type output_dir: str
+    :param num_seconds: number of seconds to simulate
+    :type num_seconds: float
+    :param num_snapshots: number of snapshots to save in one second
+    :type num_snapshots: float
+    :param base: parameters of Simulator shared by every combination
+    :type base: dict
+    :param workers: maximal number of simultaneous simulations, by default
+    the number of processors
+    :type workers: int
+    :param seed: seed of the random module of the first combination, the
+    combination i uses seed + i
+    :type seed: int
+    :param callback: function called with every row once it is done
+    :type callback: collections.abc.Callable
+    :param recording: other arguments of Simulator.simulate_to_file
+    :return: rows of the summary, in the order of the combinations
+    :rtype: list[dict]
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    combinations = expand_grid(grid)
+    jobs = []
+    for (index, combination) in enumerate(combinations):
+        parameters = dict(base or {})
+        parameters.update(combination)
+        file_name = "run_{index:04d}.bin".format(index=index)
+        jobs.append({'index': index, 'seed': seed + index,
+                     'file': file_name,
+                     'path': os.path.join(output_dir, file_name),
+                     'parameters': parameters,
+                     'recording': dict(recording, num_seconds=num_seconds,
+                                       num_snapshots=num_snapshots)})
+
+    results = [None] * len(jobs)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_combination, job) for job in jobs]
+        for future in as_completed(futures):
+            result = future.result()
+            results[result['index']] = result
+            if callback is not None:
+                callback(result)
+
+    with open(os.path.join(output_dir, SUMMARY_FILE), "w",
+              newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS[:3] +
+                                tuple(grid) + RESULT_FIELDS[3:])
+        writer.writeheader()
+        for (combination, result) in zip(combinations, results):
+            writer.writerow(dict(result, **combination))
+    return results
+
+
+def parse_value(name, value):
+    """Convert the value of a Simulator parameter given on the command line.
+
+    :param name: name of the parameter
+    :type name: str
+    :param value:
+    :type value: str
+    :return:
+    """
+    parameter = inspect.signature(Simulator).parameters.get(name)
+    if parameter is None:
+        raise argparse.ArgumentTypeError(
+            "unknown parameter {name}".format(name=name))
+    if parameter.annotation in (int, float, str):
+        return parameter.annotation(value)
+    return float(value)
+
+
+def parse_assignment(argument):
+    (name, separator, values) = argument.partition("=")
+    if not separator:
+        raise argparse.ArgumentTypeError(
+            "expected name=value, got {argument}".format(argument=argument))
+    return name, [parse_value(name, value) for value in values.split(",")]
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(
+        description="Run the simulation for every combination of parameters")
+    parser.add_argument("output_dir")
+    parser.add_argument("num_seconds", type=float,
+                        help="number of seconds to simulate")
+    parser.add_argument("num_snapshots", type=float,
+                        help="number of snapshots per second")
+    parser.add_argument("--set", type=parse_assignment, action="append",
+                        default=[], metavar="NAME=VALUE",
+                        help="parameter shared by every combination")
+    parser.add_argument("--param", type=parse_assignment, action="append",
+                        default=[], metavar="NAME=VALUE[,VALUE...]",
+                        help="swept parameter")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compression", default=None,
+                        help="write version 2 recordings, see "
+                             "particles.recording")
+    args = parser.parse_args(arguments)
+
+    base = {name: values[0] for (name, values) in args.set}
+    grid = dict(args.param)
+    total = len(expand_grid(grid))
+
+    done = []
+
+    def report(result):
+        done.append(result)
+        print("{done}/{total} {file} {status}".format(
+            done=len(done), total=total, file=result['file'],
+            status=result['error'] or "done"), flush=True)
+
+    results = run_sweep(grid, args.output_dir, args.num_seconds,
+                        args.num_snapshots, base=base, workers=args.workers,
+                        seed=args.seed, callback=report,
+                        compression=args.compression)
+    return 1 if any(result['error'] for result in results) else 0
+
+
+if __name__ == "__main__":
+    exit(main())
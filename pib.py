@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from sys import argv
+from sys import argv, executable
 from PySide import QtGui, QtCore
 from PySide.QtOpenGL import QGLWidget
 from particles.gui import Ui_NewExperimentWindow, Ui_DemonstrationWindow
 from particles.simulation import Simulator, Playback
+from particles.observables import histogram_density
+from particles.render import ParticleBuffers, draw_fans
+from particles.prefetch import FramePrefetcher
 from OpenGL.GL import (glShadeModel, glClearColor, glClearDepth, glEnable,
                        glMatrixMode, glDepthFunc, glHint, glOrtho,
                        glViewport, glLoadIdentity, glClear,
@@ -13,7 +16,7 @@ from OpenGL.GL import (glShadeModel, glClearColor, glClearDepth, glEnable,
                        GL_SMOOTH, GL_DEPTH_TEST, GL_PROJECTION, GL_LEQUAL,
                        GL_PERSPECTIVE_CORRECTION_HINT, GL_NICEST,
                        GL_MODELVIEW, GL_COLOR_BUFFER_BIT, GL_DEPTH_BUFFER_BIT,
-                       GL_TRIANGLE_FAN, GL_LINE_STRIP, GL_VERTEX_ARRAY,
+                       GL_LINE_STRIP, GL_VERTEX_ARRAY,
                        glEnableClientState, GL_DOUBLE, glVertexPointer,
                        glDrawArrays, glColorPointer, GL_UNSIGNED_BYTE,
                        GL_COLOR_ARRAY, glDisableClientState)
@@ -22,15 +25,16 @@ import datetime
 import os.path
 import struct
 import argparse
+import json
 import numpy as np
 import signal
 import subprocess
 import threading
 import collections
-from math import sin, cos, radians, pi
+from math import pi
 
 BASE_PATH = os.path.dirname(os.path.realpath(__file__))
-EXEC_CMD = os.path.join(BASE_PATH, "pib-generate")
+EXEC_CMD = [executable, "-m", "particles.generate"]
 
 
 def read_from_pipe(process, append_func):
@@ -57,8 +61,12 @@ def simulate(box_width: float, box_height: float,
                                hole_y, hole_height, delta_v_top,
                                delta_v_bottom, delta_v_side, g,
                                min_to_simulate, fps, output_file)]
-    process = subprocess.Popen([EXEC_CMD] + params, stdout=subprocess.PIPE,
-                               bufsize=1, universal_newlines=True)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, (BASE_PATH, env.get("PYTHONPATH"))))
+    params.append("--observables")
+    process = subprocess.Popen(EXEC_CMD + params, stdout=subprocess.PIPE,
+                               bufsize=1, universal_newlines=True, env=env)
     t = threading.Thread(target=read_from_pipe, args=(process, deque.append))
     t.daemon = True
     t.start()
@@ -66,22 +74,14 @@ def simulate(box_width: float, box_height: float,
 
 
 class ParticleWidget(QGLWidget):
-    COLOR_LEFT = (255, 0, 0)
-    COLOR_RIGHT = (0, 255, 0)
+    # draw every particle in a single call, see particles.render.draw_fans
+    single_draw_call = True
 
     def __init__(self, playback, parent=None):
         super(ParticleWidget, self).__init__(parent=parent)
         self.playback = playback
-        particle_r = playback.simulator.particle_r
-
-        self.xy_offset = np.vstack((
-            np.array([(particle_r * cos(radians(x)),
-                       particle_r * sin(radians(x)))
-                      for x in range(0, 361, 45)]),
-            (0, 0)
-        ))
-
-        self.xy_size = self.xy_offset.shape[0]
+        self.buffers = ParticleBuffers(playback.simulator.particle_r)
+        self.color_changed = True
 
         self.update_particle_data()
 
@@ -98,8 +98,8 @@ class ParticleWidget(QGLWidget):
         glMatrixMode(GL_PROJECTION)
         glDepthFunc(GL_LEQUAL)
         glHint(GL_PERSPECTIVE_CORRECTION_HINT, GL_NICEST)
-        self.vbo_xy = glvbo.VBO(self.particle_xy)
-        self.vbo_color = glvbo.VBO(self.particle_color)
+        self.vbo_xy = glvbo.VBO(self.buffers.xy)
+        self.vbo_color = glvbo.VBO(self.buffers.color)
         simulator = self.playback.simulator
         self.vbo_barrier = glvbo.VBO(np.array([
             simulator.barrier_x_left, simulator.box_height,
@@ -113,18 +113,21 @@ class ParticleWidget(QGLWidget):
         ]))
 
     def update_particle_data(self):
-        self.particle_xy = np.array([(p.pos_x + x, p.pos_y + y)
-                                     for p in
-                                     self.playback.simulator.particles
-                                     for (x, y) in self.xy_offset])
-        self.particle_color = np.array([x
-                                        for p in
-                                        self.playback.simulator.particles
-                                        for i in range(self.xy_size)
-                                        for x in
-                                        (self.COLOR_RIGHT if p.id & 1
-                                         else self.COLOR_LEFT)
-                                        ], dtype=np.ubyte)
+        store = self.playback.simulator.store
+        if self.buffers.update(store.pos_x, store.pos_y, store.id):
+            self.color_changed = True
+
+    def show_frame(self, frame):
+        """
+        Display a frame decoded by particles.prefetch.FramePrefetcher
+
+        :param frame:
+        :type frame: particles.prefetch.Frame
+        :return:
+        """
+        if self.buffers.set_vertices(frame.xy, frame.ids):
+            self.color_changed = True
+        self.updateGL()
 
     def resizeGL(self, width, height):
         glViewport(0, 0, width, height)
@@ -152,28 +155,25 @@ class ParticleWidget(QGLWidget):
         self.clearGL()
         glLoadIdentity()
 
-        simulator = self.playback.simulator
-
-        self.update_particle_data()
-
         glEnableClientState(GL_COLOR_ARRAY)
 
-        self.vbo_color.set_array(self.particle_color)
+        if self.color_changed:
+            # the colours only depend on the order of the particles
+            self.vbo_color.set_array(self.buffers.color)
+            self.color_changed = False
         self.vbo_color.bind()
         glColorPointer(3, GL_UNSIGNED_BYTE, 0, self.vbo_color)
         self.vbo_color.unbind()
 
         glEnableClientState(GL_VERTEX_ARRAY)
 
-        self.vbo_xy.set_array(self.particle_xy)
+        self.vbo_xy.set_array(self.buffers.xy)
         self.vbo_xy.bind()
 
         glVertexPointer(2, GL_DOUBLE, 0, self.vbo_xy)
 
-        particle_size = self.xy_size
-
-        for i in range(len(simulator)):
-            glDrawArrays(GL_TRIANGLE_FAN, i * particle_size, particle_size)
+        draw_fans(self.buffers.first, self.buffers.counts,
+                  self.single_draw_call)
 
         glDisableClientState(GL_COLOR_ARRAY)
         self.vbo_xy.unbind()
@@ -192,10 +192,18 @@ class ParticleWidget(QGLWidget):
 
 
 class DemonstrationWindow(QtGui.QMainWindow):
-    def __init__(self, file_name, parent=None):
+    # seconds to wait for a frame that is not decoded yet while paused
+    SCRUB_TIMEOUT = 0.25
+    # milliseconds between refreshes of a recording being written
+    FOLLOW_INTERVAL = 500
+
+    def __init__(self, file_name, parent=None, follow=False):
         super(DemonstrationWindow, self).__init__(parent=parent)
 
-        self.playback = Playback(file_name)
+        self.playback = Playback(file_name, memory_map=True)
+        # frames are decoded in the background from a playback of its own
+        self.prefetcher = FramePrefetcher(Playback(file_name,
+                                                   memory_map=True))
 
         self.ui = Ui_DemonstrationWindow()
 
@@ -236,9 +244,25 @@ class DemonstrationWindow(QtGui.QMainWindow):
         self.ui.plot_boltzmann.setLabel('left', 'Number of particles',
                                         units='')
 
+        # a recording being written is refreshed until stop_following
+        self.follow_timer = QtCore.QTimer(parent=self)
+        self.follow_timer.timeout.connect(self.follow_recording)
+        if follow:
+            self.follow_timer.start(self.FOLLOW_INTERVAL)
+
         self.start_playback()
 
+    def follow_recording(self):
+        self.prefetcher.refresh()
+        self.ui.current_state.setMaximum(self.playback.refresh())
+
+    def stop_following(self):
+        self.follow_timer.stop()
+        self.follow_recording()
+
     def closeEvent(self, *args, **kwargs):
+        self.follow_timer.stop()
+        self.prefetcher.close()
         self.ui.canvas.deleteBuffers()
 
     def stop_playback(self):
@@ -256,17 +280,17 @@ class DemonstrationWindow(QtGui.QMainWindow):
         self.launch_timer()
         self.ui.button_play.setText("▯▯")
 
-    def update_boltzmann_plot(self, data):
+    def update_boltzmann_plot(self, observables):
         self.ui.plot_boltzmann.clear()
-        data_sorted = sorted((x.pos_y for x in data), reverse=True)
-        y, x = np.histogram(data_sorted, bins=20, density=True)
+        x = observables['height_edges']
+        y = histogram_density(observables['height_counts'], x)
         self.ui.plot_boltzmann.plot(x, y, stepMode=True, fillLevel=0,
                                     brush=(126, 5, 80, 150))
 
-    def update_maxwell_plot(self, data):
+    def update_maxwell_plot(self, observables):
         self.ui.plot_maxwell.clear()
-        data_sorted = sorted((x.speed() for x in data), reverse=True)
-        y, x = np.histogram(data_sorted, bins=20, density=True)
+        x = observables['speed_edges']
+        y = histogram_density(observables['speed_counts'], x)
         self.ui.plot_maxwell.plot(x, y, stepMode=True, fillLevel=0,
                                   brush=(126, 5, 80, 150))
 
@@ -283,20 +307,20 @@ class DemonstrationWindow(QtGui.QMainWindow):
                                   stepMode=False,
                                   brush=(255, 255, 255, 255))
 
-    def update_plot(self, data):
+    def update_plot(self, observables):
         """
         Update plots
 
         This method is used to call other methods that are handling
         plotting of specific data, i.e. Maxwell or Botlzmann distribution
-        Data passed to this method is a copy of original particle, so any
-        manipulation is safe
+        The histograms are read from the observables of the current state,
+        see Playback.observables
 
-        :param data:
+        :param observables: record of particles.observables.OBSERVABLES_DTYPE
         :return:
         """
-        self.update_maxwell_plot(data)
-        self.update_boltzmann_plot(data)
+        self.update_maxwell_plot(observables)
+        self.update_boltzmann_plot(observables)
 
     def previous_state(self):
         try:
@@ -332,17 +356,21 @@ class DemonstrationWindow(QtGui.QMainWindow):
             self.launch_timer()
 
     def on_scrollbar_value_changed(self, new_state):
-        try:
-            self.playback.set_state(new_state)
-            self.ui.canvas.on_render_scene()
-            self.ui.label_time.setText(
-                self.label_time_original.format(
-                    time=self.playback.simulator.time_elapsed
-                )
-            )
-            self.update_plot(self.playback.simulator.state())
-        except (IOError, ValueError):
-            pass
+        if not 0 <= new_state < len(self.playback):
+            return
+        self.prefetcher.seek(new_state)
+        # while playing, a frame that is not ready is dropped, so the timer
+        # keeps its pace
+        frame = self.prefetcher.get(
+            new_state, self.SCRUB_TIMEOUT if self.stopped else 0.0)
+        if frame is None:
+            self.statusBar().showMessage("{dropped} dropped frames".format(
+                dropped=self.prefetcher.dropped))
+            return
+        self.ui.canvas.show_frame(frame)
+        self.ui.label_time.setText(
+            self.label_time_original.format(time=frame.time))
+        self.update_plot(frame.observables)
 
 
 class NewExperimentWindow(QtGui.QMainWindow):
@@ -363,6 +391,9 @@ class NewExperimentWindow(QtGui.QMainWindow):
         self.ui.output_file.setText(datetime.datetime.now().strftime(
             "particles_in_box_%Y-%m-%d-%H-%M.bin"))
 
+        # live view of the recording being generated
+        self.demo_window = None
+
         # Connect slots to signals
         self.ui.button_run.clicked.connect(self.run_simulation)
 
@@ -468,6 +499,7 @@ class NewExperimentWindow(QtGui.QMainWindow):
             self.dialog.show()
             self.dialog.setValue(0)
             self.progress = collections.deque(maxlen=1)
+            self.demo_window = None
 
             self.simulator = simulate(n_left=n_left,
                                       n_right=n_right,
@@ -497,16 +529,31 @@ class NewExperimentWindow(QtGui.QMainWindow):
         except IOError as e:
             QtGui.QMessageBox.critical(self, "Error!", str(e))
 
+    def open_demo_window(self, follow):
+        try:
+            self.demo_window = DemonstrationWindow(
+                self.ui.output_file.text(), parent=self, follow=follow)
+        except (IOError, struct.error, ValueError):
+            # nothing is flushed yet, try again with the next progress line
+            return
+        self.demo_window.show()
+
     def update_progress(self):
+        if self.dialog.wasCanceled() and self.simulator.poll() is None:
+            # the generator flushes the recording and exits
+            self.simulator.send_signal(signal.SIGINT)
         try:
-            result = self.progress.pop()
-            self.dialog.setValue(int(result))
+            result = json.loads(self.progress.pop())
+            self.dialog.setValue(int(result['time']))
+            if self.demo_window is None:
+                self.open_demo_window(follow=True)
         except IndexError:  # if empty or finished
             if self.simulator.poll() is not None:
                 self.timer.stop()
-                window = DemonstrationWindow(self.ui.output_file.text(),
-                                             parent=self)
-                window.show()
+                if self.demo_window is None:
+                    self.open_demo_window(follow=False)
+                else:
+                    self.demo_window.stop_following()
                 # otherwise, do nothing
 
 
@@ -521,7 +568,10 @@ if __name__ == "__main__":
     parser.add_argument("input", nargs="?",
                         type=argparse.FileType(mode="rb"),
                         default=None)
+    parser.add_argument("--fan-loop", action="store_true",
+                        help="draw the particles one by one")
     args = parser.parse_args()
+    ParticleWidget.single_draw_call = not args.fan_loop
 
     app = QtGui.QApplication(argv)
 
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+from benchmarks import suite
+import unittest
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_run_and_compare(self):
+        results = [suite.run_case(case, 200, 'sparse', 'numpy', 'grid',
+                                  min_time=0.01)
+                   for case in ('next_state', 'distribute_particles')]
+        self.assertGreater(results[0]['metrics']['steps_per_second'], 0)
+        self.assertGreater(results[0]['peak_rss_mib'], 0)
+
+        slower = [dict(result, metrics={
+            name: value / 2 for (name, value) in result['metrics'].items()})
+            for result in results]
+        (rows, regressions) = suite.compare(results, slower)
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(regressions, [])
+        (rows, regressions) = suite.compare(slower, results)
+        self.assertEqual(len(regressions), 4)
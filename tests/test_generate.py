@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+from particles.simulation import Playback
+from particles import generate
+from particles.recording import open_recording
+import contextlib
+import io
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import unittest
+
+
+class TestGenerate(unittest.TestCase):
+    ARGUMENTS = ["20", "20", "0.2", "3", "0.21", "10", "10", "4", "1", "3",
+                 "2", "0.5", "0.3", "0.3", "9.8"]
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.directory.name, "generated.bin")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_progress(self):
+        output = io.StringIO()
+        status = generate.main(self.ARGUMENTS + ["0.005", "20", self.file_path,
+                                                 "--engine", "numpy"],
+                               output=output)
+        self.assertEqual(status, 0)
+        lines = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(lines[-1]['status'], 'done')
+        self.assertEqual(lines[-1]['progress'], 100)
+        self.assertGreater(lines[-1]['steps'], 0)
+        self.assertEqual(len(Playback(self.file_path)),
+                         lines[-1]['snapshots'] + 1)
+
+    def test_recording_options(self):
+        output = io.StringIO()
+        status = generate.main(self.ARGUMENTS + [
+            "0.005", "20", self.file_path, "--compression", "lzma",
+            "--quantise", "--delta"], output=output)
+        self.assertEqual(status, 0)
+        with open(self.file_path, "rb") as f:
+            reader = open_recording(f)
+            self.assertEqual((reader.compression, reader.quantise,
+                              reader.delta), ('lzma', True, True))
+
+        with self.assertRaises(SystemExit), \
+                contextlib.redirect_stderr(io.StringIO()):
+            generate.main(self.ARGUMENTS + ["0.005", "20", self.file_path,
+                                            "--compression", "zip"],
+                          output=output)
+
+    def test_interrupt(self):
+        process = subprocess.Popen(
+            [sys.executable, "-m", "particles.generate"] + self.ARGUMENTS +
+            ["10", "20", self.file_path, "--report-interval", "0"],
+            stdout=subprocess.PIPE, universal_newlines=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.assertEqual(json.loads(process.stdout.readline())['status'],
+                         'running')
+        process.send_signal(signal.SIGINT)
+        lines = process.stdout.read().splitlines()
+        process.stdout.close()
+        self.assertEqual(process.wait(), generate.EXIT_INTERRUPTED)
+        last = json.loads(lines[-1])
+        self.assertEqual(last['status'], 'interrupted')
+        self.assertEqual(len(Playback(self.file_path)),
+                         last['snapshots'] + 1)
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import unittest
-from particles.core import Particle
+from particles.core import Particle, ParticleStore
 from math import sqrt
 
 
@@ -114,3 +114,42 @@ class TestParticleBehavior(unittest.TestCase):
         particle_b = self.copy_particle(offset_x=-offset, offset_y=-offset,
                                         v_ratio_x=1.5, v_ratio_y=1.5)
         self.assertTrue(self.particle.is_approaching(particle_b))
+
+
+class TestParticleStore(unittest.TestCase):
+    def setUp(self):
+        self.particles = [Particle(id=i, pos_x=i * 1.5, pos_y=10.0 - i,
+                                   velocity_x=-i * 0.5, velocity_y=i * 0.25)
+                          for i in range(5)]
+        self.store = ParticleStore.from_particles(self.particles)
+
+    def test_store_keeps_particles(self):
+        self.assertEqual(len(self.store), len(self.particles))
+        self.assertEqual(list(self.store), self.particles)
+
+    def test_view_writes_to_store(self):
+        view = self.store[2]
+        view.pos_x = 42.0
+        view.velocity_y += 1.0
+        self.assertEqual(self.store.pos_x[2], 42.0)
+        self.assertEqual(self.store.velocity_y[2], 1.5)
+
+    def test_view_returns_python_types(self):
+        view = self.store[1]
+        self.assertIs(type(view.pos_x), float)
+        self.assertIs(type(view.id), int)
+
+    def test_sort_by_y(self):
+        self.store.sort_by_y()
+        self.assertEqual(list(self.store.id), [4, 3, 2, 1, 0])
+        self.assertEqual(list(self.store),
+                         sorted(self.particles, key=lambda x: x.pos_y))
+
+    def test_copy_is_independent(self):
+        store_copy = self.store.copy()
+        store_copy[0].pos_x = 100.0
+        self.assertEqual(self.store[0].pos_x, 0.0)
+
+    def test_speed(self):
+        for (speed, particle) in zip(self.store.speed(), self.particles):
+            self.assertEqual(speed, particle.speed())
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+from particles.core import Particle, ParticleStore
+from particles.render import (ParticleBuffers, COLOR_LEFT, COLOR_RIGHT,
+                              circle_offsets, fan_arguments)
+from math import cos, radians, sin
+import numpy as np
+import os
+import subprocess
+import sys
+import unittest
+
+
+# Draws two particles with both paths of particles.render.draw_fans into an
+# offscreen software (OSMesa) context and compares the images. Exits with
+# SKIP_STATUS if the context can not be created.
+OFFSCREEN_SCRIPT = '''
+import sys
+import numpy as np
+try:
+    from OpenGL import GL, arrays, osmesa
+    context = osmesa.OSMesaCreateContextExt(osmesa.OSMESA_RGBA, 24, 0, 0,
+                                            None)
+except Exception:
+    sys.exit({skip})
+if not context:
+    sys.exit({skip})
+from particles import render
+size = 64
+image = arrays.GLubyteArray.zeros((size, size, 4))
+osmesa.OSMesaMakeCurrent(context, image, GL.GL_UNSIGNED_BYTE, size, size)
+buffers = render.ParticleBuffers(0.5)
+buffers.update(np.array([1.0, 3.0]), np.array([2.0, 2.0]),
+               np.array([0, 1], dtype=np.int16))
+GL.glMatrixMode(GL.GL_PROJECTION)
+GL.glLoadIdentity()
+GL.glOrtho(0.0, 4.0, 0.0, 4.0, -1.0, 1.0)
+GL.glMatrixMode(GL.GL_MODELVIEW)
+GL.glLoadIdentity()
+GL.glEnableClientState(GL.GL_VERTEX_ARRAY)
+GL.glEnableClientState(GL.GL_COLOR_ARRAY)
+GL.glVertexPointer(2, GL.GL_DOUBLE, 0, buffers.xy)
+GL.glColorPointer(3, GL.GL_UNSIGNED_BYTE, 0, buffers.color)
+images = []
+for single_call in (True, False):
+    GL.glClear(GL.GL_COLOR_BUFFER_BIT)
+    render.draw_fans(buffers.first, buffers.counts, single_call)
+    GL.glFinish()
+    pixels = GL.glReadPixels(0, 0, size, size, GL.GL_RGBA,
+                             GL.GL_UNSIGNED_BYTE)
+    if not isinstance(pixels, bytes):
+        pixels = np.ascontiguousarray(pixels, dtype=np.ubyte).tobytes()
+    images.append(np.frombuffer(pixels, dtype=np.ubyte).reshape(size, size,
+                                                                4))
+(single, loop) = images
+red = (single[..., 0] == 255) & (single[..., 1] == 0)
+green = (single[..., 1] == 255) & (single[..., 0] == 0)
+sys.exit(0 if (single == loop).all() and red.any() and green.any() else 1)
+'''
+
+
+class TestRender(unittest.TestCase):
+    SKIP_STATUS = 77
+
+    def test_fan_arguments(self):
+        (first, counts) = fan_arguments(3, 10)
+        self.assertEqual(first.tolist(), [0, 10, 20])
+        self.assertEqual(counts.tolist(), [10, 10, 10])
+        buffers = ParticleBuffers(0.1)
+        buffers.update(np.zeros(4), np.zeros(4), np.zeros(4, dtype=np.int16))
+        self.assertEqual(buffers.first.tolist(), [0, 10, 20, 30])
+        self.assertEqual(buffers.xy.shape[0],
+                         buffers.first[-1] + buffers.counts[-1])
+
+    def test_offscreen_draw(self):
+        env = dict(os.environ, PYOPENGL_PLATFORM="osmesa")
+        process = subprocess.run(
+            [sys.executable, "-c",
+             OFFSCREEN_SCRIPT.format(skip=self.SKIP_STATUS)],
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        if process.returncode == self.SKIP_STATUS:
+            self.skipTest("no offscreen OpenGL context")
+        self.assertEqual(process.returncode, 0, process.stderr.decode())
+
+    def test_buffers(self):
+        particle_r = 0.3
+        particles = [Particle(0, 1.0, 2.0), Particle(1, 3.0, 4.0),
+                     Particle(-3, 5.0, 6.0)]
+        offsets = np.vstack((
+            np.array([(particle_r * cos(radians(x)),
+                       particle_r * sin(radians(x)))
+                      for x in range(0, 361, 45)]),
+            (0, 0)))
+        np.testing.assert_allclose(circle_offsets(particle_r), offsets,
+                                   atol=1e-15)
+
+        buffers = ParticleBuffers(particle_r)
+        store = ParticleStore.from_particles(particles)
+        self.assertTrue(buffers.update(store.pos_x, store.pos_y, store.id))
+        expected_xy = np.array([(p.pos_x + x, p.pos_y + y)
+                                for p in particles for (x, y) in offsets])
+        np.testing.assert_allclose(buffers.xy, expected_xy)
+        expected_color = np.array([x for p in particles
+                                   for i in range(len(offsets))
+                                   for x in (COLOR_RIGHT if p.id & 1
+                                             else COLOR_LEFT)],
+                                  dtype=np.ubyte).reshape(-1, 3)
+        np.testing.assert_array_equal(buffers.color, expected_color)
+
+        store.pos_x += 1.0
+        self.assertFalse(buffers.update(store.pos_x, store.pos_y, store.id))
+        np.testing.assert_allclose(buffers.xy[:, 0], expected_xy[:, 0] + 1.0)
+        store.reorder(np.array([2, 0, 1]))
+        self.assertTrue(buffers.update(store.pos_x, store.pos_y, store.id))
+        np.testing.assert_array_equal(
+            buffers.color, np.roll(expected_color, len(offsets), axis=0))
@@ -2,28 +2,62 @@
 
 from particles.core import Particle
 from particles.simulation import Simulator, Playback
+from particles.broadphase import grid_pairs, sweep_pairs
+from particles.events import EventSimulator
+from particles.engines import ENGINES
+from particles.placement import place_points
+from particles.recording import (ChunkedWriter, open_recording, upgrade,
+                                 read_stats, load_checkpoint, save_checkpoint,
+                                 decompress, keyframe_dtype, FLOAT_COLUMNS,
+                                 DELTA_WIDTHS_FORMAT)
+from particles.stats import ProfilingEngine
+from particles.prefetch import FramePrefetcher
+from particles.render import ParticleBuffers
+from particles.observables import (measure, histogram_density,
+                                   observables_path)
+import gc
+import numpy as np
+import os
+import struct
+import random
+import tempfile
 import unittest
 
+# Box of most tests, see make_simulator
+BOX = {'box_width': 10.0, 'box_height': 10.0, 'delta_v_top': 0.5,
+       'delta_v_bottom': 0.3, 'delta_v_side': 0.3, 'barrier_x': 4.0,
+       'barrier_width': 1.0, 'hole_y': 3.0, 'hole_height': 2.0,
+       'v_loss': 0.21}
+
+# Fast particles crowding BOX, so that every step has collisions
+CROWDED = {'particle_r': 0.5, 'n_left': 30, 'n_right': 30, 'v_init': 40.0}
+
+# Elastic walls and collisions, so that energy is conserved
+ELASTIC = {'delta_v_top': 0.0, 'delta_v_bottom': 0.0, 'delta_v_side': 0.0,
+           'v_loss': 0.0}
+
+
+def make_simulator(simulator_class=Simulator, **arguments):
+    """Create a simulator of BOX, the provided arguments replacing the ones
+    of BOX."""
+    return simulator_class(**dict(BOX, **arguments))
+
 
 class TestNewSimulation(unittest.TestCase):
     def setUp(self):
         self.v_init = 3.0
         self.n_left = 100
         self.n_right = 150
-        self.simulator = Simulator(box_width=100.0,
-                                   box_height=100.0,
-                                   delta_v_top=0.5,
-                                   delta_v_bottom=0.3,
-                                   delta_v_side=0.3,
-                                   barrier_x=40.0,
-                                   barrier_width=3.0,
-                                   hole_y=30.0,
-                                   hole_height=10.0,
-                                   v_loss=0.21,
-                                   particle_r=0.2,
-                                   n_left=self.n_left,
-                                   n_right=self.n_right,
-                                   v_init=self.v_init)
+        self.simulator = make_simulator(box_width=100.0,
+                                        box_height=100.0,
+                                        barrier_x=40.0,
+                                        barrier_width=3.0,
+                                        hole_y=30.0,
+                                        hole_height=10.0,
+                                        particle_r=0.2,
+                                        n_left=self.n_left,
+                                        n_right=self.n_right,
+                                        v_init=self.v_init)
 
     def tearDown(self):
         pass
@@ -53,8 +87,938 @@ class TestNewSimulation(unittest.TestCase):
                 self.assertFalse(
                     particle_a.overlaps(particle_b, self.simulator.particle_r))
 
+    def test_too_many_particles(self):
+        simulator = self.simulator
+        with self.assertRaises(ValueError):
+            simulator.distribute_particles(simulator.MAX_PARTICLES, 1)
+        store = simulator.distribute_particles(0, 1)
+        self.assertEqual(store.id.tolist(), [1])
+
     def test_time_step(self):
         time_step = self.simulator.calculate_time_step()
         particle_r = self.simulator.particle_r
         for particle in self.simulator.particles:
             self.assertLessEqual(particle.speed() * time_step, particle_r)
+
+
+class TestPlacement(unittest.TestCase):
+    def assertApart(self, pos_x, pos_y, min_distance):
+        distance = np.hypot(pos_x[:, None] - pos_x, pos_y[:, None] - pos_y)
+        np.fill_diagonal(distance, np.inf)
+        self.assertGreaterEqual(distance.min(), min_distance)
+
+    def test_sparse(self):
+        rng = np.random.default_rng(0)
+        (pos_x, pos_y) = place_points(rng, 500, 1.0, 9.0, 2.0, 5.0, 0.05)
+        self.assertEqual(pos_x.shape, (500,))
+        self.assertTrue(((1.0 <= pos_x) & (pos_x <= 9.0)).all())
+        self.assertTrue(((2.0 <= pos_y) & (pos_y <= 5.0)).all())
+        self.assertApart(pos_x, pos_y, 0.05)
+
+    def test_dense(self):
+        rng = np.random.default_rng(0)
+        # denser than random sequential placement can reach
+        (pos_x, pos_y) = place_points(rng, 400, 0.0, 10.0, 0.0, 10.0, 0.5)
+        self.assertEqual(pos_x.shape, (400,))
+        self.assertTrue(((0.0 <= pos_x) & (pos_x <= 10.0)).all())
+        self.assertApart(pos_x, pos_y, 0.5)
+
+        with self.assertRaises(ValueError):
+            place_points(rng, 500, 0.0, 10.0, 0.0, 10.0, 0.5)
+
+    def test_reproducible(self):
+        random.seed(3)
+        first = make_simulator(particle_r=0.2, n_left=20, n_right=30)
+        random.seed(3)
+        second = make_simulator(particle_r=0.2, n_left=20, n_right=30)
+        self.assertEqual(first.particles, second.particles)
+
+
+class TestEngines(unittest.TestCase):
+    """Check every engine against the reference python engine."""
+
+    steps = 40
+
+    def assert_engine_matches_reference(self, engine, broad_phase, seed,
+                                        max_block_level=0):
+        random.seed(seed)
+        reference = make_simulator(engine='python', broad_phase=broad_phase,
+                                   max_block_level=max_block_level,
+                                   **CROWDED)
+        simulator = make_simulator(engine=engine, broad_phase=broad_phase,
+                                   particles=reference.store.copy(),
+                                   max_block_level=max_block_level,
+                                   **CROWDED)
+        for _ in range(self.steps):
+            self.assertEqual(reference.next_state(), simulator.next_state())
+        np.testing.assert_array_equal(reference.store.id,
+                                      simulator.store.id)
+        np.testing.assert_array_equal(reference.store.data,
+                                      simulator.store.data)
+
+    def test_engines(self):
+        for engine in ENGINES:
+            for broad_phase in ('all', 'grid'):
+                for seed in range(3):
+                    with self.subTest(engine=engine, broad_phase=broad_phase,
+                                      seed=seed):
+                        self.assert_engine_matches_reference(
+                            engine, broad_phase, seed)
+
+    def test_block_time_steps(self):
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                self.assert_engine_matches_reference(engine, 'grid', 0,
+                                                     max_block_level=3)
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            make_simulator(engine='unknown', **CROWDED)
+
+
+class TestStats(unittest.TestCase):
+    steps = 40
+
+    def test_profiling_does_not_change_results(self):
+        for engine in ENGINES:
+            for broad_phase in ('all', 'grid'):
+                with self.subTest(engine=engine, broad_phase=broad_phase):
+                    random.seed(1)
+                    reference = make_simulator(engine=engine,
+                                               broad_phase=broad_phase,
+                                               **CROWDED)
+                    simulator = make_simulator(
+                        engine=engine, broad_phase=broad_phase,
+                        particles=reference.store.copy(), profile=True,
+                        **CROWDED)
+                    for _ in range(self.steps):
+                        self.assertEqual(reference.next_state(),
+                                         simulator.next_state())
+                    np.testing.assert_array_equal(reference.store.data,
+                                                  simulator.store.data)
+                    totals = simulator.stats.totals
+                    self.assertEqual(totals['steps'], self.steps)
+                    self.assertEqual(totals['base_steps'], self.steps)
+                    self.assertGreater(totals['collisions'], 0)
+                    self.assertGreater(totals['wall_hits'], 0)
+                    self.assertLessEqual(totals['collisions'],
+                                         totals['overlaps'])
+                    self.assertLessEqual(totals['overlaps'],
+                                         totals['candidates'])
+
+    def test_counts(self):
+        random.seed(2)
+        simulator = make_simulator(broad_phase='grid', profile=True,
+                                   **CROWDED)
+        reference = make_simulator(broad_phase='grid',
+                                   particles=simulator.store.copy(),
+                                   **CROWDED)
+        collisions = 0
+        passages = 0
+        for _ in range(self.steps):
+            store = reference.store
+            sides = dict(zip(store.id.tolist(),
+                             (store.pos_x < reference.barrier_x).tolist()))
+            time_step = reference.calculate_time_step()
+            reference.engine.move(time_step)
+            reference.engine.sort()
+            collisions += reference.engine.collide_particles()
+            reference.engine.collide_walls()
+            passages += sum(
+                sides[id_] != side for (id_, side) in
+                zip(store.id.tolist(),
+                    (store.pos_x < reference.barrier_x).tolist()))
+            simulator.next_state()
+            last = simulator.stats.last
+            self.assertEqual(last['steps'], 1)
+            self.assertGreaterEqual(last['move_seconds'], 0)
+        totals = simulator.stats.totals
+        self.assertEqual(totals['collisions'], collisions)
+        self.assertEqual(totals['hole_passages'], passages)
+
+    def test_block_time_steps(self):
+        random.seed(3)
+        simulator = make_simulator(broad_phase='grid', profile=True,
+                                   max_block_level=3, **CROWDED)
+        for _ in range(10):
+            simulator.next_state()
+        self.assertEqual(simulator.stats.totals['steps'], 10)
+        self.assertGreaterEqual(simulator.stats.totals['base_steps'], 10)
+
+    def test_set_profiling(self):
+        simulator = make_simulator(broad_phase='grid', **CROWDED)
+        engine = simulator.engine
+        self.assertIsNone(simulator.stats)
+        simulator.set_profiling(True)
+        self.assertIsInstance(simulator.engine, ProfilingEngine)
+        simulator.next_state()
+        self.assertEqual(simulator.stats.totals['steps'], 1)
+        simulator.set_profiling(False)
+        self.assertIs(simulator.engine, engine)
+        self.assertIsNone(simulator.stats)
+
+
+class TestBroadPhase(unittest.TestCase):
+    def setUp(self):
+        random.seed(7)
+        # Particles are placed without overlap checks, so that there are
+        # plenty of collisions to resolve
+        particles = [Particle(i, random.uniform(0.0, 10.0),
+                              random.uniform(0.0, 10.0),
+                              random.uniform(-5.0, 5.0),
+                              random.uniform(-5.0, 5.0))
+                     for i in range(300)]
+        self.simulator = make_simulator(particle_r=0.5,
+                                        particles=particles,
+                                        engine='numpy')
+        self.simulator.store.sort_by_y()
+
+    def test_grid_finds_close_pairs(self):
+        store = self.simulator.store
+        cell_size = 1.0
+        first, second = grid_pairs(store.pos_x, store.pos_y, cell_size)
+        pairs = list(zip(first.tolist(), second.tolist()))
+        self.assertEqual(pairs, sorted(set(pairs)))
+        for (i, particle) in enumerate(store):
+            for j in range(i + 1, len(store)):
+                if particle.distance_to(store[j]) < cell_size:
+                    self.assertIn((i, j), pairs)
+
+    def test_grid_active_pairs(self):
+        store = self.simulator.store
+        active = np.zeros(len(store), dtype=bool)
+        active[::7] = True
+        first, second = grid_pairs(store.pos_x, store.pos_y, 1.0)
+        involved = active[first] | active[second]
+        active_first, active_second = grid_pairs(store.pos_x, store.pos_y,
+                                                 1.0, active)
+        np.testing.assert_array_equal(active_first, first[involved])
+        np.testing.assert_array_equal(active_second, second[involved])
+
+    def test_sweep_finds_close_pairs(self):
+        pos_y = self.simulator.store.pos_y
+        reach = 1.0
+        first, second = sweep_pairs(pos_y, reach)
+        expected = [(i, j) for i in range(len(pos_y))
+                    for j in range(i + 1, len(pos_y))
+                    if pos_y[j] - pos_y[i] <= reach]
+        self.assertEqual(list(zip(first.tolist(), second.tolist())),
+                         expected)
+
+    def test_narrow_phase_matches_reference(self):
+        reference = self.simulator.store.copy()
+        self.simulator.engine.collide_all_particles()
+        expected = self.simulator.store.data.copy()
+        self.simulator.particles = reference
+        self.simulator.engine.collide_pairs(
+            *np.triu_indices(len(self.simulator), 1))
+        self.assertFalse(np.array_equal(reference.data, expected))
+        np.testing.assert_array_equal(self.simulator.store.data, expected)
+
+
+class TestBlockTimeSteps(unittest.TestCase):
+    arguments = {'box_width': 20.0, 'box_height': 20.0, 'barrier_x': 8.0,
+                 'particle_r': 0.3, 'engine': 'numpy'}
+
+    def setUp(self):
+        random.seed(11)
+        self.simulator = make_simulator(n_left=100,
+                                        n_right=100,
+                                        v_init=0.5,
+                                        broad_phase='grid',
+                                        max_block_level=4,
+                                        **self.arguments)
+        # A few fast particles, like the ones kicked by the heated floor
+        self.simulator.store.velocity_y[:5] = 30.0
+
+    def test_block_levels(self):
+        simulator = self.simulator
+        time_step = simulator.calculate_time_step()
+        levels = simulator.calculate_block_levels(time_step)
+        self.assertEqual(levels[:5].tolist(), [0] * 5)
+        self.assertEqual(levels.max(), simulator.max_block_level)
+        block_time = time_step * np.left_shift(1, levels)
+        distance = (simulator.store.speed() +
+                    simulator.g * block_time) * block_time
+        self.assertTrue(np.all(distance[levels > 0] <=
+                               simulator.particle_r / 8))
+
+    def test_block_step(self):
+        simulator = self.simulator
+        for _ in range(5):
+            time_step = simulator.calculate_time_step()
+            self.assertAlmostEqual(simulator.next_state(), time_step * 16)
+            store = simulator.store
+            self.assertTrue(np.all(store.pos_x > 0))
+            self.assertTrue(np.all(store.pos_x < simulator.box_width))
+            self.assertTrue(np.all(store.pos_y > 0))
+
+    def test_slow_particle_moves_on_its_level(self):
+        # A fast particle sets the base time step, the slow one far away
+        # gets the highest level
+        simulator = make_simulator(
+            particles=[Particle(0, 4.0, 10.0, 30.0, 0.0),
+                       Particle(1, 15.0, 10.0, 0.01, 0.0)],
+            max_block_level=3, **self.arguments)
+        time_step = simulator.calculate_time_step()
+        levels = simulator.calculate_block_levels(time_step)
+        self.assertEqual(levels.tolist(), [0, 3])
+
+        engine = simulator.engine
+        positions = []
+
+        class RecordingEngine:
+            simulator = engine.simulator
+
+            def __getattr__(self, name):
+                return getattr(engine, name)
+
+            def sort(self):
+                order = engine.sort()
+                store = self.simulator.store
+                positions.append(store.data[:2, store.id == 1][:, 0].copy())
+                return order
+
+        simulator.engine = RecordingEngine()
+        self.assertEqual(simulator.next_state(), time_step * 8)
+        self.assertEqual(len(positions), 8)
+        for position in positions[:7]:
+            np.testing.assert_array_equal(position, (15.0, 10.0))
+        block_time = time_step * 8
+        np.testing.assert_allclose(
+            positions[7], (15.0 + 0.01 * block_time,
+                           10.0 - simulator.g * block_time ** 2 / 2))
+        store = simulator.store
+        np.testing.assert_array_equal(store.data[:2, store.id == 1][:, 0],
+                                      positions[7])
+
+
+class TestParallelCollisions(unittest.TestCase):
+    def make_pairs(self, workers):
+        # Isolated pairs of overlapping particles approaching each other,
+        # so the result does not depend on the order pairs are resolved in.
+        # The barrier splits a column of pairs between two strips
+        particles = []
+        for x in range(10):
+            for y in range(10):
+                particles.append(Particle(len(particles), 2.0 * x + 0.5,
+                                          2.0 * y + 0.5, 1.0, 0.5))
+                particles.append(Particle(len(particles), 2.0 * x + 0.6,
+                                          2.0 * y + 0.55, -1.0, -0.5))
+        simulator = make_simulator(box_width=20.0,
+                                   box_height=20.0,
+                                   barrier_x=10.55,
+                                   barrier_width=0.2,
+                                   particle_r=0.5,
+                                   particles=particles,
+                                   engine='numpy',
+                                   broad_phase='grid',
+                                   workers=workers)
+        simulator.store.sort_by_y()
+        return simulator
+
+    def test_matches_serial(self):
+        serial = self.make_pairs(1)
+        parallel = self.make_pairs(3)
+        try:
+            serial.engine.collide_particles()
+            parallel.engine.collide_particles()
+            np.testing.assert_allclose(np.abs(serial.store.velocity_x),
+                                       1 - serial.v_loss)
+            np.testing.assert_array_equal(parallel.store.data,
+                                          serial.store.data)
+            for _ in range(3):
+                serial.next_state()
+                parallel.next_state()
+            np.testing.assert_allclose(parallel.store.data,
+                                       serial.store.data)
+        finally:
+            parallel.close()
+
+    def test_workers_stopped(self):
+        with self.make_pairs(2) as simulator:
+            simulator.next_state()
+            executor = simulator.pool.executor
+            self.assertIsNotNone(executor)
+        self.assertIsNone(simulator.pool.executor)
+        with self.assertRaises(RuntimeError):
+            executor.submit(len, ())
+        # the workers are started again if the simulation goes on
+        simulator.next_state()
+        simulator.close()
+
+        simulator = self.make_pairs(2)
+        simulator.next_state()
+        executor = simulator.pool.executor
+        del simulator
+        gc.collect()
+        with self.assertRaises(RuntimeError):
+            executor.submit(len, ())
+
+
+class TestEventSimulator(unittest.TestCase):
+    def setUp(self):
+        random.seed(3)
+        particles = [Particle(i << 1 | (x > 4), x + 0.5, y + 0.5,
+                              random.uniform(-3.0, 3.0),
+                              random.uniform(-3.0, 3.0))
+                     for (i, (x, y)) in enumerate(
+                         (x, y) for x in range(10) for y in range(6)
+                         if x != 4)]
+        self.simulator = make_simulator(EventSimulator,
+                                        barrier_x=4.5,
+                                        barrier_width=0.5,
+                                        particle_r=0.2,
+                                        particles=particles,
+                                        **ELASTIC)
+
+    def energy(self):
+        store = self.simulator.store
+        return (((store.velocity_x ** 2 + store.velocity_y ** 2) / 2).sum() +
+                self.simulator.g * store.pos_y.sum())
+
+    def test_snapshot_times(self):
+        times = [t for (t, particles) in self.simulator.simulate(1.0, 30)]
+        self.assertEqual(len(times), 30)
+        for (i, t) in enumerate(times):
+            self.assertAlmostEqual(t, (i + 1) / 30)
+        self.assertAlmostEqual(self.simulator.time_elapsed, 1.0)
+
+    def test_energy_conserved(self):
+        energy = self.energy()
+        for _ in self.simulator.simulate(2.0, 10):
+            pass
+        self.assertGreater(self.simulator.event_number, len(self.simulator))
+        self.assertAlmostEqual(self.energy() / energy, 1.0, places=6)
+
+    def test_particles_stay_apart(self):
+        simulator = self.simulator
+        for _ in simulator.simulate(2.0, 10):
+            store = simulator.store
+            self.assertTrue(np.all(store.pos_x >= simulator.x_min))
+            self.assertTrue(np.all(store.pos_x <= simulator.x_max))
+            self.assertTrue(np.all(store.pos_y >= simulator.y_min - 1e-9))
+            self.assertTrue(np.all(store.pos_y <= simulator.y_max + 1e-9))
+            d_x = store.pos_x[:, None] - store.pos_x
+            d_y = store.pos_y[:, None] - store.pos_y
+            distance = np.sqrt(d_x ** 2 + d_y ** 2)
+            np.fill_diagonal(distance, np.inf)
+            self.assertGreater(distance.min(),
+                               2 * simulator.particle_r - 1e-9)
+
+    def test_neighbours(self):
+        simulator = self.simulator
+        for _ in simulator.simulate(1.0, 10):
+            store = simulator.store
+            for i in range(len(simulator)):
+                distance = np.hypot(store.pos_x - store.pos_x[i],
+                                    store.pos_y - store.pos_y[i])
+                distance[i] = np.inf
+                close = np.flatnonzero(distance < simulator.cell_size)
+                self.assertTrue(set(close) <=
+                                set(simulator.neighbours(i).tolist()))
+
+    def test_resting_particles(self):
+        # on the floor, below the floor, and falling onto the first one
+        particles = [Particle(0, 1.0, 0.2, 0.0, 0.0),
+                     Particle(2, 3.0, 0.0, 0.5, 0.0),
+                     Particle(4, 1.05, 2.0, 0.0, 0.0)]
+        simulator = make_simulator(EventSimulator,
+                                   barrier_x=6.0,
+                                   barrier_width=0.5,
+                                   particle_r=0.2,
+                                   particles=particles,
+                                   **ELASTIC)
+        self.assertEqual(simulator.resting.tolist(), [True, True, False])
+        for (_, store) in simulator.simulate(2.0, 20):
+            self.assertTrue(np.all(store.pos_y >= simulator.y_min))
+        store = simulator.store
+        # the second particle slides along the floor
+        self.assertEqual(store.pos_y[1], simulator.y_min)
+        self.assertEqual(store.velocity_y[1], 0.0)
+        self.assertAlmostEqual(store.pos_x[1], 4.0)
+        # the falling one bounced off the first one
+        self.assertNotEqual(store.velocity_x[2], 0.0)
+        self.assertGreater(np.hypot(store.pos_x[2] - store.pos_x[0],
+                                    store.pos_y[2] - store.pos_y[0]),
+                           2 * simulator.particle_r - 1e-9)
+
+    def test_simulate_to_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, "events.bin")
+            for _ in self.simulator.simulate_to_file(file_path, 1.0, 20):
+                pass
+            playback = Playback(file_path)
+            playback.set_state(len(playback) - 1)
+            self.assertEqual(len(playback), 21)
+            self.assertEqual(playback.simulator.particles,
+                             self.simulator.particles)
+            del playback
+
+
+class TestRecording(unittest.TestCase):
+    arguments = {'particle_r': 0.2, 'n_left': 20, 'n_right': 30,
+                 'v_init': 3.0, 'engine': 'numpy'}
+
+    def setUp(self):
+        random.seed(5)
+        self.simulator = make_simulator(**self.arguments)
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def record(self, name, num_seconds=0.5, num_snapshots=20, **kwargs):
+        file_path = self.path(name)
+        for _ in self.simulator.simulate_to_file(file_path, num_seconds,
+                                                 num_snapshots, **kwargs):
+            pass
+        return file_path
+
+    def test_output_format(self):
+        initial = self.simulator.store.copy()
+        simulator = make_simulator(particles=initial.copy(),
+                                   **self.arguments)
+        expected = [struct.pack(Simulator.STRUCT_FORMAT,
+                                simulator.box_width, simulator.box_height,
+                                simulator.delta_v_top,
+                                simulator.delta_v_bottom,
+                                simulator.delta_v_side, simulator.barrier_x,
+                                simulator.barrier_width, simulator.hole_y,
+                                simulator.hole_height, simulator.v_loss,
+                                simulator.particle_r, simulator.g,
+                                len(simulator)),
+                    struct.pack("d", simulator.time_elapsed)]
+        expected.extend(bytes(particle) for particle in simulator.particles)
+        for (time_elapsed, particles) in simulator.simulate(0.5, 20):
+            expected.append(struct.pack("d", time_elapsed))
+            expected.extend(bytes(particle) for particle in particles)
+
+        for flush_interval in (1, 3, 100):
+            self.simulator = make_simulator(particles=initial.copy(),
+                                            **self.arguments)
+            file_path = self.record("flush.bin", flush_interval=flush_interval)
+            with open(file_path, "rb") as f:
+                self.assertEqual(f.read(), b"".join(expected))
+
+    def test_exact_snapshot_times(self):
+        simulator = make_simulator(particles=[Particle(0, 5.0, 5.0, 1.0,
+                                                       2.0)],
+                                   **self.arguments)
+        self.assertGreater(simulator.calculate_time_step(), 0.002)
+        times = []
+        for (t, frame) in simulator.simulate(0.05, 1000):
+            times.append(t)
+            self.assertAlmostEqual(frame.pos_x[0], 5.0 + t)
+            self.assertAlmostEqual(frame.pos_y[0],
+                                   5.0 + 2.0 * t - simulator.g * t ** 2 / 2)
+            self.assertAlmostEqual(frame.velocity_y[0],
+                                   2.0 - simulator.g * t)
+        self.assertEqual(times, [1 / 1000 * k for k in range(1, 51)])
+        self.assertLess(simulator.steps, 50)
+
+    def test_frames(self):
+        frames = []
+        for (time_elapsed, frame) in self.simulator.simulate(0.5, 20):
+            frames.append((frame, frame.data.copy()))
+        self.assertGreater(len(frames), 3)
+        for (frame, data) in frames:
+            np.testing.assert_array_equal(frame.data, data)
+        (frame, _) = frames[0]
+        with self.assertRaises(ValueError):
+            frame[0].pos_x = 1.0
+        with self.assertRaises(ValueError):
+            frame.velocity_y[:] = 0
+        state = self.simulator.state()
+        np.testing.assert_array_equal(state.data, self.simulator.store.data)
+        with self.assertRaises(ValueError):
+            state.id[0] = 1
+        writable = state.copy()
+        writable.pos_x[0] = 1.0
+        self.assertEqual(writable[0].pos_x, 1.0)
+
+    def test_memory_mapped_playback(self):
+        file_path = self.record("playback.bin")
+        playback = Playback(file_path)
+        mapped = Playback(file_path, memory_map=True)
+        self.assertEqual(len(mapped), len(playback))
+        last = len(mapped) - 1
+        self.assertGreater(last, 3)
+
+        frame = mapped.snapshot(2)
+        self.assertFalse(frame['particles'].flags.writeable)
+        self.assertFalse(frame['particles'].flags.owndata)
+
+        for index in (last, 0, 3, 1):
+            playback.set_state(index)
+            mapped.set_state(index)
+            self.assertEqual(mapped.simulator.time_elapsed,
+                             playback.simulator.time_elapsed)
+            self.assertEqual(mapped.simulator.particles,
+                             playback.simulator.particles)
+        with self.assertRaises(ValueError):
+            mapped.set_state(last + 1)
+
+    def assertSameFrames(self, playback, expected, places=None):
+        self.assertEqual(len(playback), len(expected))
+        for index in range(len(expected)):
+            playback.set_state(index)
+            expected.set_state(index)
+            self.assertEqual(playback.simulator.time_elapsed,
+                             expected.simulator.time_elapsed)
+            for (actual, particle) in zip(playback.simulator.particles,
+                                          expected.simulator.particles):
+                if places is None:
+                    self.assertEqual(actual, particle)
+                else:
+                    self.assertEqual(actual.id, particle.id)
+                    self.assertAlmostEqual(actual.pos_x, particle.pos_x,
+                                           places=places)
+                    self.assertAlmostEqual(actual.pos_y, particle.pos_y,
+                                           places=places)
+
+    def test_compressed_recording(self):
+        initial = self.simulator.store.copy()
+        expected = Playback(self.record("v1.bin", num_seconds=1.0))
+        for compression in ('none', 'zlib', 'lzma'):
+            self.simulator = make_simulator(particles=initial.copy(),
+                                            **self.arguments)
+            file_path = self.record("v2.bin", num_seconds=1.0,
+                                    compression=compression,
+                                    flush_interval=4)
+            self.assertSameFrames(Playback(file_path), expected)
+
+        self.simulator = make_simulator(particles=initial.copy(),
+                                        **self.arguments)
+        file_path = self.record("quantised.bin", num_seconds=1.0,
+                                compression='zlib', quantise=True)
+        self.assertSameFrames(Playback(file_path), expected, places=5)
+
+    def test_upgrade_recording(self):
+        source = self.record("v1.bin")
+        destination = self.path("v2.bin")
+        upgrade(source, destination, flush_interval=3)
+        self.assertSameFrames(Playback(destination), Playback(source))
+
+    def test_recording_without_index(self):
+        file_path = self.record("v2.bin", num_seconds=1.0,
+                                compression='zlib', flush_interval=3)
+        complete = Playback(file_path)
+        with open(file_path, "rb") as f:
+            data = f.read()
+        # drop the index and a part of the last chunk
+        with open(self.path("truncated.bin"), "wb") as f:
+            f.write(data[:complete.reader.index['offset'][-1] + 10])
+        truncated = Playback(self.path("truncated.bin"))
+        self.assertEqual(len(truncated), len(complete) -
+                         complete.reader.index['frames'][-1])
+        truncated.set_state(len(truncated) - 1)
+        complete.set_state(len(truncated) - 1)
+        self.assertEqual(truncated.simulator.particles,
+                         complete.simulator.particles)
+
+    def test_delta_encoding(self):
+        initial = self.simulator.store.copy()
+        expected = Playback(self.record("v1.bin", num_seconds=1.0))
+        self.simulator = make_simulator(particles=initial.copy(),
+                                        **self.arguments)
+        playback = Playback(self.record("delta.bin", num_seconds=1.0,
+                                        compression='zlib', delta=True,
+                                        flush_interval=8))
+        self.assertEqual(len(playback), len(expected))
+        for index in range(len(expected)):
+            actual = playback.snapshot(index)
+            frame = expected.snapshot(index)
+            self.assertEqual(actual['time'], frame['time'])
+            particles = np.sort(frame['particles'], order='id')
+            np.testing.assert_array_equal(actual['particles']['id'],
+                                          particles['id'])
+            for column in ('pos_x', 'pos_y', 'velocity_x', 'velocity_y'):
+                np.testing.assert_allclose(actual['particles'][column],
+                                           particles[column], rtol=0,
+                                           atol=0.5e-6 * (1 + 1e-6))
+
+    def test_delta_overflow_starts_chunk(self):
+        file_path = self.path("delta.bin")
+        store = self.simulator.store
+        order = np.argsort(store.id)
+        expected = []
+        with open(file_path, "wb") as f:
+            writer = ChunkedWriter(f, len(self.simulator), flush_interval=8,
+                                   delta=True, quantum=1e-12)
+            writer.write_head(self.simulator)
+            for _ in range(8):
+                writer.write_snapshot(self.simulator.time_elapsed, store)
+                expected.append(store.pos_x[order].copy())
+                store.pos_x[0] += 0.01
+            writer.close()
+        with open(file_path, "rb") as f:
+            reader = open_recording(f)
+            self.assertEqual(list(reader.index['frames']), [1] * 8)
+            for (index, pos_x) in enumerate(expected):
+                np.testing.assert_array_equal(
+                    reader.snapshot(index)['particles']['pos_x'], pos_x)
+
+    def test_delta_widths(self):
+        file_path = self.path("delta.bin")
+        store = self.simulator.store
+        order = np.argsort(store.id)
+        expected = []
+        with open(file_path, "wb") as f:
+            writer = ChunkedWriter(f, len(self.simulator), flush_interval=4,
+                                   delta=True)
+            writer.write_head(self.simulator)
+            for moved in (1e-3, 1e-3, 1e-3, 1e-3, 1.0, 1e-3):
+                writer.write_snapshot(self.simulator.time_elapsed, store)
+                expected.append(store.data[:, order].copy())
+                store.pos_x += moved
+            writer.close()
+        with open(file_path, "rb") as f:
+            reader = open_recording(f)
+            widths = []
+            for (offset, size, _) in reader.index:
+                f.seek(offset)
+                data = decompress(f.read(size), reader.compression)
+                widths.append(struct.unpack_from(
+                    DELTA_WIDTHS_FORMAT, data,
+                    keyframe_dtype(len(self.simulator)).itemsize))
+            self.assertEqual(widths, [(2, 2, 2, 2), (4, 2, 2, 2)])
+            for (index, data) in enumerate(expected):
+                particles = reader.snapshot(index)['particles']
+                for (row, column) in enumerate(FLOAT_COLUMNS):
+                    np.testing.assert_allclose(particles[column], data[row],
+                                               rtol=0, atol=0.5e-6)
+
+    def test_resume_from_checkpoint(self):
+        initial = self.simulator.store.copy()
+        options = [{}, {'compression': 'zlib', 'delta': True,
+                        'flush_interval': 4, 'record_observables': True}]
+        for kwargs in options:
+            self.simulator = make_simulator(particles=initial.copy(),
+                                            **self.arguments)
+            random.seed(11)
+            expected = self.record("expected.bin", checkpoint_interval=5,
+                                   **kwargs)
+            expected_random = random.random()
+            self.assertFalse(os.path.exists(expected + ".checkpoint"))
+
+            self.simulator = make_simulator(particles=initial.copy(),
+                                            **self.arguments)
+            random.seed(11)
+            file_path = self.path("resumed.bin")
+            recording = self.simulator.simulate_to_file(
+                file_path, 0.5, 20, checkpoint_interval=5, **kwargs)
+            for _ in range(7):
+                next(recording)
+            recording.close()
+            random.seed(12)
+            with self.assertRaises(ValueError):
+                for _ in self.simulator.simulate_to_file(
+                        file_path, 1.0, 20, checkpoint_interval=5,
+                        resume=True, **kwargs):
+                    pass
+
+            self.simulator = Simulator.resume(file_path, engine='numpy')
+            for _ in self.simulator.simulate_to_file(
+                    file_path, 0.5, 20, checkpoint_interval=5, resume=True,
+                    **kwargs):
+                pass
+            self.assertEqual(random.random(), expected_random)
+            with open(file_path, "rb") as f, open(expected, "rb") as g:
+                self.assertEqual(f.read(), g.read())
+            if kwargs.get('record_observables'):
+                with open(observables_path(file_path), "rb") as f, \
+                        open(observables_path(expected), "rb") as g:
+                    self.assertEqual(f.read(), g.read())
+            self.assertFalse(os.path.exists(file_path + ".checkpoint"))
+
+    def test_resume_inside_steps(self):
+        # many snapshots fall inside every step
+        initial = self.simulator.store.copy()
+        random.seed(11)
+        expected = self.record("expected.bin", 0.05, 2000,
+                               checkpoint_interval=3)
+        self.assertLess(self.simulator.steps, 10)
+
+        self.simulator = make_simulator(particles=initial.copy(),
+                                        **self.arguments)
+        random.seed(11)
+        file_path = self.path("resumed.bin")
+        recording = self.simulator.simulate_to_file(
+            file_path, 0.05, 2000, checkpoint_interval=3)
+        for _ in range(40):
+            next(recording)
+        recording.close()
+
+        self.simulator = Simulator.resume(file_path, engine='numpy')
+        for _ in self.simulator.simulate_to_file(
+                file_path, 0.05, 2000, checkpoint_interval=3, resume=True):
+            pass
+        with open(file_path, "rb") as f, open(expected, "rb") as g:
+            self.assertEqual(f.read(), g.read())
+
+    def test_resume_checkpoint_inside_step(self):
+        file_path = self.path("resumed.bin")
+        recording = self.simulator.simulate_to_file(
+            file_path, 0.05, 2000, checkpoint_interval=3)
+        for _ in range(40):
+            next(recording)
+        recording.close()
+        # pretend the last snapshot before the checkpoint was not taken
+        checkpoint = load_checkpoint(file_path)
+        checkpoint['snapshots'] -= 1
+        save_checkpoint(file_path, checkpoint)
+
+        self.simulator = Simulator.resume(file_path, engine='numpy')
+        with self.assertRaises(ValueError):
+            for _ in self.simulator.simulate_to_file(
+                    file_path, 0.05, 2000, checkpoint_interval=3,
+                    resume=True):
+                pass
+
+    def test_observables(self):
+        observables = measure(self.simulator, 1.5)
+        store = self.simulator.store
+        self.assertEqual(observables['time'], 1.5)
+        self.assertAlmostEqual(
+            observables['kinetic_energy'],
+            sum(particle.speed() ** 2 / 2
+                for particle in self.simulator.particles))
+        self.assertAlmostEqual(observables['temperature'],
+                               observables['kinetic_energy'] / 50)
+        self.assertEqual(observables['population'].tolist(), [[20, 0],
+                                                              [0, 30]])
+        (expected, edges) = np.histogram(store.pos_y, bins=20,
+                                          density=True)
+        np.testing.assert_allclose(
+            histogram_density(observables['height_counts'],
+                              observables['height_edges']), expected)
+        np.testing.assert_array_equal(observables['height_edges'], edges)
+        self.assertEqual(observables['speed_counts'].sum(), 50)
+
+    def test_recorded_observables(self):
+        file_path = self.path("observables.bin")
+        for _ in self.simulator.simulate_to_file(file_path, 0.5, 20,
+                                                 record_observables=True):
+            pass
+        playback = Playback(file_path)
+        self.assertEqual(len(playback.recorded_observables), len(playback))
+        for index in (0, 3, len(playback) - 1):
+            playback.set_state(index)
+            recorded = playback.observables()
+            computed = measure(playback.simulator,
+                               playback.simulator.time_elapsed)
+            self.assertEqual(recorded.tobytes(), computed.tobytes())
+        os.remove(observables_path(file_path))
+        playback = Playback(file_path)
+        self.assertIsNone(playback.recorded_observables)
+        playback.set_state(3)
+        self.assertEqual(playback.observables()['time'],
+                         playback.simulator.time_elapsed)
+
+    def test_prefetch(self):
+        file_path = self.record("prefetch.bin", num_seconds=1.0)
+        playback = Playback(file_path)
+        prefetcher = FramePrefetcher(Playback(file_path), ahead=4, behind=2)
+        try:
+            for index in (0, 1, 2, 10, 9, 8, 7):
+                prefetcher.seek(index)
+                frame = prefetcher.get(index, timeout=10)
+                playback.set_state(index)
+                store = playback.simulator.store
+                self.assertEqual(frame.time, playback.simulator.time_elapsed)
+                np.testing.assert_array_equal(frame.ids, store.id)
+                buffers = ParticleBuffers(self.simulator.particle_r)
+                buffers.update(store.pos_x, store.pos_y, store.id)
+                np.testing.assert_array_equal(frame.xy, buffers.xy)
+                self.assertEqual(frame.observables.tobytes(),
+                                 playback.observables().tobytes())
+            self.assertEqual(prefetcher.dropped, 0)
+            # scrubbing backwards fills the ring below the cursor
+            for index in (3, 4, 5, 6, 7, 8, 9):
+                self.assertIsNotNone(prefetcher.get(index, timeout=10))
+            self.assertLessEqual(len(prefetcher.frames), 7)
+            prefetcher.seek(len(playback) - 1)
+            self.assertIsNone(prefetcher.get(0))
+            self.assertEqual(prefetcher.dropped, 1)
+        finally:
+            prefetcher.close()
+        self.assertFalse(prefetcher.thread.is_alive())
+
+    def test_follow_recording(self):
+        for (name, memory_map, kwargs) in (
+                ("v1.bin", False, {}),
+                ("mapped.bin", True, {}),
+                ("v2.bin", False, {'compression': 'zlib',
+                                   'flush_interval': 3})):
+            with self.subTest(name):
+                file_path = self.path(name)
+                random.seed(5)
+                generator = make_simulator(**self.arguments).simulate_to_file(
+                    file_path, 1.0, 20, record_observables=True, **kwargs)
+                for _ in range(4):
+                    next(generator)
+                playback = Playback(file_path, memory_map=memory_map)
+                prefetcher = FramePrefetcher(
+                    Playback(file_path, memory_map=memory_map))
+                try:
+                    first = len(playback)
+                    self.assertGreater(first, 0)
+                    for _ in range(6):
+                        next(generator)
+                    self.assertEqual(len(playback), first)
+                    length = playback.refresh()
+                    self.assertGreater(length, first)
+                    self.assertEqual(len(playback.recorded_observables),
+                                     length)
+                    prefetcher.refresh()
+                    prefetcher.seek(length - 1)
+                    frame = prefetcher.get(length - 1, timeout=10)
+                    self.assertIsNotNone(frame)
+
+                    for _ in generator:
+                        pass
+                    length = playback.refresh()
+                    complete = Playback(file_path)
+                    self.assertEqual(length, len(complete))
+                    self.assertEqual(len(playback.recorded_observables),
+                                     length)
+                    for index in range(length):
+                        self.assertEqual(playback.snapshot(index).tobytes(),
+                                         complete.snapshot(index).tobytes())
+                    self.assertEqual(frame.time, float(
+                        complete.snapshot(frame.index)['time']))
+                finally:
+                    prefetcher.close()
+
+    def test_follow_empty_recording(self):
+        file_path = self.path("empty.bin")
+        generator = self.simulator.simulate_to_file(
+            file_path, 1.0, 20, compression='zlib')
+        next(generator)
+        # the head is written, the first chunk is not
+        with self.assertRaises(ValueError):
+            Playback(file_path)
+        generator.close()
+        self.assertEqual(len(Playback(file_path)), 2)
+
+    def test_record_stats(self):
+        with self.assertRaises(ValueError):
+            for _ in self.simulator.simulate_to_file(
+                    self.path("unprofiled.bin"), 0.5, 20, record_stats=True):
+                pass
+        self.simulator.set_profiling(True)
+        self.simulator.next_state()
+        file_path = self.path("profiled.bin")
+        snapshots = sum(1 for _ in self.simulator.simulate_to_file(
+            file_path, 0.5, 20, record_stats=True))
+        lines = read_stats(file_path)
+        self.assertEqual([line['snapshot'] for line in lines],
+                         list(range(1, snapshots + 1)))
+        self.assertEqual(sum(line['steps'] for line in lines),
+                         self.simulator.stats.totals['steps'] - 1)
+        self.assertEqual(self.simulator.stats.totals['steps'],
+                         self.simulator.steps + 1)
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+from particles.simulation import Playback
+from particles.sweep import SUMMARY_FILE, expand_grid, run_sweep
+import csv
+import os
+import tempfile
+import unittest
+
+
+class TestSweep(unittest.TestCase):
+    def test_sweep(self):
+        base = dict(box_width=10.0, box_height=10.0, delta_v_top=0.5,
+                    delta_v_bottom=0.3, delta_v_side=0.3, barrier_x=4.0,
+                    barrier_width=1.0, hole_y=3.0, hole_height=2.0,
+                    particle_r=0.2, n_right=10, v_init=3.0,
+                    engine='numpy')
+        grid = {'v_loss': [0.1, 0.2], 'n_left': [10, 20, -1]}
+        self.assertEqual(expand_grid(grid)[1], {'v_loss': 0.1, 'n_left': 20})
+        with tempfile.TemporaryDirectory() as directory:
+            results = run_sweep(grid, directory, 0.2, 20, base=base,
+                                workers=2)
+            self.assertEqual([result['index'] for result in results],
+                             list(range(6)))
+            for result in results:
+                if result['index'] % 3 == 2:
+                    self.assertTrue(result['error'])
+                    continue
+                self.assertEqual(result['error'], '')
+                playback = Playback(os.path.join(directory, result['file']))
+                self.assertEqual(len(playback), result['snapshots'] + 1)
+                self.assertEqual(len(playback.simulator),
+                                 result['n_left_final'] +
+                                 result['n_right_final'])
+            with open(os.path.join(directory, SUMMARY_FILE)) as f:
+                rows = list(csv.DictReader(f))
+            self.assertEqual(len(rows), 6)
+            self.assertEqual(rows[4]['v_loss'], '0.2')
+            self.assertEqual(rows[4]['n_left'], '20')
+            self.assertEqual(rows[4]['file'], results[4]['file'])